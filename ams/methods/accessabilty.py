@@ -1,14 +1,11 @@
-import os
 import json
 from datetime import datetime
 from typing import Dict, Any
 
-from io import BytesIO
-from PIL import Image
-import pytesseract
-import base64
-
 from ams.settings import SETTINGS
+from ams.methods.ocr import decode_image, ocr_image, _set_tesseract_cmd
+from ams.methods.log_sink import getLogSink, log_files
+from ams.methods.metrics import getMetrics
 
 # ############## [ END IMPORTS ] ##############
 
@@ -17,9 +14,9 @@ def trackAPICalls(method: str, resp_data: Dict[str, Any], usage_info: Dict[str,
 	"""
 	Logs API call metadata, usage information, and response data to a daily log file.
 
-	This function creates a JSON Lines (`.jsonl`) file named by the current date
-	in a predefined log directory (`SETTINGS.KB_API_LOG_PATH`) and appends one
-	record per API call.
+	The record is queued for the background `LogSink`, which appends it to a JSON Lines
+	(`.jsonl`) file named by the current date in `SETTINGS.KB_API_LOG_PATH`
+	(continued in `api_log_<date>.1.jsonl`, ... once a file gets too big).
 
 	Parameters:
 		method (str): Name or identifier of the API method invoked.
@@ -30,13 +27,6 @@ def trackAPICalls(method: str, resp_data: Dict[str, Any], usage_info: Dict[str,
 		None
 	"""
 
-	# Ensure the log directory exists
-	os.makedirs(SETTINGS.KB_API_LOG_PATH, exist_ok=True)
-
-	# Log file with today's date
-	today_str = datetime.now().strftime('%Y-%m-%d')
-	log_file = os.path.join(SETTINGS.KB_API_LOG_PATH, f"api_log_{today_str}.jsonl")
-
 	# Create JSONL record
 	record = {
 		"timestamp": datetime.now().isoformat(),
@@ -45,9 +35,10 @@ def trackAPICalls(method: str, resp_data: Dict[str, Any], usage_info: Dict[str,
 		"response_data": resp_data
 	}
 
-	# Append to the log file
-	with open(log_file, "a", encoding="utf-8") as f:
-		f.write(json.dumps(record) + "\n")
+	getLogSink().put(SETTINGS.KB_API_LOG_PATH, "api_log", record)
+
+	getMetrics().inc("tds_api_calls_total", method=method)
+	getMetrics().inc("tds_tokens_total", usage_info.get("total_tokens", 0) or 0, method=method)
 
 def print_api_logs_if_debug(date: str = None) -> None:
 	"""
@@ -67,16 +58,24 @@ def print_api_logs_if_debug(date: str = None) -> None:
 		return
 
 	log_date = date or datetime.now().strftime('%Y-%m-%d')
-	log_file = os.path.join(SETTINGS.KB_API_LOG_PATH, f"api_log_{log_date}.jsonl")
 
-	if not os.path.exists(log_file):
+	# Records still queued in the log sink belong to the view too
+	getLogSink().flush()
+	log_files_of_date = log_files(SETTINGS.KB_API_LOG_PATH, "api_log", log_date)
+
+	if not log_files_of_date:
 		print(f"[Log Viewer] No log file found for date: {log_date}")
 		return
 
-	print(f"\n[Log Viewer] Showing logs from {log_file}:\n")
+	i = 0
+	for log_file in log_files_of_date:
+		print(f"\n[Log Viewer] Showing logs from {log_file}:\n")
+
+		with open(log_file, "r", encoding="utf-8") as f:
+			lines = f.readlines()
 
-	with open(log_file, "r", encoding="utf-8") as f:
-		for i, line in enumerate(f, start=1):
+		for line in lines:
+			i += 1
 			try:
 				record = json.loads(line)
 
@@ -99,8 +98,9 @@ def extract_text_from_base64_image(base64_str: str) -> str:
 	"""
 	Extracts text content from a base64-encoded image using Tesseract OCR.
 
-	The function decodes the image, ensures it's in a compatible format,
-	and applies OCR to return the extracted string.
+	The function decodes the image, converts it to a downscaled grayscale image
+	and applies OCR to return the extracted string. It runs in the calling process;
+	the API goes through the pooled `ams.methods.ocr.OCRService` instead.
 
 	Parameters:
 		base64_str (str): The base64-encoded image content.
@@ -108,19 +108,15 @@ def extract_text_from_base64_image(base64_str: str) -> str:
 	Returns:
 		str: The text extracted from the image. Returns an empty string if OCR fails.
 	"""
-	
-	pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
-	try:
-		image_data = base64.b64decode(base64_str)
-		image = Image.open(BytesIO(image_data))
+	_set_tesseract_cmd(SETTINGS.TESSERACT_CMD)
 
-		# Ensure the image is in a Tesseract-compatible format (RGB)
-		if image.mode not in ("RGB", "L"):
-			image = image.convert("RGB")
+	try:
+		image_data = decode_image(base64_str)
+		if not image_data:
+			return ""
 
-		text = pytesseract.image_to_string(image).strip()
-		return text
+		return ocr_image(image_data)
 
 	except Exception as e:
 		print(f"[OCR Error] {e}")
@@ -130,8 +126,10 @@ def save_question_data(question: str, image_base64: str = None) -> None:
 	"""
 	Saves a question and optional image (in base64) to a log file for record-keeping.
 
-	Each entry is appended to a JSON Lines file with a timestamp. The output path
-	is defined by `SETTINGS.QUESTION_LOG_PATH`.
+	Each entry is queued for the background `LogSink` and appended to a daily JSON Lines
+	file (`qa_data_<date>.jsonl`) with a timestamp. The output path is defined by
+	`SETTINGS.QUESTION_LOG_PATH`. The image is stored once per content hash in
+	`SETTINGS.QUESTION_IMAGE_PATH`, the entry only keeps its `image_sha256`.
 
 	Parameters:
 		question (str): The question text to log.
@@ -141,23 +139,16 @@ def save_question_data(question: str, image_base64: str = None) -> None:
 		None
 	"""
 
-	os.makedirs(SETTINGS.QUESTION_LOG_PATH, exist_ok=True)
-
 	try:
 		record = {
 			"timestamp": datetime.utcnow().isoformat(),
 			"question": question.strip()
 		}
 
-		if image_base64:
-			record["image_base64"] = image_base64.strip()
-
-		with open(os.path.join(SETTINGS.QUESTION_LOG_PATH, 'qa_data.jsonl'), "a", encoding="utf-8") as f:
-			f.write(json.dumps(record) + "\n")
+		getLogSink().put(SETTINGS.QUESTION_LOG_PATH, "qa_data", record, image=image_base64)
 
 		if SETTINGS.DEBUG:
-			print(f"--------- [QuestionLog Saved] ---------\n\n")
+			print("--------- [QuestionLog Queued] ---------\n\n")
 
 	except Exception as e:
 		print(f"[QuestionLog Error] {e}")
-
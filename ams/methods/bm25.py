@@ -0,0 +1,220 @@
+"""
+Lexical (BM25) index over the KB rows, fused with the vector results in `api.searchKB`.
+
+Dense retrieval tends to miss questions that hinge on exact identifiers (`gpt-4o-mini`,
+`uv`, `GA5`), which BM25 finds easily. The index is built from the `title` and `text`
+of the rows of a KB index build (`metadata.json`), so its row numbers are the `doc_<i>`
+ids of the vector backends, and is saved next to it (`bm25.npz`, `bm25_vocab.json`) on
+first use, so that it is built once per KB version and shared by every worker.
+
+Postings are kept as CSR arrays (term -> rows, term frequencies), a query only touches
+the postings of its own terms.
+"""
+
+import os
+import re
+import json
+from collections import Counter
+
+import numpy as np
+
+from ..settings import SETTINGS
+
+# ############## [ END IMPORTS ] ##############
+
+
+TOKEN		=	re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+SEPARATORS	=	re.compile(r"[-_.]")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it its me my no not of on or our
+so that the their them then there these they this to was we what when where which who why will with you your
+""".split())
+
+BM25_INDEX = None
+
+
+def tokenize(text: str) -> list[str]:
+	"""
+	Lowercased terms of `text`. Identifiers such as `gpt-4o-mini` or `3.11` are kept whole
+	and also split into their parts, so both spellings match.
+	"""
+
+	tokens = []
+
+	for token in TOKEN.findall(text.lower()):
+		if token not in STOPWORDS:
+			tokens.append(token)
+
+		if SEPARATORS.search(token):
+			tokens.extend(part for part in SEPARATORS.split(token) if part and part not in STOPWORDS)
+
+	return tokens
+
+
+class BM25Index:
+	"""
+	Okapi BM25 over a fixed list of documents.
+
+	Attributes:
+		vocab (dict[str, int]): Term -> term id.
+		indptr (np.ndarray): Postings of term `t` are `doc_ids[indptr[t]:indptr[t + 1]]`.
+		doc_ids (np.ndarray): Row of every posting.
+		tfs (np.ndarray): Term frequency of every posting.
+		doc_len (np.ndarray): Number of terms of every row.
+	"""
+
+	def __init__(self, vocab: dict[str, int], indptr: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray, doc_len: np.ndarray, k1: float = SETTINGS.BM25_K1, b: float = SETTINGS.BM25_B) -> None:
+		self.vocab		=	vocab
+		self.indptr		=	indptr
+		self.doc_ids	=	doc_ids
+		self.tfs		=	tfs.astype(np.float32)
+		self.doc_len	=	doc_len.astype(np.float32)
+		self.k1			=	k1
+		self.b			=	b
+
+		rows	=	len(doc_len)
+		df		=	np.diff(indptr).astype(np.float32)
+
+		self.idf		=	np.log1p((rows - df + 0.5) / (df + 0.5))
+		self.avgdl		=	float(self.doc_len.mean()) if rows else 0.0
+
+		# Length normalisation of every row, computed once instead of per query
+		self._norm		=	k1 * (1 - b + b * self.doc_len / (self.avgdl or 1.0))
+
+	@classmethod
+	def build(cls, texts) -> 'BM25Index':
+		vocab		:	dict[str, int]	=	{}
+		terms, docs, freqs, doc_len = [], [], [], []
+
+		for row, text in enumerate(texts):
+			counts = Counter(tokenize(text))
+			doc_len.append(sum(counts.values()))
+
+			for term, tf in counts.items():
+				terms.append(vocab.setdefault(term, len(vocab)))
+				docs.append(row)
+				freqs.append(tf)
+
+		terms	=	np.asarray(terms, dtype=np.int32)
+		order	=	np.argsort(terms, kind='stable')
+		indptr	=	np.zeros(len(vocab) + 1, dtype=np.int64)
+		np.cumsum(np.bincount(terms, minlength=len(vocab)), out=indptr[1:])
+
+		return cls(
+			vocab
+			, indptr
+			, np.asarray(docs, dtype=np.int32)[order]
+			, np.asarray(freqs, dtype=np.int32)[order]
+			, np.asarray(doc_len, dtype=np.int32)
+		)
+
+	def save(self, directory: str) -> None:
+		tmp_npz = os.path.join(directory, f"bm25.tmp-{os.getpid()}.npz")
+		tmp_vocab = os.path.join(directory, f"bm25_vocab.json.tmp-{os.getpid()}")
+
+		np.savez(tmp_npz, indptr=self.indptr, doc_ids=self.doc_ids, tfs=self.tfs.astype(np.int32), doc_len=self.doc_len.astype(np.int32))
+		with open(tmp_vocab, 'w', encoding='utf-8') as f:
+			json.dump(sorted(self.vocab, key=self.vocab.get), f, ensure_ascii=False)
+
+		os.replace(tmp_vocab, os.path.join(directory, 'bm25_vocab.json'))
+		os.replace(tmp_npz, os.path.join(directory, 'bm25.npz'))
+
+	@classmethod
+	def load(cls, directory: str) -> 'BM25Index':
+		with open(os.path.join(directory, 'bm25_vocab.json'), 'r', encoding='utf-8') as f:
+			vocab = {term: i for i, term in enumerate(json.load(f))}
+
+		with np.load(os.path.join(directory, 'bm25.npz')) as data:
+			return cls(vocab, data['indptr'], data['doc_ids'], data['tfs'], data['doc_len'])
+
+	def query(self, text: str, n_results: int = 10) -> tuple[list[int], list[float]]:
+		"""
+		Best matching rows for a query text.
+
+		Parameters:
+			text (str): The query.
+			n_results (int): Most rows to return.
+
+		Returns:
+			tuple[list[int], list[float]]: Rows with a non-zero score and their scores, best first.
+		"""
+
+		scores = np.zeros(len(self.doc_len), dtype=np.float32)
+
+		for term in set(tokenize(text)):
+			t = self.vocab.get(term)
+			if t is None:
+				continue
+
+			start, end = self.indptr[t], self.indptr[t + 1]
+			rows, tf = self.doc_ids[start:end], self.tfs[start:end]
+			scores[rows] += self.idf[t] * tf * (self.k1 + 1) / (tf + self._norm[rows])
+
+		matched = np.flatnonzero(scores)
+		if len(matched) > n_results:
+			matched = matched[np.argpartition(scores[matched], -n_results)[-n_results:]]
+
+		matched = matched[np.argsort(-scores[matched], kind='stable')]
+
+		return matched.tolist(), scores[matched].tolist()
+
+
+def load_or_build_bm25(build_dir: str) -> BM25Index:
+	"""
+	Loads the BM25 index of a KB index build, building and saving it first if needed.
+	"""
+
+	if os.path.exists(os.path.join(build_dir, 'bm25.npz')) and os.path.exists(os.path.join(build_dir, 'bm25_vocab.json')):
+		return BM25Index.load(build_dir)
+
+	with open(os.path.join(build_dir, 'metadata.json'), 'r', encoding='utf-8') as f:
+		metadatas = json.load(f)
+
+	index = BM25Index.build(f"{meta.get('title') or ''}\n{meta.get('text') or ''}" for meta in metadatas)
+	index.save(build_dir)
+
+	print(f"[BM25] ===============================> Built: {len(index.vocab)} terms over {len(metadatas)} rows.")
+
+	return index
+
+
+def rrf_fuse(rankings: list[list[int]], n_results: int, k: int = SETTINGS.RRF_K) -> list[tuple[int, float]]:
+	"""
+	Reciprocal-rank fusion: every ranking adds `1 / (k + rank)` to the score of each of its rows.
+
+	Parameters:
+		rankings (list[list[int]]): Row numbers, best first, per retriever.
+		n_results (int): Rows to keep.
+		k (int): Damping constant; the usual 60 keeps a single first place from dominating.
+
+	Returns:
+		list[tuple[int, float]]: `(row, score)` of the best fused rows, best first.
+	"""
+
+	scores : dict[int, float] = {}
+
+	for ranking in rankings:
+		for rank, row in enumerate(ranking, start=1):
+			scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank)
+
+	# Ties keep the order of the first ranking (the vector one)
+	return sorted(scores.items(), key=lambda item: -item[1])[:n_results]
+
+
+def initialize_bm25(build_dir: str) -> BM25Index:
+	global BM25_INDEX
+
+	BM25_INDEX = load_or_build_bm25(build_dir)
+	return BM25_INDEX
+
+
+def getBM25() -> BM25Index | None:
+	"""
+	Function to get the BM25 index of the served KB
+
+	Returns
+		`BM25Index` or `None` when hybrid search is off
+	"""
+
+	return BM25_INDEX
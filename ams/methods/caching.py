@@ -0,0 +1,600 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from ..settings import SETTINGS
+from .metrics import getMetrics
+
+# ############## [ END IMPORTS ] ##############
+
+
+class LRUCache:
+	"""
+	Thread-safe, bounded in-memory LRU cache with an optional time-to-live.
+
+	Attributes:
+		maxsize (int): Maximum number of entries kept; the least recently used is evicted first.
+		ttl (float | None): Seconds an entry stays valid, `None` for no expiry.
+		hits (int): Number of successful lookups.
+		misses (int): Number of lookups that found nothing (or an expired entry).
+	"""
+
+	def __init__(self, maxsize: int, ttl: Optional[float] = None) -> None:
+		self.maxsize	=	maxsize
+		self.ttl		=	ttl
+		self.hits		=	0
+		self.misses		=	0
+
+		self._data		:	OrderedDict[str, tuple[float, Any]]	=	OrderedDict()
+		self._lock		=	threading.Lock()
+
+	def get(self, key: str) -> Any:
+		with self._lock:
+			entry = self._data.get(key)
+
+			if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+				del self._data[key]
+				entry = None
+
+			if entry is None:
+				self.misses += 1
+				return None
+
+			self._data.move_to_end(key)
+			self.hits += 1
+			return entry[1]
+
+	def set(self, key: str, value: Any) -> None:
+		if self.maxsize <= 0:
+			return
+
+		with self._lock:
+			self._data[key] = (time.time(), value)
+			self._data.move_to_end(key)
+
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def pop(self, key: str) -> Any:
+		with self._lock:
+			entry = self._data.pop(key, None)
+			return None if entry is None else entry[1]
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+	def stats(self) -> dict:
+		return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class SQLiteKVStore:
+	"""
+	Small persistent key/value tier on top of SQLite (WAL mode, so several workers can share it).
+
+	Values are stored as BLOBs; encoding and decoding is left to the caller.
+	"""
+
+	def __init__(self, path: str, ttl: Optional[float] = None) -> None:
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+		self.path	=	path
+		self.ttl	=	ttl
+		self._lock	=	threading.Lock()
+		self._conn	=	sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+
+		with self._lock:
+			self._conn.execute("PRAGMA journal_mode=WAL")
+			self._conn.execute("PRAGMA synchronous=NORMAL")
+			self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, created_at REAL NOT NULL)")
+			self._conn.commit()
+
+	def get(self, key: str) -> Optional[bytes]:
+		with self._lock:
+			row = self._conn.execute("SELECT value, created_at FROM kv WHERE key = ?", (key,)).fetchone()
+
+		if row is None:
+			return None
+
+		if self.ttl is not None and time.time() - row[1] > self.ttl:
+			self.delete(key)
+			return None
+
+		return row[0]
+
+	def set(self, key: str, value: bytes) -> None:
+		with self._lock:
+			self._conn.execute("INSERT OR REPLACE INTO kv (key, value, created_at) VALUES (?, ?, ?)", (key, value, time.time()))
+			self._conn.commit()
+
+	def delete(self, key: str) -> None:
+		with self._lock:
+			self._conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+			self._conn.commit()
+
+	def get_many(self, keys: list[str]) -> dict[str, bytes]:
+		found = {}
+		oldest = None if self.ttl is None else time.time() - self.ttl
+
+		with self._lock:
+			for start in range(0, len(keys), 500):
+				chunk = keys[start:start + 500]
+				rows = self._conn.execute(f"SELECT key, value, created_at FROM kv WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+				found.update((key, value) for key, value, created_at in rows if oldest is None or created_at >= oldest)
+
+		return found
+
+	def set_many(self, items: dict[str, bytes]) -> None:
+		"""
+		Writes all items in one transaction, so a batch is either fully stored or not at all.
+		"""
+
+		now = time.time()
+		with self._lock, self._conn:
+			self._conn.executemany("INSERT OR REPLACE INTO kv (key, value, created_at) VALUES (?, ?, ?)", [(k, v, now) for k, v in items.items()])
+
+	def keys(self) -> frozenset[str]:
+		with self._lock:
+			return frozenset(row[0] for row in self._conn.execute("SELECT key FROM kv"))
+
+	def delete_many(self, keys: list[str]) -> None:
+		with self._lock, self._conn:
+			self._conn.executemany("DELETE FROM kv WHERE key = ?", [(k,) for k in keys])
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
+
+
+class TieredCache:
+	"""
+	In-memory LRU in front of an optional persistent `SQLiteKVStore`.
+
+	A disk hit is promoted into memory. `encode`/`decode` convert values to and from
+	the bytes kept on disk.
+
+	`get`/`set` query SQLite in the calling thread. The request path uses `aget_many` /
+	`aset_many` instead: reads run in a worker thread, and writes are queued and stored
+	write-behind, in one transaction per batch, off the event loop.
+	"""
+
+	def __init__(
+		self
+		, memory		:	LRUCache
+		, disk			:	Optional[SQLiteKVStore]		=	None
+		, encode		:	Callable[[Any], bytes]		=	lambda v: v
+		, decode		:	Callable[[bytes], Any]		=	lambda b: b
+	) -> None:
+		self.memory		=	memory
+		self.disk		=	disk
+		self.encode		=	encode
+		self.decode		=	decode
+
+		self.hits		=	0
+		self.disk_hits	=	0
+		self.misses		=	0
+
+		# Encoded values waiting for the write-behind task
+		self._pending	:	dict[str, bytes]			=	{}
+		self._writer	:	asyncio.Task | None			=	None
+
+	def get(self, key: str) -> Any:
+		value = self.memory.get(key)
+		if value is not None:
+			self.hits += 1
+			return value
+
+		if self.disk is not None:
+			try:
+				blob = self.disk.get(key)
+			except sqlite3.Error as e:
+				print(f"[Cache Error] {e}")
+				blob = None
+
+			if blob is not None:
+				value = self.decode(blob)
+				self.memory.set(key, value)
+				self.hits += 1
+				self.disk_hits += 1
+				return value
+
+		self.misses += 1
+		return None
+
+	def set(self, key: str, value: Any) -> None:
+		self.memory.set(key, value)
+
+		if self.disk is not None:
+			try:
+				self.disk.set(key, self.encode(value))
+			except sqlite3.Error as e:
+				print(f"[Cache Error] {e}")
+
+	async def aget_many(self, keys: list[str]) -> list[Any]:
+		"""
+		Looks up many keys at once, the memory misses with a single disk query in a worker thread
+
+		Parameters
+			`keys: list[str]` cache keys
+
+		Returns
+			`list[Any]` one value per key, in order, `None` on a miss
+		"""
+
+		values = [self.memory.get(key) for key in keys]
+		missing = [key for key, value in zip(keys, values) if value is None]
+
+		blobs = {}
+		if missing and self.disk is not None:
+			blobs = {key: self._pending[key] for key in missing if key in self._pending}
+			unread = [key for key in dict.fromkeys(missing) if key not in blobs]
+
+			if unread:
+				try:
+					blobs.update(await asyncio.to_thread(self.disk.get_many, unread))
+				except sqlite3.Error as e:
+					print(f"[Cache Error] {e}")
+
+		decoded = {}
+		for i, key in enumerate(keys):
+			if values[i] is not None:
+				self.hits += 1
+
+			elif key in blobs:
+				if key not in decoded:
+					decoded[key] = self.decode(blobs[key])
+					self.memory.set(key, decoded[key])
+
+				values[i] = decoded[key]
+				self.hits += 1
+				self.disk_hits += 1
+
+			else:
+				self.misses += 1
+
+		return values
+
+	async def aget(self, key: str) -> Any:
+		return (await self.aget_many([key]))[0]
+
+	async def aset_many(self, items: dict[str, Any]) -> None:
+		"""
+		Stores many values: in memory straight away, on disk by the write-behind task
+		"""
+
+		for key, value in items.items():
+			self.memory.set(key, value)
+
+		if self.disk is None or not items:
+			return
+
+		self._pending.update((key, self.encode(value)) for key, value in items.items())
+
+		if self._writer is None:
+			self._writer = asyncio.get_running_loop().create_task(self._write_behind())
+
+	async def aset(self, key: str, value: Any) -> None:
+		await self.aset_many({key: value})
+
+	async def _write_behind(self) -> None:
+		# Whatever was queued while a batch was being written goes in the next one
+		try:
+			while self._pending:
+				batch, self._pending = self._pending, {}
+
+				try:
+					await asyncio.to_thread(self.disk.set_many, batch)
+				except sqlite3.Error as e:
+					print(f"[Cache Error] {e}")
+		finally:
+			self._writer = None
+
+	async def flush(self) -> None:
+		"""
+		Waits until the queued values are on disk.
+		"""
+
+		while self._writer is not None:
+			await asyncio.shield(self._writer)
+
+	def stats(self) -> dict:
+		lookups = self.hits + self.misses
+		return {
+			"size": len(self.memory)
+			, "hits": self.hits
+			, "disk_hits": self.disk_hits
+			, "misses": self.misses
+			, "hit_ratio": (self.hits / lookups) if lookups else 0.0
+		}
+
+
+def normalize_question(text: str) -> str:
+	"""
+	Canonical form of a question used for cache keys: NFKC, case-folded, whitespace collapsed.
+	"""
+
+	return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def cache_key(*parts: str) -> str:
+	return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def encode_embedding(embedding: list[float]) -> bytes:
+	return array('f', embedding).tobytes()
+
+
+def decode_embedding(blob: bytes) -> list[float]:
+	values = array('f')
+	values.frombytes(blob)
+	return values.tolist()
+
+
+EMBEDDING_CACHE : TieredCache | None = None
+
+
+def getEmbeddingCache() -> TieredCache:
+	"""
+	Function to get the question-embedding cache, creating it on first use
+
+	Returns
+		`TieredCache` of `normalized question -> embedding`
+	"""
+
+	global EMBEDDING_CACHE
+
+	if EMBEDDING_CACHE is None:
+		EMBEDDING_CACHE = TieredCache(
+			memory	=	LRUCache(SETTINGS.EMBED_CACHE_SIZE, SETTINGS.EMBED_CACHE_TTL)
+			, disk	=	SQLiteKVStore(SETTINGS.EMBED_CACHE_DB, SETTINGS.EMBED_CACHE_TTL) if SETTINGS.EMBED_CACHE_DB else None
+			, encode=	encode_embedding
+			, decode=	decode_embedding
+		)
+
+	return EMBEDDING_CACHE
+
+
+OCR_CACHE : TieredCache | None = None
+
+
+def getOCRCache() -> TieredCache:
+	"""
+	Function to get the OCR result cache, creating it on first use
+
+	Returns
+		`TieredCache` of `image content hash -> cleaned OCR text` (empty when the image has no usable text)
+	"""
+
+	global OCR_CACHE
+
+	if OCR_CACHE is None:
+		OCR_CACHE = TieredCache(
+			memory	=	LRUCache(SETTINGS.OCR_CACHE_SIZE, SETTINGS.OCR_CACHE_TTL)
+			, disk	=	SQLiteKVStore(SETTINGS.OCR_CACHE_DB, SETTINGS.OCR_CACHE_TTL) if SETTINGS.OCR_CACHE_DB else None
+			, encode=	lambda text: text.encode('utf-8')
+			, decode=	lambda blob: blob.decode('utf-8')
+		)
+
+	return OCR_CACHE
+
+
+class SemanticAnswerCache:
+	"""
+	Answer cache keyed by question embedding rather than by exact text.
+
+	A stored answer is reused when a new question's embedding is within the cosine
+	similarity threshold of a cached one, the KB search returned the same set of sources
+	and the KB version is unchanged. Entries of an older KB version are dropped once an
+	answer for a newer version is stored, and the least recently used entry is evicted
+	when the cache is full.
+
+	Attributes:
+		maxsize (int): Maximum number of cached answers.
+		min_similarity (float): Cosine similarity required for a hit.
+		ttl (float | None): Seconds an answer stays valid, `None` for no expiry.
+		saved_tokens (int): Upstream tokens not spent thanks to cache hits.
+	"""
+
+	def __init__(self, maxsize: int, min_similarity: float, ttl: Optional[float] = None) -> None:
+		self.maxsize		=	maxsize
+		self.min_similarity	=	min_similarity
+		self.ttl			=	ttl
+
+		self.hits			=	0
+		self.misses			=	0
+		self.saved_tokens	=	0
+
+		# Unit vectors live in a fixed (maxsize, dim) matrix; `_entries` maps slot -> entry in LRU order
+		self._vectors		:	np.ndarray | None		=	None
+		self._used			:	np.ndarray				=	np.zeros(max(maxsize, 0), dtype=bool)
+		self._entries		:	OrderedDict[int, dict]	=	OrderedDict()
+		self._lock			=	threading.Lock()
+
+	@staticmethod
+	def _unit(embedding: list[float]) -> np.ndarray:
+		vec = np.asarray(embedding, dtype=np.float32)
+		norm = float(np.linalg.norm(vec))
+		return vec / norm if norm > 0 else vec
+
+	def _evict(self, slot: int) -> None:
+		self._entries.pop(slot, None)
+		self._used[slot] = False
+
+	def lookup(self, embedding: list[float], source_ids: list[str], kb_version: str) -> dict | None:
+		"""
+		Finds a cached answer for a near-duplicate question.
+
+		Parameters:
+			embedding (list[float]): Embedding of the new question.
+			source_ids (list[str]): Ids of the KB rows retrieved for it.
+			kb_version (str): Version of the KB the sources were retrieved from.
+
+		Returns:
+			dict | None: The cached `{answer, links, tokens, similarity}` or None on a miss.
+		"""
+
+		with self._lock:
+			if self._vectors is None or not self._entries:
+				self.misses += 1
+				return None
+
+			vec = self._unit(embedding)
+			if vec.shape[0] != self._vectors.shape[1]:
+				self.misses += 1
+				return None
+
+			sims = self._vectors @ vec
+			sims[~self._used] = -np.inf
+
+			sources = frozenset(source_ids)
+			now = time.time()
+
+			candidates = np.flatnonzero(sims >= self.min_similarity)
+
+			for slot in candidates[np.argsort(-sims[candidates])]:
+				slot = int(slot)
+				entry = self._entries[slot]
+
+				if entry['kb_version'] != kb_version or (self.ttl is not None and now - entry['created_at'] > self.ttl):
+					self._evict(slot)
+					continue
+
+				if entry['sources'] != sources:
+					continue
+
+				self._entries.move_to_end(slot)
+				self.hits += 1
+				self.saved_tokens += entry['tokens']
+
+				return {'answer': entry['answer'], 'links': entry['links'], 'tokens': entry['tokens'], 'similarity': float(sims[slot])}
+
+			self.misses += 1
+			return None
+
+	def store(self, embedding: list[float], source_ids: list[str], kb_version: str, answer: str, links: list[dict], tokens: int = 0) -> None:
+		if self.maxsize <= 0:
+			return
+
+		with self._lock:
+			vec = self._unit(embedding)
+
+			if self._vectors is None or self._vectors.shape[1] != vec.shape[0]:
+				self._vectors = np.zeros((self.maxsize, vec.shape[0]), dtype=np.float32)
+				self._used[:] = False
+				self._entries.clear()
+
+			# A rebuilt KB makes every older answer stale
+			for stale in [slot for slot, entry in self._entries.items() if entry['kb_version'] != kb_version]:
+				self._evict(stale)
+
+			free = np.flatnonzero(~self._used)
+			if free.size:
+				slot = int(free[0])
+			else:
+				slot = next(iter(self._entries))
+				self._evict(slot)
+
+			self._vectors[slot] = vec
+			self._used[slot] = True
+			self._entries[slot] = {
+				'sources': frozenset(source_ids)
+				, 'kb_version': kb_version
+				, 'answer': answer
+				, 'links': links
+				, 'tokens': int(tokens or 0)
+				, 'created_at': time.time()
+			}
+
+	def invalidate(self, keep_version: Optional[str] = None) -> int:
+		"""
+		Drops every entry, or only those not built on `keep_version`; returns how many were dropped.
+		"""
+
+		with self._lock:
+			stale = [slot for slot, entry in self._entries.items() if keep_version is None or entry['kb_version'] != keep_version]
+			for slot in stale:
+				self._evict(slot)
+
+			return len(stale)
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	def stats(self) -> dict:
+		lookups = self.hits + self.misses
+		return {
+			"size": len(self._entries)
+			, "hits": self.hits
+			, "misses": self.misses
+			, "hit_ratio": (self.hits / lookups) if lookups else 0.0
+			, "saved_tokens": self.saved_tokens
+		}
+
+
+ANSWER_CACHE : SemanticAnswerCache | None = None
+
+
+def getAnswerCache() -> SemanticAnswerCache:
+	"""
+	Function to get the semantic answer cache, creating it on first use
+
+	Returns
+		`SemanticAnswerCache` shared by the `/api/ask` routes
+	"""
+
+	global ANSWER_CACHE
+
+	if ANSWER_CACHE is None:
+		ANSWER_CACHE = SemanticAnswerCache(SETTINGS.ANSWER_CACHE_SIZE, SETTINGS.ANSWER_CACHE_MIN_SIMILARITY, SETTINGS.ANSWER_CACHE_TTL)
+
+	return ANSWER_CACHE
+
+
+async def flush_caches() -> None:
+	"""
+	Writes the queued values of the persistent caches to disk; called from `server.lifespan` on shutdown.
+	"""
+
+	for cache in (EMBEDDING_CACHE, OCR_CACHE):
+		if cache is not None:
+			await cache.flush()
+
+
+def cache_metrics() -> list[tuple[str, str, str, dict, float]]:
+	"""
+	Hit ratios and counts of the caches created so far, for `/metrics`.
+	"""
+
+	samples = []
+
+	for name, cache in (("embedding", EMBEDDING_CACHE), ("ocr", OCR_CACHE), ("answer", ANSWER_CACHE)):
+		if cache is None:
+			continue
+
+		stats = cache.stats()
+		samples.extend([
+			("tds_cache_hit_ratio", "gauge", "Share of cache lookups served from the cache.", {"cache": name}, stats["hit_ratio"])
+			, ("tds_cache_hits", "gauge", "Cache hits since start.", {"cache": name}, stats["hits"])
+			, ("tds_cache_misses", "gauge", "Cache misses since start.", {"cache": name}, stats["misses"])
+			, ("tds_cache_size", "gauge", "Entries held in memory by the cache.", {"cache": name}, stats["size"])
+		])
+
+	if ANSWER_CACHE is not None:
+		samples.append(("tds_answer_cache_saved_tokens", "gauge", "LLM tokens not spent thanks to the answer cache.", {}, ANSWER_CACHE.stats()["saved_tokens"]))
+
+	return samples
+
+
+getMetrics().register_collector(cache_metrics)
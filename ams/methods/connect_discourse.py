@@ -4,6 +4,7 @@ References:
 """
 
 import requests
+import httpx
 
 from ..settings import SETTINGS
 
@@ -45,3 +46,28 @@ def verify_session_authentication(_session: requests.Session):
         # print("Authentication failed using browser cookies")
         return False
 
+
+
+def create_async_client_with_browser_cookies(discourse_url, cookies, max_connections=SETTINGS.DISCOURSE_CONCURRENCY * 2):
+    """
+    Create a pooled async client with cookies extracted from browser, for the concurrent scraper
+
+    Parameters:
+        discourse_url (str): Base URL of the IIT Madras Discourse instance
+        cookies (dict): Dictionary of cookie names and values from browser
+        max_connections (int): Upper bound of open connections, shared by every topic
+
+    Returns:
+        httpx.AsyncClient: Client with the Discourse base URL and authentication cookies
+    """
+    return httpx.AsyncClient(
+        base_url=discourse_url,
+        cookies=cookies,
+        headers={"Accept": "application/json"},
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        timeout=httpx.Timeout(SETTINGS.HTTP_READ_TIMEOUT, connect=SETTINGS.HTTP_CONNECT_TIMEOUT),
+    )
+
+async def verify_async_client_authentication(_client: httpx.AsyncClient):
+    response = await _client.get("/session/current.json")
+    return response.status_code == 200
@@ -0,0 +1,114 @@
+import re
+
+from ..settings import SETTINGS
+from .tokens import estimate_tokens
+
+# ############## [ END IMPORTS ] ##############
+
+
+_WORDS = re.compile(r"\w+", re.UNICODE)
+
+_ELLIPSIS = ' ...'
+
+SHINGLE_SIZE = 8
+
+
+def _shingles(text: str) -> set[tuple[str, ...]]:
+	words = [w.lower() for w in _WORDS.findall(text)]
+	if len(words) < SHINGLE_SIZE:
+		return {tuple(words)} if words else set()
+
+	return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+	"""
+	Longest prefix of `text`, cut at a whitespace boundary, that fits in `max_tokens` with the ellipsis appended.
+	"""
+
+	lo, hi = 0, len(text)
+	while lo < hi:
+		mid = (lo + hi + 1) // 2
+		if estimate_tokens(text[:mid] + _ELLIPSIS) <= max_tokens:
+			lo = mid
+		else:
+			hi = mid - 1
+
+	cut = text[:lo]
+	if lo < len(text) and ' ' in cut:
+		cut = cut[:cut.rindex(' ')]
+
+	return cut.rstrip() + _ELLIPSIS
+
+
+def assemble_context(
+	metadatas			:	list[dict]
+	, distances			:	list[float] | None	=	None
+	, budget_tokens		:	int					=	SETTINGS.CONTEXT_TOKEN_BUDGET
+	, max_overlap		:	float				=	SETTINGS.CONTEXT_MAX_OVERLAP
+	, min_tokens		:	int					=	SETTINGS.CONTEXT_MIN_TRUNCATED_TOKENS
+) -> tuple[list[str], dict]:
+	"""
+	Picks the source texts sent to the LLM so that they fit a token budget.
+
+	Sources are taken nearest first (by `distances`). One whose word 8-grams are mostly
+	covered by the already picked ones (exact duplicates, or overlapping passages of the same
+	page) is skipped. When the next source no longer fits, it is truncated to the remaining
+	budget if at least `min_tokens` are left, and everything ranked below it is dropped.
+
+	Parameters:
+		metadatas (list[dict]): Retrieved KB rows, each with a `text`.
+		distances (list[float], optional): Their distances to the question; lower is better.
+		budget_tokens (int): Maximum estimated tokens of all picked texts together.
+		max_overlap (float): Share of a source's 8-grams already picked above which it is a duplicate.
+		min_tokens (int): Smallest truncated source worth sending.
+
+	Returns:
+		tuple[list[str], dict]: The picked texts, best first, and the budget utilisation stats.
+	"""
+
+	order = sorted(range(len(metadatas)), key=lambda i: distances[i]) if distances else list(range(len(metadatas)))
+
+	picked		:	list[str]	=	[]
+	seen		:	set			=	set()
+	used		=	0
+	stats		=	{"candidates": len(metadatas), "kept": 0, "truncated": 0, "duplicates": 0, "over_budget": 0}
+
+	for rank, i in enumerate(order):
+		text = (metadatas[i].get('text') or '').strip()
+		if not text:
+			continue
+
+		shingles = _shingles(text)
+		if shingles and len(shingles & seen) / len(shingles) >= max_overlap:
+			stats["duplicates"] += 1
+			continue
+
+		tokens = estimate_tokens(text)
+		remaining = budget_tokens - used
+
+		if tokens > remaining:
+			truncate = remaining >= max(min_tokens, estimate_tokens(_ELLIPSIS) + 1)
+			if truncate:
+				text = _truncate(text, remaining)
+				tokens = estimate_tokens(text)
+				picked.append(text)
+				used += tokens
+				stats["truncated"] += 1
+				stats["kept"] += 1
+
+			stats["over_budget"] += len(order) - rank - (1 if truncate else 0)
+			break
+
+		picked.append(text)
+		seen |= shingles
+		used += tokens
+		stats["kept"] += 1
+
+	stats.update({
+		"budget_tokens": budget_tokens
+		, "used_tokens": used
+		, "utilisation": round(used / budget_tokens, 3) if budget_tokens else 0.0
+	})
+
+	return picked, stats
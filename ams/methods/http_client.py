@@ -0,0 +1,114 @@
+import random
+
+import httpx
+
+from ..settings import SETTINGS
+
+# ############## [ END IMPORTS ] ##############
+
+
+HTTP_CLIENT : httpx.AsyncClient | None = None
+
+# Statuses worth retrying: rate limits, timeouts and transient server errors
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def retry_delay(attempt: int, response: httpx.Response | None) -> float:
+	"""
+	Seconds to wait before the next attempt: `Retry-After` if the server sent one, else
+	exponential backoff with jitter.
+	"""
+
+	if response is not None:
+		retry_after = response.headers.get("Retry-After")
+		if retry_after:
+			try:
+				return max(0.0, float(retry_after))
+			except ValueError:
+				pass
+
+	return min(60.0, 0.5 * (2 ** attempt)) * (0.5 + random.random())
+
+
+def aipipe_headers() -> dict[str, str]:
+	"""
+	Headers of every AIPIPE request: the bearer token, if one is configured.
+
+	Without a token no `Authorization` header is sent at all (an empty `Bearer ` is not even
+	a valid header value), so a local stand-in still works and AIPIPE answers a plain `401`.
+	"""
+
+	if not SETTINGS.AIPIPE_API_KEY:
+		print("[HTTP] AIPIPE token not configured (`.auth/aipipe.token` or `AIPIPE_API_KEY`), calling AIPIPE without one")
+		return {}
+
+	return {"Authorization": f"Bearer {SETTINGS.AIPIPE_API_KEY}"}
+
+
+def create_http_client() -> httpx.AsyncClient:
+	"""
+	Creates the pooled async HTTP client used for every AIPIPE call.
+
+	Connections are kept alive and reused across requests, so a question no longer
+	pays for a fresh TCP + TLS handshake on each upstream call. Pool size, keep-alive
+	and timeouts are taken from `SETTINGS`.
+
+	Returns:
+		httpx.AsyncClient: A client with the AIPIPE base URL and auth header preset.
+	"""
+
+	return httpx.AsyncClient(
+		base_url	=	SETTINGS.AIPIPE_BASE_URL
+		, headers	=	aipipe_headers()
+		, limits	=	httpx.Limits(
+			max_connections				=	SETTINGS.HTTP_POOL_MAX_CONNECTIONS
+			, max_keepalive_connections	=	SETTINGS.HTTP_POOL_MAX_KEEPALIVE
+			, keepalive_expiry			=	SETTINGS.HTTP_KEEPALIVE_EXPIRY
+		)
+		, timeout	=	httpx.Timeout(
+			SETTINGS.HTTP_READ_TIMEOUT
+			, connect	=	SETTINGS.HTTP_CONNECT_TIMEOUT
+			, pool		=	SETTINGS.HTTP_POOL_TIMEOUT
+		)
+	)
+
+
+async def startup_http_client() -> httpx.AsyncClient:
+	"""
+	Opens the shared client; called from `server.lifespan`.
+	"""
+
+	global HTTP_CLIENT
+
+	if HTTP_CLIENT is None or HTTP_CLIENT.is_closed:
+		HTTP_CLIENT = create_http_client()
+
+	return HTTP_CLIENT
+
+
+async def shutdown_http_client() -> None:
+	"""
+	Closes the shared client and its pooled connections; called from `server.lifespan`.
+	"""
+
+	global HTTP_CLIENT
+
+	if HTTP_CLIENT is not None:
+		await HTTP_CLIENT.aclose()
+		HTTP_CLIENT = None
+
+
+def getHTTPClient() -> httpx.AsyncClient:
+	"""
+	Function to get the shared client, creating it on first use outside of the lifespan
+
+	Returns
+		`httpx.AsyncClient` pooled client
+	"""
+
+	global HTTP_CLIENT
+
+	if HTTP_CLIENT is None or HTTP_CLIENT.is_closed:
+		HTTP_CLIENT = create_http_client()
+
+	return HTTP_CLIENT
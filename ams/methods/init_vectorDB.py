@@ -1,62 +1,347 @@
+"""
+The KB is served from a persistent, read-only index directory (`SETTINGS.KB_INDEX_DIR`)
+built out of `SETTINGS.KB_EMBEDDINGS_DATA_JSON` (JSONL records + `.f32` embeddings, or the
+older JSON array with inline embeddings):
+
+	kb_index/
+		CURRENT.json			<- points to the active build, swapped atomically
+		v<format>-<sha256[:16]>/
+			embeddings.npy		<- float32 (rows x dim) matrix, opened with mmap
+			sq_norms.npy		<- squared L2 norm of each row
+			metadata.json		<- compact list of {title, url, text}
+			manifest.json		<- source files, their size/mtime and content hash
+
+Every worker maps the same files read-only, so the OS page cache holds a single copy,
+and the build only re-runs when the content hash of the source KB files changes. The
+build is then served by the retrieval backend chosen in `SETTINGS.VECTOR_BACKEND`
+(see `retrieval.py`).
+
+Builds are serialized across processes by a lock file in the index directory: the workers
+of a multi-worker server starting together build the index once, the others wait for it
+and only map the files. `prepare_kb_index` builds it ahead of starting the workers.
+"""
+
+import os
 import json
-import chromadb
-from chromadb.config import Settings
+import shutil
+import hashlib
+from array import array
+from datetime import datetime
+from contextlib import contextmanager
+
+import numpy as np
 
 from ..settings import SETTINGS
+from .kb_io import iter_json_records, vectors_path
+from .metrics import span
+from .retrieval import RetrievalBackend, create_backend
+from .bm25 import initialize_bm25, load_or_build_bm25
 
-from chromadb.api.models.Collection import Collection
+try:
+	import fcntl
+except ImportError:		# Windows: builds racing each other stay correct (identical content), only wasteful
+	fcntl = None
 
 # ############## [ END IMPORTS ] ##############
 
 
+INDEX_FORMAT_VERSION = 2
+
 VEC_DB_COLLECTION = None
 
-def initialize_vector_db() -> Collection:
+
+def _source_files(source_path: str) -> list[str]:
+	"""
+	The files a KB source is made of: a `.jsonl` records file comes with its `.f32` embeddings.
 	"""
-	Function to initialize the VectorDB into memory
 
-	Returns
-		`Collection` object of the ChromaDB
+	return [source_path, vectors_path(source_path)] if source_path.endswith('.jsonl') else [source_path]
+
+
+def _source_stat(source_path: str) -> list[list[int]]:
+	return [[os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in _source_files(source_path)]
+
+
+def _file_sha256(source_path: str) -> str:
+	"""
+	Streams the source file(s) through SHA-256 so large KB files are never fully held in memory.
 	"""
 
-	client = chromadb.Client(Settings())
+	digest = hashlib.sha256()
+	for path in _source_files(source_path):
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				digest.update(block)
+
+	return digest.hexdigest()
+
+
+def _iter_source(source_path: str):
+	"""
+	Yields `(metadata, embedding)` per KB row from either source format.
+	"""
+
+	if source_path.endswith('.jsonl'):
+		records = iter_json_records(source_path)
+		first = next(records, None)
+		if first is None:
+			return
+
+		rows = 1 + sum(1 for _ in records)
+		vectors = np.memmap(vectors_path(source_path), dtype=np.float32, mode='r')
+		vectors = vectors.reshape(rows, -1)
+
+		for obj, vec in zip(iter_json_records(source_path), vectors):
+			yield obj['data'], vec
+	else:
+		for obj in iter_json_records(source_path):
+			if obj and obj.get('embeddings'):
+				yield obj['data'], obj['embeddings']
+
+
+def _write_metadata(path: str, metadatas) -> None:
+	"""
+	Writes the compact metadata sidecar as a JSON array, one element at a time.
+	"""
+
+	with open(path, 'w', encoding='utf-8') as f:
+		f.write('[')
+		for i, meta in enumerate(metadatas):
+			f.write((',' if i else '') + json.dumps(meta, ensure_ascii=False, separators=(',', ':')))
+		f.write(']')
 
-	global VEC_DB_COLLECTION
 
+def _read_json(path: str) -> dict | None:
 	try:
-		VEC_DB_COLLECTION = client.get_collection("knowledge_base")
-	except Exception:
-		VEC_DB_COLLECTION = client.create_collection("knowledge_base")
+		with open(path, 'r', encoding='utf-8') as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+
+def _write_json_atomic(path: str, data: dict) -> None:
+	tmp_path = f"{path}.tmp-{os.getpid()}"
+	with open(tmp_path, 'w', encoding='utf-8') as f:
+		json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+	os.replace(tmp_path, path)
+
+
+def _current_build(index_dir: str) -> tuple[str, dict] | tuple[None, None]:
+	"""
+	Resolves `CURRENT.json` into the active build directory and its manifest.
+	"""
+
+	current = _read_json(os.path.join(index_dir, 'CURRENT.json'))
+	if not current:
+		return None, None
+
+	build_dir = os.path.join(index_dir, current['build'])
+	manifest = _read_json(os.path.join(build_dir, 'manifest.json'))
+	if not manifest or manifest.get('format_version') != INDEX_FORMAT_VERSION:
+		return None, None
+
+	return build_dir, manifest
+
+
+def build_kb_index(source_path: str, index_dir: str, source_sha256: str | None = None) -> tuple[str, dict]:
+	"""
+	Builds the on-disk index from the KB embeddings file and makes it the current build.
+
+	The files are written into a fresh build directory first and only then published by
+	atomically replacing `CURRENT.json`, so readers never observe a half-written index.
+
+	Parameters:
+		source_path (str): KB records (`{data: {title, url, text}}` per line + `.f32` sidecar, or a JSON array with inline `embeddings`).
+		index_dir (str): Root directory of the index.
+		source_sha256 (str, optional): Pre-computed content hash of `source_path`.
+
+	Returns:
+		tuple[str, dict]: The build directory and its manifest.
+	"""
+
+	source_sha256 = source_sha256 or _file_sha256(source_path)
+	source_stat = _source_stat(source_path)
+
+	# The format is part of the name: a build of the same source in an older format is not this one
+	build_name = f"v{INDEX_FORMAT_VERSION}-{source_sha256[:16]}"
+	build_dir = os.path.join(index_dir, build_name)
+	tmp_dir = f"{build_dir}.tmp-{os.getpid()}"
+
+	os.makedirs(index_dir, exist_ok=True)
+	shutil.rmtree(tmp_dir, ignore_errors=True)
+	os.makedirs(tmp_dir)
+
+	# Rows are streamed from the source; only the float32 matrix is ever held in memory
+	vectors = array('f')
+	rows, dim = 0, 0
+
+	def metadatas():
+		nonlocal rows, dim
 
+		for data, embedding in _iter_source(source_path):
+			vectors.frombytes(np.asarray(embedding, dtype=np.float32).tobytes())
+			dim = dim or len(embedding)
+			rows += 1
 
-	if len(VEC_DB_COLLECTION.get()["ids"]) > 0:
+			yield {'title': data['title'], 'url': data['url'], 'text': data['text']}
+
+	_write_metadata(os.path.join(tmp_dir, 'metadata.json'), metadatas())
+
+	matrix = np.frombuffer(vectors, dtype=np.float32).reshape(rows, dim)
+
+	np.save(os.path.join(tmp_dir, 'embeddings.npy'), matrix)
+	np.save(os.path.join(tmp_dir, 'sq_norms.npy'), np.einsum('ij,ij->i', matrix, matrix))
+
+	manifest = {
+		'format_version': INDEX_FORMAT_VERSION
+		, 'source': os.path.abspath(source_path)
+		, 'source_stat': source_stat
+		, 'source_sha256': source_sha256
+		, 'rows': rows
+		, 'dim': dim
+		, 'built_at': datetime.now().isoformat()
+	}
+	_write_json_atomic(os.path.join(tmp_dir, 'manifest.json'), manifest)
+
+	# Another process may have published the very same build meanwhile; identical content.
+	# A directory of that name without a valid manifest is what a crashed build left, it is replaced.
+	existing = _read_json(os.path.join(build_dir, 'manifest.json')) if os.path.isdir(build_dir) else None
+	if existing and existing.get('format_version') == INDEX_FORMAT_VERSION:
+		shutil.rmtree(tmp_dir, ignore_errors=True)
+	else:
+		shutil.rmtree(build_dir, ignore_errors=True)
+		os.replace(tmp_dir, build_dir)
+
+	_write_json_atomic(os.path.join(index_dir, 'CURRENT.json'), {'build': build_name})
+
+	# Drop the older builds; workers which still map them keep their open file handles.
+	for name in os.listdir(index_dir):
+		path = os.path.join(index_dir, name)
+		if name != build_name and os.path.isdir(path) and '.tmp-' not in name:
+			shutil.rmtree(path, ignore_errors=True)
+
+	return build_dir, _read_json(os.path.join(build_dir, 'manifest.json'))
+
+
+@contextmanager
+def kb_build_lock(index_dir: str | None = None):
+	"""
+	Holds the inter-process lock of the index directory while building or opening the index.
+	"""
+
+	index_dir = index_dir or SETTINGS.KB_INDEX_DIR
+
+	if fcntl is None:
+		yield
+		return
+
+	os.makedirs(index_dir, exist_ok=True)
+
+	with open(os.path.join(index_dir, '.build.lock'), 'w') as f:
+		fcntl.flock(f, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def ensure_kb_index(source_path: str | None = None, index_dir: str | None = None) -> tuple[str, dict]:
+	"""
+	Returns the current index build, rebuilding it only if the source KB content changed.
+
+	A matching size and mtime is trusted straight away; otherwise the source is hashed and
+	the build is reused as long as the content hash is still the same.
+
+	Parameters:
+		source_path (str, optional): Defaults to `SETTINGS.KB_EMBEDDINGS_DATA_JSON`.
+		index_dir (str, optional): Defaults to `SETTINGS.KB_INDEX_DIR`.
+
+	Returns:
+		tuple[str, dict]: The build directory and its manifest.
+	"""
+
+	source_path = source_path or SETTINGS.KB_EMBEDDINGS_DATA_JSON
+	index_dir = index_dir or SETTINGS.KB_INDEX_DIR
+
+	build_dir, manifest = _current_build(index_dir)
+
+	if not all(os.path.exists(path) for path in _source_files(source_path)):
+		if manifest is None:
+			raise FileNotFoundError(f"No KB index in {index_dir} and no source file {source_path} to build it from")
+
+		# Serving from a shipped index without its source is fine.
+		return build_dir, manifest
+
+	source_stat = _source_stat(source_path)
+	if manifest is not None and manifest['source_stat'] == source_stat:
+		return build_dir, manifest
+
+	source_sha256 = _file_sha256(source_path)
+	if manifest is not None and manifest['source_sha256'] == source_sha256:
+		manifest.update({'source_stat': source_stat})
+		_write_json_atomic(os.path.join(build_dir, 'manifest.json'), manifest)
+		return build_dir, manifest
+
+	print(f"[VectorDB] ===============================> {'Building' if manifest is None else 'Source changed, rebuilding'} index.")
+	with span("kb_index_build"):
+		return build_kb_index(source_path, index_dir, source_sha256)
+
+
+def initialize_vector_db() -> RetrievalBackend:
+	"""
+	Function to initialize the VectorDB into memory
+
+	Returns
+		`RetrievalBackend` serving the persistent on-disk index
+	"""
+
+	global VEC_DB_COLLECTION
+
+	if VEC_DB_COLLECTION is not None:
 		print("[VectorDB] ===============================> Already initialized.")
 		print(f" [VectorDB] --- ROW COUNT: {VEC_DB_COLLECTION.count()}")
 		return VEC_DB_COLLECTION
 
-	f = open(SETTINGS.KB_EMBEDDINGS_DATA_JSON, 'r')
-	embed_json = json.load(f)
-
-	cnt = 0
-	for obj in embed_json:
-		VEC_DB_COLLECTION.add(
-			ids=[f"doc_{cnt}"],
-			embeddings=[obj["embeddings"]],
-			metadatas=[{"title": obj["data"]['title'], 'url': obj["data"]["url"], 'text': obj["data"]["text"]}],
-		)
+	# The first worker in builds what is missing; the others wait for it, then only map the files
+	with kb_build_lock():
+		build_dir, manifest = ensure_kb_index()
+		VEC_DB_COLLECTION = create_backend(build_dir, manifest)
 
-		cnt += 1
+		# The lexical index of hybrid search is built from (and next to) the same build
+		if SETTINGS.SEARCH_HYBRID:
+			initialize_bm25(build_dir)
 
-	print("[VectorDB] ===============================> Loaded into memory.")
-	print(f"[VectorDB] --- ROW COUNT: {VEC_DB_COLLECTION.count()}")
+	print("[VectorDB] ===============================> Mapped into memory.")
+	print(f"[VectorDB] --- ROW COUNT: {VEC_DB_COLLECTION.count()} | VERSION: {VEC_DB_COLLECTION.version[:16]} | BACKEND: {VEC_DB_COLLECTION.name}")
 
 	return VEC_DB_COLLECTION
 
-def getCol() -> Collection:
+def prepare_kb_index() -> str:
+	"""
+	Function to build everything the served KB needs on disk, before the workers of a
+	multi-worker server start: the index, the matrix in the storage type of the backend and
+	the BM25 index. Nothing is kept in memory here.
+
+	Returns
+		`str` the build directory
+	"""
+
+	with kb_build_lock():
+		build_dir, manifest = ensure_kb_index()
+		create_backend(build_dir, manifest)
+
+		if SETTINGS.SEARCH_HYBRID:
+			load_or_build_bm25(build_dir)
+
+	print(f"[VectorDB] ===============================> Prepared {build_dir} for the workers.")
+
+	return build_dir
+
+def getCol() -> RetrievalBackend:
 	"""
 	Function to get the VectorDB vaiable for performaing further operations
 
 	Returns
-		`Collection` object of the ChromaDB
+		`RetrievalBackend` of the mapped KB
 	"""
 	return VEC_DB_COLLECTION
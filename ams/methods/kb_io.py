@@ -0,0 +1,179 @@
+"""
+Streaming record I/O shared by the KB build pipeline.
+
+Records are read one at a time with generators, from either JSON Lines (`.jsonl`) or the
+older pretty-printed JSON arrays, and written as compact JSONL. Embeddings are kept out of
+the JSON entirely: they go to a raw float32 sidecar (`<name>.f32`, row `i` belongs to line
+`i` of the records file), which is ~6x smaller than the pretty-printed floats and can be
+memory-mapped as is.
+"""
+
+import os
+import json
+from array import array
+from typing import Any, Iterable, Iterator
+
+# ############## [ END IMPORTS ] ##############
+
+
+READ_CHUNK = 1 << 16
+
+
+def _iter_json_array(f) -> Iterator[Any]:
+	"""
+	Yields the elements of a top-level JSON array without loading the whole file.
+	"""
+
+	decoder = json.JSONDecoder()
+	buffer = ''
+	eof = False
+	started = False
+
+	while True:
+		# Skip whitespace and the array punctuation between elements
+		i = 0
+		while i < len(buffer) and (buffer[i].isspace() or buffer[i] == ',' or (buffer[i] == '[' and not started)):
+			started = started or buffer[i] == '['
+			i += 1
+		buffer = buffer[i:]
+
+		if buffer.startswith(']'):
+			return
+
+		if buffer:
+			try:
+				obj, end = decoder.raw_decode(buffer)
+			except json.JSONDecodeError:
+				if eof:
+					raise
+			else:
+				# A scalar cut at the chunk border could still be incomplete
+				if end < len(buffer) or eof:
+					yield obj
+					buffer = buffer[end:]
+					continue
+
+		if eof:
+			return
+
+		chunk = f.read(READ_CHUNK)
+		if not chunk:
+			eof = True
+		buffer += chunk
+
+
+def iter_json_records(path: str) -> Iterator[Any]:
+	"""
+	Yields the records of a `.jsonl` file, or the elements of a JSON array file, one by one.
+
+	Parameters:
+		path (str): File to read.
+
+	Returns:
+		Iterator[Any]: The decoded records, in file order.
+	"""
+
+	with open(path, 'r', encoding='utf-8') as f:
+		if path.endswith('.jsonl'):
+			for line in f:
+				line = line.strip()
+				if line:
+					yield json.loads(line)
+		else:
+			yield from _iter_json_array(f)
+
+
+def resolve_records_path(path: str) -> str:
+	"""
+	Returns `path`, or its legacy `.json` twin when only the older array format exists.
+	"""
+
+	if not os.path.exists(path) and path.endswith('.jsonl') and os.path.exists(path[:-1]):
+		return path[:-1]
+
+	return path
+
+
+def write_jsonl(path: str, records: Iterable[Any]) -> int:
+	"""
+	Streams records into a JSONL file; the file is replaced atomically once complete.
+
+	Parameters:
+		path (str): Destination file.
+		records (Iterable[Any]): Records to write, typically a generator.
+
+	Returns:
+		int: Number of records written.
+	"""
+
+	os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+	tmp_path = f"{path}.tmp-{os.getpid()}"
+	count = 0
+
+	with open(tmp_path, 'w', encoding='utf-8') as f:
+		for record in records:
+			f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+			count += 1
+
+	os.replace(tmp_path, path)
+	return count
+
+
+def vectors_path(records_path: str) -> str:
+	"""
+	Path of the float32 sidecar holding the embeddings of a records file.
+	"""
+
+	return os.path.splitext(records_path)[0] + '.f32'
+
+
+class EmbeddingsWriter:
+	"""
+	Streams `(record, embedding)` pairs into a JSONL records file plus its `.f32` sidecar.
+
+	Both files are written under temporary names and published on a clean `close()`
+	(or exit of the `with` block), so readers never see them out of step.
+	"""
+
+	def __init__(self, records_path: str) -> None:
+		os.makedirs(os.path.dirname(records_path) or '.', exist_ok=True)
+
+		self.records_path	=	records_path
+		self.vectors_path	=	vectors_path(records_path)
+		self.count			=	0
+		self.dim			:	int | None	=	None
+
+		self._tmp_records	=	f"{self.records_path}.tmp-{os.getpid()}"
+		self._tmp_vectors	=	f"{self.vectors_path}.tmp-{os.getpid()}"
+		self._records		=	open(self._tmp_records, 'w', encoding='utf-8')
+		self._vectors		=	open(self._tmp_vectors, 'wb')
+
+	def write(self, record: dict, embedding: Iterable[float]) -> None:
+		values = array('f', embedding)
+
+		if self.dim is None:
+			self.dim = len(values)
+		elif len(values) != self.dim:
+			raise ValueError(f"Embedding of record {self.count} has {len(values)} dims, expected {self.dim}")
+
+		self._records.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+		self._vectors.write(values.tobytes())
+		self.count += 1
+
+	def close(self, publish: bool = True) -> None:
+		self._records.close()
+		self._vectors.close()
+
+		if publish:
+			os.replace(self._tmp_vectors, self.vectors_path)
+			os.replace(self._tmp_records, self.records_path)
+		else:
+			for path in (self._tmp_records, self._tmp_vectors):
+				if os.path.exists(path):
+					os.remove(path)
+
+	def __enter__(self) -> 'EmbeddingsWriter':
+		return self
+
+	def __exit__(self, exc_type, exc, tb) -> None:
+		self.close(publish=exc_type is None)
@@ -0,0 +1,328 @@
+"""
+Background writer for the API-call and question logs.
+
+Logging a request only puts the record on an in-process queue; a single writer thread
+collects records into batches and appends each batch with one write per file, once
+`LOG_FLUSH_RECORDS` records are waiting or `LOG_FLUSH_INTERVAL` seconds after the first
+one arrived, and on shutdown. When the queue is full, records are dropped (and counted)
+rather than slowing requests down.
+
+Files are named by date and rotate by size too: `<prefix>_<date>.jsonl`, then
+`<prefix>_<date>.1.jsonl`, `.2`, ... once a file exceeds `LOG_MAX_FILE_BYTES`. Images of
+questions are written once per content hash into `QUESTION_IMAGE_PATH`, and the question
+records only reference them.
+"""
+
+import os
+import glob
+import json
+import time
+import queue
+import atexit
+import hashlib
+import threading
+from datetime import datetime
+
+from ..settings import SETTINGS
+from .ocr import decode_image
+
+# ############## [ END IMPORTS ] ##############
+
+
+_STOP = object()
+
+IMAGE_EXTENSIONS = {
+	b'\x89PNG': '.png'
+	, b'\xff\xd8\xff': '.jpg'
+	, b'GIF8': '.gif'
+	, b'RIFF': '.webp'
+}
+
+
+def image_extension(image_data: bytes) -> str:
+	for magic, ext in IMAGE_EXTENSIONS.items():
+		if image_data.startswith(magic):
+			return ext
+
+	return '.bin'
+
+
+def _part_number(path: str, prefix: str, date: str) -> int:
+	middle = os.path.basename(path)[len(f"{prefix}_{date}"):-len('.jsonl')]
+	return int(middle[1:]) if middle[1:].isdigit() else 0
+
+
+def log_files(directory: str, prefix: str, date: str) -> list[str]:
+	"""
+	All the files of one log for one date, oldest first.
+
+	Parameters:
+		directory (str): Log directory.
+		prefix (str): Log name, e.g. `api_log`.
+		date (str): Date string in 'YYYY-MM-DD' format.
+
+	Returns:
+		list[str]: Paths of `<prefix>_<date>.jsonl`, `<prefix>_<date>.1.jsonl`, ... that exist.
+	"""
+
+	pattern = os.path.join(glob.escape(directory), f"{glob.escape(prefix)}_{date}*.jsonl")
+	return sorted(glob.glob(pattern), key=lambda path: _part_number(path, prefix, date))
+
+
+def _append_file(path: str, lines: list[str]) -> None:
+	"""
+	Appends lines with a single unbuffered write: with several server workers logging into the
+	same file, an `O_APPEND` write lands whole, so lines of different workers never interleave.
+	"""
+
+	with open(path, "ab", buffering=0) as f:
+		f.write("".join(lines).encode("utf-8"))
+
+
+class LogSink:
+	"""
+	Queue plus writer thread appending JSONL records to size- and date-rotated files.
+
+	Parameters:
+		queue_size (int): Records that may wait to be written before new ones are dropped.
+		flush_records (int): Batch size that triggers a write.
+		flush_interval (float): Seconds a record may wait for its batch to fill up.
+		max_file_bytes (int): Size after which a log continues in a new file.
+		image_dir (str): Directory of the question images, stored by content hash.
+	"""
+
+	def __init__(
+		self
+		, queue_size		:	int		=	SETTINGS.LOG_QUEUE_SIZE
+		, flush_records		:	int		=	SETTINGS.LOG_FLUSH_RECORDS
+		, flush_interval	:	float	=	SETTINGS.LOG_FLUSH_INTERVAL
+		, max_file_bytes	:	int		=	SETTINGS.LOG_MAX_FILE_BYTES
+		, image_dir			:	str		=	SETTINGS.QUESTION_IMAGE_PATH
+	) -> None:
+		self.flush_records	=	max(1, flush_records)
+		self.flush_interval	=	flush_interval
+		self.max_file_bytes	=	max_file_bytes
+		self.image_dir		=	image_dir
+
+		self.written	=	0
+		self.dropped	=	0
+		self.batches	=	0
+
+		self._queue		:	queue.Queue					=	queue.Queue(maxsize=max(1, queue_size))
+		self._thread	:	threading.Thread | None		=	None
+		self._lock		=	threading.Lock()
+
+		# Writer-thread state: directories already created, current part per log, images on disk
+		self._dirs		:	set[str]					=	set()
+		self._parts		:	dict[tuple, int]			=	{}
+		self._images	:	set[str]					=	set()
+
+	def start(self) -> None:
+		with self._lock:
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+				self._thread.start()
+
+	def put(self, directory: str, prefix: str, record: dict, image: str | None = None) -> None:
+		"""
+		Queues a record for `<directory>/<prefix>_<date>[.N].jsonl`; never blocks.
+
+		Parameters:
+			directory (str): Log directory.
+			prefix (str): Log name.
+			record (dict): JSON-serializable record.
+			image (str, optional): Base64 image to store by hash; its `image_sha256` is added to the record.
+		"""
+
+		self.start()
+
+		try:
+			self._queue.put_nowait((directory, prefix, record, image))
+		except queue.Full:
+			self.dropped += 1
+			if self.dropped == 1 or self.dropped % 1000 == 0:
+				print(f"[LogSink] queue full, {self.dropped} records dropped so far")
+
+	def flush(self, timeout: float = 10.0) -> bool:
+		"""
+		Waits until everything queued so far is on disk; `False` if it took longer than `timeout`.
+		"""
+
+		if self._thread is None or not self._thread.is_alive():
+			return True
+
+		done = threading.Event()
+		self._queue.put(done)
+
+		return done.wait(timeout)
+
+	def stop(self, timeout: float = 10.0) -> None:
+		"""
+		Writes what is left in the queue and stops the writer thread.
+		"""
+
+		with self._lock:
+			thread, self._thread = self._thread, None
+
+		if thread is not None and thread.is_alive():
+			self._queue.put(_STOP)
+			thread.join(timeout)
+
+	def _run(self) -> None:
+		pending		=	[]
+		deadline	=	0.0
+
+		while True:
+			try:
+				item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()) if pending else None)
+			except queue.Empty:
+				item = None
+
+			if isinstance(item, tuple):
+				if not pending:
+					deadline = time.monotonic() + self.flush_interval
+				pending.append(item)
+
+				if len(pending) < self.flush_records:
+					continue
+
+			if pending:
+				self._write(pending)
+				pending = []
+
+			if isinstance(item, threading.Event):
+				item.set()
+			elif item is _STOP:
+				return
+
+	def _ensure_dir(self, directory: str) -> None:
+		if directory not in self._dirs:
+			os.makedirs(directory, exist_ok=True)
+			self._dirs.add(directory)
+
+	def _file(self, directory: str, prefix: str, date: str, part: int) -> str:
+		return os.path.join(directory, f"{prefix}_{date}.jsonl" if part == 0 else f"{prefix}_{date}.{part}.jsonl")
+
+	def _append(self, directory: str, prefix: str, date: str, lines: list[str]) -> None:
+		"""
+		Appends lines to the current part of a log, moving on to the next part whenever one is full.
+		"""
+
+		key = (directory, prefix, date)
+
+		if key not in self._parts:
+			existing = log_files(directory, prefix, date)
+			self._parts[key] = _part_number(existing[-1], prefix, date) if existing else 0
+
+		path = self._file(directory, prefix, date, self._parts[key])
+		size = os.path.getsize(path) if os.path.exists(path) else 0
+		chunk = []
+
+		for line in lines:
+			n = len(line.encode("utf-8"))
+
+			if size and size + n > self.max_file_bytes:
+				if chunk:
+					_append_file(path, chunk)
+					chunk = []
+
+				self._parts[key] += 1
+				path = self._file(directory, prefix, date, self._parts[key])
+				size = os.path.getsize(path) if os.path.exists(path) else 0
+
+			chunk.append(line)
+			size += n
+
+		if chunk:
+			_append_file(path, chunk)
+
+	def _store_image(self, image: str) -> str | None:
+		image_data = decode_image(image)
+		if not image_data:
+			return None
+
+		digest = hashlib.sha256(image_data).hexdigest()
+
+		if digest not in self._images:
+			self._ensure_dir(self.image_dir)
+			path = os.path.join(self.image_dir, digest + image_extension(image_data))
+
+			if not os.path.exists(path):
+				with open(path, 'wb') as f:
+					f.write(image_data)
+
+			self._images.add(digest)
+
+		return digest
+
+	def _write(self, items: list[tuple]) -> None:
+		date	=	datetime.now().strftime('%Y-%m-%d')
+		lines	:	dict[tuple[str, str], list[str]]	=	{}
+
+		for directory, prefix, record, image in items:
+			try:
+				if image:
+					record["image_sha256"] = self._store_image(image.strip())
+
+				lines.setdefault((directory, prefix), []).append(json.dumps(record) + "\n")
+
+			except Exception as e:
+				print(f"[LogSink Error] {e}")
+
+		for (directory, prefix), group in lines.items():
+			try:
+				self._ensure_dir(directory)
+				self._append(directory, prefix, date, group)
+
+				self.written += len(group)
+
+			except Exception as e:
+				print(f"[LogSink Error] {e}")
+
+		self.batches += 1
+
+	@property
+	def stats(self) -> dict:
+		return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped, "batches": self.batches}
+
+
+LOG_SINK : LogSink | None = None
+
+
+async def startup_log_sink() -> LogSink:
+	"""
+	Starts the log writer thread; called from `server.lifespan`.
+	"""
+
+	sink = getLogSink()
+	sink.start()
+
+	return sink
+
+
+async def shutdown_log_sink() -> None:
+	"""
+	Flushes the remaining records and stops the writer thread; called from `server.lifespan`.
+	"""
+
+	if LOG_SINK is not None:
+		LOG_SINK.stop()
+
+
+def getLogSink() -> LogSink:
+	"""
+	Function to get the shared log sink, creating it on first use
+
+	Returns
+		`LogSink` the process-wide log sink
+	"""
+
+	global LOG_SINK
+
+	if LOG_SINK is None:
+		LOG_SINK = LogSink()
+
+		# Scripts that log without the server lifespan still get their records written
+		atexit.register(LOG_SINK.stop)
+
+	return LOG_SINK
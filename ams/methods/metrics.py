@@ -0,0 +1,336 @@
+"""
+In-process metrics: latency of each stage of answering a question (and of the KB build
+tools), token usage and cache hit ratios, rendered in the Prometheus text format for the
+`/metrics` route of `server.py`.
+
+Stage latencies are kept as summaries: a running count and sum plus a window of the most
+recent `METRICS_WINDOW` observations, from which p50/p95/p99 are computed at scrape time.
+Cache hit ratios are not recorded as they happen but read from the caches when scraped.
+
+Every worker of a multi-worker server has a registry of its own. Once `startup_metrics`
+has run, each one writes its state to `METRICS_DIR/metrics-<pid>.json` every
+`METRICS_SHARE_INTERVAL` seconds (and on every scrape), and a scrape answers with the state
+of all the live workers merged. Counters and summary counts/sums are added up, and the
+quantiles are computed over the windows of all of them together. The gauges read at
+scrape time are per process, so they carry a `worker` label. A worker that stopped writing
+for three intervals is left out, so the totals drop when a worker restarts, which
+Prometheus treats as a counter reset.
+"""
+
+import os
+import glob
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+import numpy as np
+
+from ..settings import SETTINGS
+
+# ############## [ END IMPORTS ] ##############
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Summary:
+	"""
+	Count, sum and a sliding window of recent observations of one labelled series.
+	"""
+
+	def __init__(self, window: int = SETTINGS.METRICS_WINDOW) -> None:
+		self.count		=	0
+		self.total		=	0.0
+		self.recent		:	deque[float]	=	deque(maxlen=max(1, window))
+
+	def observe(self, value: float) -> None:
+		self.count += 1
+		self.total += value
+		self.recent.append(value)
+
+	def quantiles(self, qs: tuple[float, ...] = QUANTILES) -> dict[float, float]:
+		return quantiles(self.recent, qs)
+
+
+def quantiles(values, qs: tuple[float, ...] = QUANTILES) -> dict[float, float]:
+	if not values:
+		return {q: float('nan') for q in qs}
+
+	return dict(zip(qs, np.quantile(np.fromiter(values, dtype=np.float64), qs).tolist()))
+
+
+class MetricsRegistry:
+	"""
+	Summaries and counters keyed by `(name, labels)`, plus collectors evaluated at scrape time.
+	"""
+
+	def __init__(self) -> None:
+		self._lock			=	threading.Lock()
+		self._help			:	dict[str, tuple[str, str]]							=	{}
+		self._summaries		:	dict[tuple[str, tuple], Summary]					=	{}
+		self._counters		:	dict[tuple[str, tuple], float]						=	{}
+		self._collectors	:	list[Callable[[], list[tuple[str, str, str, dict, float]]]]	=	[]
+
+		# Sharing with the other workers, see `share`
+		self._shared_dir	:	str		=	''
+		self._interval		:	float	=	0.0
+		self._stop			=	threading.Event()
+		self._thread		:	threading.Thread | None		=	None
+
+	def describe(self, name: str, kind: str, help_text: str) -> None:
+		self._help.setdefault(name, (kind, help_text))
+
+	def observe(self, name: str, value: float, **labels: str) -> None:
+		key = (name, tuple(sorted(labels.items())))
+
+		with self._lock:
+			summary = self._summaries.get(key)
+			if summary is None:
+				summary = self._summaries[key] = Summary()
+			summary.observe(value)
+
+	def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+		key = (name, tuple(sorted(labels.items())))
+
+		with self._lock:
+			self._counters[key] = self._counters.get(key, 0.0) + value
+
+	def register_collector(self, collector: Callable[[], list[tuple[str, str, str, dict, float]]]) -> None:
+		"""
+		Adds a callback returning `(name, kind, help, labels, value)` samples, called on every scrape.
+		"""
+
+		self._collectors.append(collector)
+
+	@contextmanager
+	def span(self, stage: str, name: str = 'tds_stage_seconds') -> Iterator[None]:
+		"""
+		Times the body of a `with` block (sync or async code alike) as one observation of `stage`.
+		"""
+
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(name, time.perf_counter() - started, stage=stage)
+
+	def snapshot(self) -> dict:
+		"""
+		The stage latencies as `{stage: {count, mean, p50, p95, p99}}`, in seconds.
+		"""
+
+		with self._lock:
+			items = [(dict(labels).get('stage', name), s.count, s.total, s.quantiles()) for (name, labels), s in self._summaries.items()]
+
+		return {
+			stage: {"count": count, "mean": total / count if count else 0.0, **{f"p{int(q * 100)}": v for q, v in qs.items()}}
+			for stage, count, total, qs in items
+		}
+
+	def _state(self) -> dict:
+		"""
+		This process's metrics as plain JSON data, the gauges of the collectors included.
+		"""
+
+		with self._lock:
+			summaries	=	[[name, labels, s.count, s.total, list(s.recent)] for (name, labels), s in self._summaries.items()]
+			counters	=	[[name, labels, v] for (name, labels), v in self._counters.items()]
+
+		gauges = []
+		for collector in self._collectors:
+			try:
+				for name, kind, help_text, labels, value in collector():
+					self.describe(name, kind, help_text)
+					gauges.append([name, labels, value])
+			except Exception as e:
+				print(f"[Metrics Error] {type(e).__name__} {e}")
+
+		return {"pid": os.getpid(), "summaries": summaries, "counters": counters, "gauges": gauges}
+
+	def share(self, directory: str, interval: float) -> None:
+		"""
+		Starts writing this process's state into `directory` every `interval` seconds, and
+		makes `render` merge the states of all the workers writing there.
+		"""
+
+		os.makedirs(directory, exist_ok=True)
+
+		self._shared_dir	=	directory
+		self._interval		=	max(0.5, interval)
+		self._stop.clear()
+
+		if self._thread is None or not self._thread.is_alive():
+			self._thread = threading.Thread(target=self._share_loop, name="metrics-share", daemon=True)
+			self._thread.start()
+
+	def unshare(self) -> None:
+		"""
+		Stops writing the state and removes this worker's file.
+		"""
+
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join(timeout=5)
+			self._thread = None
+
+		if self._shared_dir:
+			try:
+				os.remove(self._shared_path())
+			except OSError:
+				pass
+
+			self._shared_dir = ''
+
+	def _shared_path(self) -> str:
+		return os.path.join(self._shared_dir, f"metrics-{os.getpid()}.json")
+
+	def _share_loop(self) -> None:
+		while not self._stop.wait(self._interval):
+			self._write_shared(self._state())
+
+	def _write_shared(self, state: dict) -> None:
+		path = self._shared_path()
+		tmp_path = f"{path}.tmp"
+
+		try:
+			with open(tmp_path, "w", encoding="utf-8") as f:
+				json.dump(state, f)
+			os.replace(tmp_path, path)
+		except OSError as e:
+			print(f"[Metrics Error] {e}")
+
+	def _read_shared(self) -> list[dict]:
+		states = []
+		now = time.time()
+
+		for path in glob.glob(os.path.join(self._shared_dir, "metrics-*.json")):
+			try:
+				age = now - os.path.getmtime(path)
+
+				# A worker that is gone; its file is removed once it is clearly abandoned
+				if age > 3 * self._interval:
+					if age > 20 * self._interval:
+						os.remove(path)
+					continue
+
+				with open(path, "r", encoding="utf-8") as f:
+					states.append(json.load(f))
+
+			except (OSError, ValueError):
+				continue
+
+		return states
+
+	def render(self) -> str:
+		"""
+		All metrics in the Prometheus text exposition format, of all the workers once shared.
+		"""
+
+		def fmt(name: str, labels: dict, value: float) -> str:
+			label_str = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+			return f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}"
+
+		def key(name: str, labels) -> tuple:
+			return (name, tuple(tuple(pair) for pair in labels))
+
+		state = self._state()
+		states = [state]
+
+		if self._shared_dir:
+			# Fresh numbers of this worker, whatever the age of the others'
+			self._write_shared(state)
+			states = [other for other in self._read_shared() if other["pid"] != state["pid"]] + [state]
+
+		summaries	:	dict[tuple, list]	=	{}
+		counters	:	dict[tuple, float]	=	{}
+		gauges		=	[]
+
+		for worker in states:
+			for name, labels, count, total, recent in worker["summaries"]:
+				merged = summaries.setdefault(key(name, labels), [0, 0.0, []])
+				merged[0] += count
+				merged[1] += total
+				merged[2].extend(recent)
+
+			for name, labels, value in worker["counters"]:
+				counters[key(name, labels)] = counters.get(key(name, labels), 0.0) + value
+
+			for name, labels, value in worker["gauges"]:
+				gauges.append((name, {**labels, "worker": str(worker["pid"])} if self._shared_dir else labels, value))
+
+		families : dict[str, list[str]] = {}
+
+		for (name, labels), (count, total, recent) in summaries.items():
+			labels = dict(labels)
+			lines = families.setdefault(name, [])
+			for q, v in quantiles(recent).items():
+				lines.append(fmt(name, {**labels, "quantile": q}, v))
+			lines.append(fmt(f"{name}_sum", labels, total))
+			lines.append(fmt(f"{name}_count", labels, count))
+
+		for (name, labels), value in counters.items():
+			families.setdefault(name, []).append(fmt(name, dict(labels), value))
+
+		for name, labels, value in gauges:
+			families.setdefault(name, []).append(fmt(name, labels, value))
+
+		families.setdefault('tds_metrics_workers', []).append(fmt('tds_metrics_workers', {}, len(states)))
+
+		out = []
+		for name, lines in families.items():
+			kind, help_text = self._help.get(name, ('untyped', ''))
+			out.append(f"# HELP {name} {help_text}")
+			out.append(f"# TYPE {name} {kind}")
+			out.extend(lines)
+
+		return "\n".join(out) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+METRICS.describe('tds_stage_seconds', 'summary', 'Latency of each stage of answering a question or building the KB, in seconds.')
+METRICS.describe('tds_tokens_total', 'counter', 'Tokens reported by the AIPIPE API, by calling method.')
+METRICS.describe('tds_api_calls_total', 'counter', 'Calls made to the AIPIPE API, by calling method.')
+METRICS.describe('tds_questions_total', 'counter', 'Questions answered, by route and whether the answer came from the cache.')
+METRICS.describe('tds_metrics_workers', 'gauge', 'Worker processes whose metrics are merged into this scrape.')
+
+
+def getMetrics() -> MetricsRegistry:
+	"""
+	Function to get the process-wide metrics registry
+
+	Returns
+		`MetricsRegistry` the registry every module records into
+	"""
+
+	return METRICS
+
+
+def span(stage: str):
+	"""
+	Shorthand for `getMetrics().span(stage)`.
+	"""
+
+	return METRICS.span(stage)
+
+
+async def startup_metrics() -> MetricsRegistry:
+	"""
+	Starts sharing this worker's metrics through `SETTINGS.METRICS_DIR`; called from `server.lifespan`.
+	"""
+
+	if SETTINGS.METRICS_DIR:
+		METRICS.share(SETTINGS.METRICS_DIR, SETTINGS.METRICS_SHARE_INTERVAL)
+
+	return METRICS
+
+
+async def shutdown_metrics() -> None:
+	"""
+	Stops sharing this worker's metrics; called from `server.lifespan`.
+	"""
+
+	METRICS.unshare()
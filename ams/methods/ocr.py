@@ -0,0 +1,295 @@
+"""
+OCR of the images attached to questions, off the event loop.
+
+Tesseract is CPU-bound and runs for hundreds of milliseconds per screenshot, so it gets a
+small pool of worker processes of its own instead of borrowing the threads that serve text
+questions. At most `OCR_WORKERS` images are processed at once and at most `OCR_QUEUE_SIZE`
+more wait for a worker; beyond that new images are turned away straight away, and an image
+that is not done within `OCR_TIMEOUT` seconds (queueing included) is given up on. In all of
+these cases the question is still answered, only without the image text.
+
+Pillow and pytesseract are only imported where an image is read, i.e. in the workers, so
+the server itself never loads them. The workers are started on the first image question,
+or with the server when `OCR_PREWARM` is set.
+"""
+
+import re
+import base64
+import asyncio
+import binascii
+import multiprocessing
+from io import BytesIO
+from typing import TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ..settings import SETTINGS
+
+if TYPE_CHECKING:
+	from PIL import Image
+
+# ############## [ END IMPORTS ] ##############
+
+
+def _set_tesseract_cmd(tesseract_cmd: str) -> None:
+	# Also warms a worker up: the imports are its slowest part
+	import pytesseract
+
+	if tesseract_cmd:
+		pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+
+def preprocess_image(image_data: bytes, max_side: int = SETTINGS.OCR_MAX_SIDE) -> 'Image.Image':
+	"""
+	Decodes an image and prepares it for Tesseract: flattened onto white, grayscale and
+	scaled down so that its longest side is at most `max_side` pixels.
+
+	Parameters:
+		image_data (bytes): Raw image file content (PNG, JPEG, ...).
+		max_side (int): Longest side in pixels after scaling; 0 keeps the original size.
+
+	Returns:
+		Image.Image: A mode `L` image.
+	"""
+
+	from PIL import Image
+
+	image = Image.open(BytesIO(image_data))
+
+	# JPEGs can be decoded at a reduced size directly, which is much faster than resizing after
+	if max_side:
+		image.draft('L', (max_side, max_side))
+
+	# Transparent screenshots would otherwise turn into text on a black background
+	if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+		image = image.convert('RGBA')
+		background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+		image = Image.alpha_composite(background, image)
+
+	image = image.convert('L')
+
+	if max_side and max(image.size) > max_side:
+		image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+	return image
+
+
+def ocr_image(image_data: bytes, max_side: int = SETTINGS.OCR_MAX_SIDE, timeout: float = SETTINGS.OCR_TIMEOUT) -> str:
+	"""
+	Runs Tesseract on an image, in the calling process.
+
+	Parameters:
+		image_data (bytes): Raw image file content.
+		max_side (int): See `preprocess_image`.
+		timeout (float): Seconds after which the tesseract process is killed; 0 for no limit.
+
+	Returns:
+		str: The extracted text, stripped.
+	"""
+
+	import pytesseract
+
+	return pytesseract.image_to_string(preprocess_image(image_data, max_side), timeout=timeout).strip()
+
+
+def _ocr_job(image_data: bytes, max_side: int, timeout: float) -> str:
+	# pytesseract's exceptions cannot be unpickled and would break the whole pool on the way back
+	try:
+		return ocr_image(image_data, max_side, timeout)
+	except Exception as e:
+		raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+JUNK_CHARS	=	re.compile(r'[^a-zA-Z0-9\s.,:;?!%-]')
+WHITESPACE	=	re.compile(r'\s+')
+
+
+def clean_ocr_text(text: str, min_words: int = 5) -> str:
+	"""
+	Strips the junk symbols Tesseract reads into screenshots and normalizes the spacing.
+
+	Parameters:
+		text (str): Raw OCR output.
+		min_words (int): Fewer words than this are treated as no text at all.
+
+	Returns:
+		str: The cleaned text, or an empty string when too little is left.
+	"""
+
+	text = WHITESPACE.sub(' ', JUNK_CHARS.sub('', text)).strip()
+
+	return text if len(text.split()) >= min_words else ''
+
+
+def decode_image(base64_str: str) -> bytes | None:
+	"""
+	Decodes a base64 image, also accepting `data:image/...;base64,` URLs; `None` if it is not valid base64.
+	"""
+
+	if base64_str.startswith('data:') and ',' in base64_str:
+		base64_str = base64_str.split(',', 1)[1]
+
+	try:
+		return base64.b64decode(base64_str)
+	except (binascii.Error, ValueError):
+		return None
+
+
+class OCRService:
+	"""
+	Bounded process pool running `ocr_image`, with admission control and timeouts.
+
+	Parameters:
+		workers (int): Worker processes, i.e. images processed in parallel.
+		queue_size (int): Images allowed to wait for a worker before new ones are rejected.
+		timeout (float): Seconds an image may take, from submission to result.
+		max_side (int): See `preprocess_image`.
+		tesseract_cmd (str): Path of the tesseract binary; empty to look it up on `PATH`.
+	"""
+
+	def __init__(
+		self
+		, workers		:	int		=	SETTINGS.OCR_WORKERS
+		, queue_size	:	int		=	SETTINGS.OCR_QUEUE_SIZE
+		, timeout		:	float	=	SETTINGS.OCR_TIMEOUT
+		, max_side		:	int		=	SETTINGS.OCR_MAX_SIDE
+		, tesseract_cmd	:	str		=	SETTINGS.TESSERACT_CMD
+	) -> None:
+		self.workers		=	max(1, workers)
+		self.capacity		=	self.workers + max(0, queue_size)
+		self.timeout		=	timeout
+		self.max_side		=	max_side
+		self.tesseract_cmd	=	tesseract_cmd
+
+		self.in_flight	=	0
+		self.done		=	0
+		self.rejected	=	0
+		self.timed_out	=	0
+		self.failed		=	0
+
+		self._pool		:	ProcessPoolExecutor | None	=	None
+
+	def _get_pool(self) -> ProcessPoolExecutor:
+		if self._pool is None:
+			# `spawn`: forking a process that already runs the event loop and thread pools is unsafe
+			self._pool = ProcessPoolExecutor(
+				max_workers		=	self.workers
+				, mp_context	=	multiprocessing.get_context('spawn')
+				, initializer	=	_set_tesseract_cmd
+				, initargs		=	(self.tesseract_cmd,)
+			)
+
+		return self._pool
+
+	def start(self) -> None:
+		"""
+		Creates the pool and starts its workers, so the first image does not pay for the spawn.
+		"""
+
+		pool = self._get_pool()
+		for _ in range(self.workers):
+			pool.submit(_set_tesseract_cmd, self.tesseract_cmd)
+
+	def shutdown(self) -> None:
+		if self._pool is not None:
+			self._pool.shutdown(wait=False, cancel_futures=True)
+			self._pool = None
+
+	async def extract_text(self, image_data: bytes) -> str | None:
+		"""
+		OCRs an image in the pool.
+
+		Parameters:
+			image_data (bytes): Raw image file content.
+
+		Returns:
+			str | None: The extracted text; `None` when the image was rejected, timed out or could not be read.
+		"""
+
+		if self.in_flight >= self.capacity:
+			self.rejected += 1
+			print(f"[OCR] busy ({self.in_flight} images in flight), skipping image")
+			return None
+
+		self.in_flight += 1
+
+		try:
+			future = asyncio.wrap_future(self._get_pool().submit(_ocr_job, image_data, self.max_side, self.timeout))
+
+			# Cancelling the wrapper also drops the job from the pool while it is still queued
+			text = await asyncio.wait_for(future, timeout=self.timeout + 1 if self.timeout else None)
+			self.done += 1
+			return text
+
+		except asyncio.TimeoutError:
+			self.timed_out += 1
+			print(f"[OCR] timed out after {self.timeout}s")
+
+		except BrokenProcessPool:
+			self.failed += 1
+			print("[OCR] worker pool broke, restarting it")
+			self.shutdown()
+
+		except Exception as e:
+			self.failed += 1
+			print(f"[OCR Error] {type(e).__name__} {e}")
+
+		finally:
+			self.in_flight -= 1
+
+		return None
+
+	@property
+	def stats(self) -> dict:
+		return {
+			"workers": self.workers
+			, "capacity": self.capacity
+			, "in_flight": self.in_flight
+			, "done": self.done
+			, "rejected": self.rejected
+			, "timed_out": self.timed_out
+			, "failed": self.failed
+		}
+
+
+OCR_SERVICE : OCRService | None = None
+
+
+async def startup_ocr_service() -> OCRService:
+	"""
+	Creates the OCR service, starting its worker pool only with `OCR_PREWARM`; called from `server.lifespan`.
+	"""
+
+	service = getOCRService()
+	if SETTINGS.OCR_PREWARM:
+		service.start()
+
+	return service
+
+
+async def shutdown_ocr_service() -> None:
+	"""
+	Stops the OCR worker pool; called from `server.lifespan`.
+	"""
+
+	global OCR_SERVICE
+
+	if OCR_SERVICE is not None:
+		OCR_SERVICE.shutdown()
+		OCR_SERVICE = None
+
+
+def getOCRService() -> OCRService:
+	"""
+	Function to get the shared OCR service, creating it on first use outside of the lifespan
+
+	Returns
+		`OCRService` the process-wide OCR service
+	"""
+
+	global OCR_SERVICE
+
+	if OCR_SERVICE is None:
+		OCR_SERVICE = OCRService()
+
+	return OCR_SERVICE
@@ -0,0 +1,290 @@
+"""
+Retrieval backends serving `api.searchKB` out of a built KB index (see `init_vectorDB`).
+
+Every backend exposes the small part of the ChromaDB `Collection` API the application
+uses (`query`, `count`, `get`) plus the `version` of the KB it serves, and returns
+Chroma-shaped results (squared L2 distances, nearest first):
+
+	numpy	brute force over the memory-mapped matrix: one matrix product per batch of
+			queries and a top-k with `argpartition`. The matrix can be kept as float32,
+			float16 (half the memory) or int8 with a per-row scale (a quarter).
+	chroma	the same rows loaded into an in-memory ChromaDB collection; needs `chromadb`.
+
+`SETTINGS.VECTOR_BACKEND` and `SETTINGS.VECTOR_DTYPE` select one; `tools/bench_retrieval.py`
+compares their latency and recall.
+"""
+
+import os
+import json
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from ..settings import SETTINGS
+
+# ############## [ END IMPORTS ] ##############
+
+
+DTYPES = ('float32', 'float16', 'int8')
+
+# Rows converted back to float32 at a time when scoring a float16/int8 matrix
+SCORE_BLOCK_ROWS = 4096
+
+
+class RetrievalBackend(ABC):
+	"""
+	Interface of a KB retrieval backend; a backend missing any part of it cannot be instantiated.
+	"""
+
+	@property
+	@abstractmethod
+	def name(self) -> str:
+		"""
+		Backend name as used in `SETTINGS.VECTOR_BACKEND`.
+		"""
+
+	@property
+	@abstractmethod
+	def version(self) -> str:
+		"""
+		Content hash of the source KB the served index was built from.
+		"""
+
+	@abstractmethod
+	def count(self) -> int:
+		"""
+		Number of rows served.
+		"""
+
+	@abstractmethod
+	def get(self, ids: list[str] | None = None) -> dict:
+		"""
+		`ids` and `metadatas` of the given rows (`doc_<i>`), or of all of them.
+		"""
+
+	@abstractmethod
+	def query(self, query_embeddings: list[list[float]], n_results: int = 10) -> dict:
+		"""
+		Nearest-neighbour search by squared L2 distance (ChromaDB's default space).
+
+		Parameters:
+			query_embeddings (list[list[float]]): One or more query vectors.
+			n_results (int): Number of neighbours to return per query.
+
+		Returns:
+			dict: `ids`, `distances` and `metadatas`, each a list per query, nearest first.
+		"""
+
+
+def _save_npy_atomic(path: str, array: np.ndarray) -> None:
+	tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+	np.save(tmp_path, array)
+	os.replace(tmp_path, path)
+
+
+def _load_matrix(build_dir: str, dtype: str) -> tuple[np.ndarray, np.ndarray | None]:
+	"""
+	Maps the embeddings of a build in the requested storage type, writing the converted copy
+	into the build directory on first use so that every worker maps the same file.
+
+	Returns:
+		tuple[np.ndarray, np.ndarray | None]: The matrix and, for int8, the per-row scales.
+	"""
+
+	source = os.path.join(build_dir, 'embeddings.npy')
+
+	if dtype == 'float32':
+		return np.load(source, mmap_mode='r'), None
+
+	path = os.path.join(build_dir, f'embeddings.{dtype}.npy')
+	scales_path = os.path.join(build_dir, 'embeddings.int8_scales.npy')
+
+	if not os.path.exists(path) or (dtype == 'int8' and not os.path.exists(scales_path)):
+		matrix = np.load(source, mmap_mode='r')
+
+		if dtype == 'float16':
+			_save_npy_atomic(path, matrix.astype(np.float16))
+		else:
+			scales = np.abs(matrix).max(axis=1) / 127.0
+			scales[scales == 0] = 1.0
+			_save_npy_atomic(scales_path, scales.astype(np.float32))
+			_save_npy_atomic(path, np.rint(matrix / scales[:, None]).astype(np.int8))
+
+	return np.load(path, mmap_mode='r'), (np.load(scales_path, mmap_mode='r') if dtype == 'int8' else None)
+
+
+class NumpyBackend(RetrievalBackend):
+	"""
+	Memory-mapped, read-only brute-force index.
+
+	Parameters:
+		build_dir (str): Build directory of the KB index.
+		manifest (dict): Its manifest.
+		dtype (str): Storage type of the matrix, one of `DTYPES`. Distances always use the
+			exact float32 row norms, only the dot products are approximate.
+
+	Attributes:
+		embeddings (np.ndarray): Memory-mapped matrix of shape (rows, dim).
+		sq_norms (np.ndarray): Squared L2 norm of every row.
+		metadatas (list[dict]): Per-row `{title, url, text}` records.
+	"""
+
+	name = 'numpy'
+
+	def __init__(self, build_dir: str, manifest: dict, dtype: str = SETTINGS.VECTOR_DTYPE) -> None:
+		if dtype not in DTYPES:
+			raise ValueError(f"Unknown vector dtype {dtype!r}, expected one of {DTYPES}")
+
+		self.build_dir	=	build_dir
+		self.manifest	=	manifest
+		self.dtype		=	dtype
+
+		self.embeddings, self.scales = _load_matrix(build_dir, dtype)
+		self.sq_norms	:	np.ndarray	=	np.load(os.path.join(build_dir, 'sq_norms.npy'), mmap_mode='r')
+
+		with open(os.path.join(build_dir, 'metadata.json'), 'r', encoding='utf-8') as f:
+			self.metadatas : list[dict] = json.load(f)
+
+	@property
+	def version(self) -> str:
+		return self.manifest['source_sha256']
+
+	def count(self) -> int:
+		return int(self.embeddings.shape[0])
+
+	def get(self, ids: list[str] | None = None) -> dict:
+		if ids is None:
+			return {
+				'ids': [f"doc_{i}" for i in range(self.count())]
+				, 'metadatas': self.metadatas
+			}
+
+		return {
+			'ids': list(ids)
+			, 'metadatas': [self.metadatas[int(i.removeprefix('doc_'))] for i in ids]
+		}
+
+	def _dot(self, q: np.ndarray) -> np.ndarray:
+		if self.dtype == 'float32':
+			return q @ self.embeddings.T
+
+		# There is no BLAS for float16/int8: convert block by block to bound the temporary memory
+		rows = self.count()
+		out = np.empty((q.shape[0], rows), dtype=np.float32)
+
+		for start in range(0, rows, SCORE_BLOCK_ROWS):
+			block = np.asarray(self.embeddings[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+			np.matmul(q, block.T, out=out[:, start:start + SCORE_BLOCK_ROWS])
+
+		if self.scales is not None:
+			out *= self.scales[None, :]
+
+		return out
+
+	def query(self, query_embeddings: list[list[float]], n_results: int = 10) -> dict:
+		q = np.asarray(query_embeddings, dtype=np.float32)
+		if q.ndim == 1:
+			q = q[None, :]
+
+		k = max(0, min(n_results, self.count()))
+
+		# ||q - x||^2 = ||q||^2 + ||x||^2 - 2 q.x
+		dists = (q * q).sum(axis=1)[:, None] + self.sq_norms[None, :] - 2.0 * self._dot(q)
+		np.maximum(dists, 0.0, out=dists)
+
+		result = {'ids': [], 'distances': [], 'metadatas': [], 'documents': None, 'embeddings': None}
+
+		for row in dists:
+			if k == 0:
+				top = np.empty(0, dtype=np.int64)
+			else:
+				top = np.argpartition(row, k - 1)[:k]
+				top = top[np.argsort(row[top])]
+
+			result['ids'].append([f"doc_{i}" for i in top])
+			result['distances'].append([float(row[i]) for i in top])
+			result['metadatas'].append([self.metadatas[i] for i in top])
+
+		return result
+
+
+class ChromaBackend(RetrievalBackend):
+	"""
+	In-memory ChromaDB collection loaded from a built KB index.
+
+	The rows are added with as few `add` calls as Chroma's maximum batch size allows, and
+	the collection is named after the KB version, so a rebuilt KB gets a fresh one.
+
+	Parameters:
+		build_dir (str): Build directory of the KB index.
+		manifest (dict): Its manifest.
+	"""
+
+	name = 'chroma'
+
+	def __init__(self, build_dir: str, manifest: dict) -> None:
+		# Imported here: `chromadb` is heavy and only needed by this backend
+		import chromadb
+		from chromadb.config import Settings
+
+		source = NumpyBackend(build_dir, manifest, 'float32')
+
+		self.manifest	=	manifest
+		self.client		=	chromadb.Client(Settings(anonymized_telemetry=False))
+		self.collection	=	self.client.get_or_create_collection(f"knowledge_base_{self.version[:16]}")
+
+		if self.collection.count() == 0:
+			rows		=	source.count()
+			max_batch	=	self.client.get_max_batch_size() if hasattr(self.client, 'get_max_batch_size') else 5000
+
+			for start in range(0, rows, max_batch):
+				end = min(rows, start + max_batch)
+				self.collection.add(
+					ids			=	[f"doc_{i}" for i in range(start, end)]
+					, embeddings=	np.asarray(source.embeddings[start:end]).tolist()
+					, metadatas	=	source.metadatas[start:end]
+				)
+
+	@property
+	def version(self) -> str:
+		return self.manifest['source_sha256']
+
+	def count(self) -> int:
+		return self.collection.count()
+
+	def get(self, ids: list[str] | None = None) -> dict:
+		return self.collection.get(ids=ids)
+
+	def query(self, query_embeddings: list[list[float]], n_results: int = 10) -> dict:
+		return self.collection.query(query_embeddings=query_embeddings, n_results=n_results)
+
+
+BACKENDS = {
+	NumpyBackend.name: NumpyBackend
+	, ChromaBackend.name: ChromaBackend
+}
+
+
+def create_backend(build_dir: str, manifest: dict, name: str | None = None, dtype: str | None = None) -> RetrievalBackend:
+	"""
+	Opens a KB index build with the chosen retrieval backend.
+
+	Parameters:
+		build_dir (str): Build directory of the KB index.
+		manifest (dict): Its manifest.
+		name (str, optional): Backend name; defaults to `SETTINGS.VECTOR_BACKEND`.
+		dtype (str, optional): Matrix storage type of the `numpy` backend; defaults to `SETTINGS.VECTOR_DTYPE`.
+
+	Returns:
+		RetrievalBackend: The opened backend.
+	"""
+
+	name = name or SETTINGS.VECTOR_BACKEND
+
+	if name not in BACKENDS:
+		raise ValueError(f"Unknown vector backend {name!r}, expected one of {tuple(BACKENDS)}")
+
+	if name == NumpyBackend.name:
+		return NumpyBackend(build_dir, manifest, dtype or SETTINGS.VECTOR_DTYPE)
+
+	return BACKENDS[name](build_dir, manifest)
@@ -0,0 +1,212 @@
+"""
+Checkpoint of the Discourse scraper: every post scraped so far and the per-topic watermarks
+of the incremental sync, in one SQLite file (`DISCOURSE_CHECKPOINT_DB`).
+
+A topic is committed in a single transaction (its new or edited posts, the posts removed
+from it, its watermark and their entries in the delta log), so the cost of a checkpoint is
+proportional to what changed and a crash leaves the file at the last committed topic:
+resuming redoes at most the topics that were in flight.
+
+The delta log is append-only: every post added, edited or removed since the KB was last
+formatted, consumed by `form_kb(delta=True)`. The JSON checkpoint of older versions
+(`TEMP_DISCOURSE_JSON`) is imported once into an empty database.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from typing import Iterable, Iterator
+
+from ..settings import SETTINGS
+
+# ############## [ END IMPORTS ] ##############
+
+
+class ScrapeCheckpoint:
+	"""
+	SQLite store of the scraped posts (keyed by post id) and of the topic watermarks.
+
+	Parameters:
+		path (str): SQLite file; created with its directory if missing.
+	"""
+
+	def __init__(self, path: str = SETTINGS.DISCOURSE_CHECKPOINT_DB) -> None:
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+		self.path	=	path
+		self._lock	=	threading.Lock()
+		self._conn	=	sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+
+		with self._lock, self._conn:
+			# WAL: a commit is one append to the log, and a crash cannot corrupt what was committed
+			self._conn.execute("PRAGMA journal_mode=WAL")
+			self._conn.execute("PRAGMA synchronous=NORMAL")
+			self._conn.execute("CREATE TABLE IF NOT EXISTS posts (post_id INTEGER PRIMARY KEY, topic_id INTEGER NOT NULL, post_number INTEGER NOT NULL, updated_at TEXT, record TEXT NOT NULL)")
+			self._conn.execute("CREATE INDEX IF NOT EXISTS posts_topic ON posts (topic_id, post_number)")
+			self._conn.execute("CREATE TABLE IF NOT EXISTS topics (topic_id INTEGER PRIMARY KEY, mark TEXT NOT NULL)")
+			self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+			self._conn.execute("CREATE TABLE IF NOT EXISTS delta (seq INTEGER PRIMARY KEY AUTOINCREMENT, post_id INTEGER NOT NULL, removed INTEGER NOT NULL, record TEXT NOT NULL)")
+
+	@staticmethod
+	def _post_row(post: dict) -> tuple:
+		return (post["post_id"], post["topic_id"], post["post_number"], post.get("updated_at"), json.dumps(post, ensure_ascii=False))
+
+	def count(self) -> int:
+		with self._lock:
+			return self._conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+	def topic_posts(self, topic_id: int) -> dict[int, dict]:
+		"""
+		The saved posts of one topic, keyed by post id.
+		"""
+
+		with self._lock:
+			rows = self._conn.execute("SELECT post_id, record FROM posts WHERE topic_id = ?", (topic_id,)).fetchall()
+
+		return {post_id: json.loads(record) for post_id, record in rows}
+
+	def commit_topic(self, topic_id: int, posts: list[dict], removed: list[dict] = (), mark: dict | None = None, changed: list[dict] = ()) -> None:
+		"""
+		Saves the new or edited posts of a topic, deletes its removed ones, logs the changes
+		and, if given, records its watermark, all in one transaction.
+
+		Parameters:
+			topic_id (int): The topic.
+			posts (list[dict]): Post records to save.
+			removed (list[dict]): `{post_id, url}` of the posts no longer in the topic.
+			mark (dict, optional): Watermark of the topic.
+			changed (list[dict]): The records of `posts` whose text changed, for the delta log.
+		"""
+
+		with self._lock, self._conn:
+			self._conn.executemany("INSERT OR REPLACE INTO posts (post_id, topic_id, post_number, updated_at, record) VALUES (?, ?, ?, ?, ?)", [self._post_row(post) for post in posts])
+			self._conn.executemany("DELETE FROM posts WHERE post_id = ?", [(post["post_id"],) for post in removed])
+
+			self._conn.executemany(
+				"INSERT INTO delta (post_id, removed, record) VALUES (?, ?, ?)"
+				, [(post["post_id"], 0, json.dumps(post, ensure_ascii=False)) for post in changed]
+				+ [(post["post_id"], 1, json.dumps(post, ensure_ascii=False)) for post in removed]
+			)
+
+			if mark is not None:
+				self._conn.execute("INSERT OR REPLACE INTO topics (topic_id, mark) VALUES (?, ?)", (topic_id, json.dumps(mark)))
+
+	def topics(self) -> dict[str, dict]:
+		"""
+		Watermarks of every topic seen by a sync, keyed by topic id (as a string).
+		"""
+
+		with self._lock:
+			rows = self._conn.execute("SELECT topic_id, mark FROM topics").fetchall()
+
+		return {str(topic_id): json.loads(mark) for topic_id, mark in rows}
+
+	def set_topics(self, marks: dict[str, dict]) -> None:
+		with self._lock, self._conn:
+			self._conn.executemany("INSERT OR REPLACE INTO topics (topic_id, mark) VALUES (?, ?)", [(int(topic_id), json.dumps(mark)) for topic_id, mark in marks.items()])
+
+	def get_meta(self, key: str, default=None):
+		with self._lock:
+			row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+
+		return default if row is None else json.loads(row[0])
+
+	def set_meta(self, key: str, value) -> None:
+		with self._lock, self._conn:
+			self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+	def iter_posts(self, topic_ids: Iterable[int] | None = None) -> Iterator[dict]:
+		"""
+		Streams the saved posts (of the given topics only, if any) ordered by topic and post number.
+		"""
+
+		if topic_ids is None:
+			with self._lock:
+				rows = self._conn.execute("SELECT record FROM posts ORDER BY topic_id, post_number").fetchall()
+
+			for (record,) in rows:
+				yield json.loads(record)
+			return
+
+		for topic_id in sorted(set(topic_ids)):
+			with self._lock:
+				rows = self._conn.execute("SELECT record FROM posts WHERE topic_id = ? ORDER BY post_number", (topic_id,)).fetchall()
+
+			for (record,) in rows:
+				yield json.loads(record)
+
+	def pending_delta(self) -> tuple[dict, int]:
+		"""
+		The posts changed since the delta log was last cleared, latest change per post.
+
+		Returns:
+			tuple[dict, int]: `{"changed": [post...], "removed": [{post_id, url}...]}` and the
+			last log entry read, to pass to `clear_delta`.
+		"""
+
+		with self._lock:
+			rows = self._conn.execute("SELECT seq, post_id, removed, record FROM delta ORDER BY seq").fetchall()
+
+		latest = {post_id: (removed, record) for _, post_id, removed, record in rows}
+
+		delta = {
+			"changed": [json.loads(record) for removed, record in latest.values() if not removed]
+			, "removed": [json.loads(record) for removed, record in latest.values() if removed]
+		}
+
+		return delta, (rows[-1][0] if rows else 0)
+
+	def clear_delta(self, upto: int | None = None) -> None:
+		"""
+		Drops the delta log up to entry `upto` (everything by default): entries logged by a
+		sync running meanwhile are kept.
+		"""
+
+		with self._lock, self._conn:
+			if upto is None:
+				self._conn.execute("DELETE FROM delta")
+			else:
+				self._conn.execute("DELETE FROM delta WHERE seq <= ?", (upto,))
+
+	def import_json(self, path: str) -> int:
+		"""
+		Imports a JSON checkpoint of older versions (`{post_id: post}` or a list of posts).
+		"""
+
+		with open(path, "r", encoding="utf-8") as f:
+			saved = json.load(f)
+
+		posts = list(saved.values()) if isinstance(saved, dict) else saved
+
+		with self._lock, self._conn:
+			self._conn.executemany("INSERT OR REPLACE INTO posts (post_id, topic_id, post_number, updated_at, record) VALUES (?, ?, ?, ?, ?)", [self._post_row(post) for post in posts])
+
+		return len(posts)
+
+	def close(self) -> None:
+		with self._lock:
+			self._conn.close()
+
+
+CHECKPOINT : ScrapeCheckpoint | None = None
+
+
+def getCheckpoint() -> ScrapeCheckpoint:
+	"""
+	Function to get the scraper checkpoint, opening it (and importing the legacy JSON one) on first use
+
+	Returns
+		`ScrapeCheckpoint` the process-wide checkpoint
+	"""
+
+	global CHECKPOINT
+
+	if CHECKPOINT is None:
+		CHECKPOINT = ScrapeCheckpoint()
+
+		if CHECKPOINT.count() == 0 and os.path.exists(SETTINGS.TEMP_DISCOURSE_JSON):
+			imported = CHECKPOINT.import_json(SETTINGS.TEMP_DISCOURSE_JSON)
+			print(f"[Checkpoint] imported {imported} posts from {SETTINGS.TEMP_DISCOURSE_JSON}")
+
+	return CHECKPOINT
@@ -0,0 +1,24 @@
+import re
+
+# ############## [ END IMPORTS ] ##############
+
+
+_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def estimate_tokens(text: str) -> int:
+	"""
+	Cheap estimate of the number of `cl100k`-style tokens in `text`.
+
+	Every punctuation mark counts as one token and every word as one token per ~4
+	characters, which tracks the real tokenizer closely enough for budgeting prompts
+	and sizing chunks without pulling in a tokenizer dependency.
+
+	Parameters:
+		text (str): Text to measure.
+
+	Returns:
+		int: Estimated token count.
+	"""
+
+	return sum((len(piece) + 3) // 4 for piece in _PIECES.findall(text))
@@ -1,5 +1,28 @@
+import os
+from typing import Callable
+
+from pydantic import Field
 from pydantic_settings import BaseSettings
 
+
+def auth_file(filename: str) -> Callable[[], str]:
+	"""
+	Default of a secret setting: the stripped content of `./.auth/<filename>`, read when the settings
+	are created and only if the setting is not given in the environment; empty if the file is missing.
+	"""
+
+	def read() -> str:
+		path = os.path.join('.', '.auth', filename)
+		if not os.path.exists(path):
+			return ''
+
+		# A trailing newline would make the token an invalid header value
+		with open(path) as f:
+			return f.read().strip()
+
+	return read
+
+
 class Settings(BaseSettings):
 	"""
 	Application configuration using Pydantic BaseSettings.
@@ -11,44 +34,187 @@ class Settings(BaseSettings):
 	Attributes:
 		APP_NAME (str): Project name/identifier.
 		DEBUG (bool): Toggle for debug behavior (prints, log viewing, etc.).
+		SERVER_WORKERS (int): Worker processes of `python server.py`; they all map the same KB index.
 
 		DISCOURSE_URL (str): URL of the Discourse forum (IITM ODL).
-		DISCOURSE_AUTH_TOKEN (str): Authentication token for Discourse access.
-		DISCOURSE_SESSION_TOKEN (str): Session cookie for forum scraping.
+		DISCOURSE_AUTH_TOKEN (str): Authentication token for Discourse access; `./.auth/auth_token.cookie` by default.
+		DISCOURSE_SESSION_TOKEN (str): Session cookie for forum scraping; `./.auth/forum_session.cookie` by default.
 
 		OUTPUT_FOLDER_C_CONTENT (str): Path for storing scraped course content.
 		OUTPUT_FOLDER_D_CONTENT (str): Path for storing scraped forum content.
-		TEMP_DISCOURSE_JSON (str): Temporary JSON file for intermediate Discourse data.
+		TEMP_DISCOURSE_JSON (str): JSON checkpoint of older versions, imported into `DISCOURSE_CHECKPOINT_DB` once.
+		DISCOURSE_CHECKPOINT_DB (str): SQLite checkpoint of the scraped posts, the sync watermarks and the delta log for `form_kb(delta=True)`.
+		DISCOURSE_CONCURRENCY (int): Topics scraped at the same time.
+		DISCOURSE_RATE (float): Requests per second allowed to Discourse (token bucket); 0 for no limit.
+		DISCOURSE_BURST (int): Requests that may be sent back to back before the rate applies.
+		DISCOURSE_POSTS_PER_REQUEST (int): Post ids asked for in one `posts.json` request.
+		DISCOURSE_MAX_RETRIES (int): Attempts after the first one for a throttled or failed request.
+		DISCOURSE_DATE_FROM (str): Topics created from this date ('YYYY-MM-DD' or ISO datetime) are scraped.
+		DISCOURSE_DATE_TO (str): ... up to this one.
 
 		OUTPUT_FORMATTED_KB_DATA (str): Directory to save the cleaned/structured KB output.
-
-		AIPIPE_API_KEY (str): API key for communicating with the AI pipeline.
-
-		KB_EMBEDDINGS_DATA_JSON (str): File path for knowledge base with vector embeddings.
+		KB_FORMATTED_DATA (str): JSONL file of the cleaned/structured KB records.
+		CHUNK_MAX_TOKENS (int): Token budget of a KB passage; longer posts/pages are split.
+		CHUNK_OVERLAP_TOKENS (int): Tokens repeated between consecutive passages of a section.
+		KB_FORMAT_WORKERS (int): Processes chunking and cleaning the KB records; 0 for one per CPU.
+		KB_FORMAT_CHUNK (int): Posts/pages handed to a formatting process at a time.
+
+		AIPIPE_API_KEY (str): API key for communicating with the AI pipeline; `./.auth/aipipe.token` by default.
+		AIPIPE_BASE_URL (str): Base URL of the OpenAI-compatible AIPIPE endpoints.
+
+		HTTP_POOL_MAX_CONNECTIONS (int): Upper bound of open upstream connections per worker.
+		HTTP_POOL_MAX_KEEPALIVE (int): Idle connections kept alive for reuse.
+		HTTP_KEEPALIVE_EXPIRY (float): Seconds an idle connection is kept before closing it.
+		HTTP_CONNECT_TIMEOUT (float): Seconds allowed to establish an upstream connection.
+		HTTP_READ_TIMEOUT (float): Seconds allowed for an upstream response (LLM round trip).
+		HTTP_POOL_TIMEOUT (float): Seconds a request may wait for a free pooled connection.
+
+		EMBED_CACHE_SIZE (int): Question embeddings kept in the in-memory LRU cache.
+		EMBED_CACHE_TTL (float): Seconds a cached question embedding stays valid.
+		EMBED_CACHE_DB (str): SQLite file for the persistent embedding cache tier; empty to disable.
+
+		SEARCH_N_RESULTS (int): KB chunks retrieved per question.
+		SEARCH_HYBRID (bool): Fuse BM25 (lexical) results with the vector results.
+		SEARCH_CANDIDATES (int): Results taken from each retriever before fusion.
+		RRF_K (int): Damping constant of the reciprocal-rank fusion.
+		BM25_K1 (float): BM25 term-frequency saturation.
+		BM25_B (float): BM25 document-length normalisation.
+
+		CONTEXT_TOKEN_BUDGET (int): Maximum estimated tokens of KB chunks sent with a question.
+		CONTEXT_MAX_OVERLAP (float): Share of a chunk already covered by better ones above which it is dropped as a duplicate.
+		CONTEXT_MIN_TRUNCATED_TOKENS (int): Smallest truncated chunk still worth sending.
+
+		ANSWER_CACHE_SIZE (int): Answers kept by the semantic answer cache; 0 disables it.
+		ANSWER_CACHE_MIN_SIMILARITY (float): Cosine similarity a new question needs to reuse a cached answer.
+		ANSWER_CACHE_TTL (float): Seconds a cached answer stays valid.
+
+		KB_EMBEDDINGS_DATA_JSON (str): JSONL records of the knowledge base; their embeddings live in the sibling `.f32` file.
+		VECTOR_BACKEND (str): Retrieval backend serving the KB index, `numpy` or `chroma`.
+		VECTOR_DTYPE (str): Storage of the `numpy` backend's matrix, `float32`, `float16` or `int8`.
+		KB_INDEX_DIR (str): Directory of the persistent, memory-mapped index built from the KB embeddings.
+
+		EMBED_BATCH_SIZE (int): Texts packed into each embeddings request while building the KB.
+		EMBED_CONCURRENCY (int): Embeddings requests in flight at once while building the KB.
+		EMBED_MAX_RETRIES (int): Retries of a batch on 429/5xx or network errors, with backoff.
+		KB_EMBED_STORE_DB (str): SQLite store of KB embeddings keyed by content hash, for incremental builds.
+
+		BATCH_MAX_QUESTIONS (int): Most questions accepted by one `/api/ask/batch` request.
+		BATCH_CONCURRENCY (int): LLM calls in flight at once while answering a batch.
+
+		TESSERACT_CMD (str): Path of the tesseract binary; empty to use the one on `PATH`.
+		OCR_WORKERS (int): Worker processes running OCR of question images.
+		OCR_PREWARM (bool): Start the OCR workers with the server instead of on the first image question.
+		OCR_QUEUE_SIZE (int): Images that may wait for an OCR worker before new ones are skipped.
+		OCR_TIMEOUT (float): Seconds an image may take to OCR, queueing included.
+		OCR_MAX_SIDE (int): Images are scaled down to this longest side (pixels) before OCR; 0 to disable.
+		OCR_CACHE_SIZE (int): OCR results of distinct images kept in memory.
+		OCR_CACHE_TTL (float): Seconds a cached OCR result stays valid.
+		OCR_CACHE_DB (str): SQLite file for the persistent OCR cache tier; empty to disable.
 
 		KB_API_LOG_PATH (str): Directory for storing daily API call logs.
 		QUESTION_LOG_PATH (str): Directory for saving incoming question records.
+		QUESTION_IMAGE_PATH (str): Directory for the images of questions, stored once per content hash.
+		LOG_QUEUE_SIZE (int): Log records that may wait for the writer thread before new ones are dropped.
+		LOG_FLUSH_RECORDS (int): Queued records that trigger a write.
+		LOG_FLUSH_INTERVAL (float): Seconds a record may wait before it is written.
+		LOG_MAX_FILE_BYTES (int): Size after which a daily log file continues in a new part.
+
+		METRICS_WINDOW (int): Recent observations per stage the `/metrics` percentiles are computed from.
+		METRICS_DIR (str): Folder where every server worker shares its metrics, so that `/metrics` reports all of them; empty for per-process metrics.
+		METRICS_SHARE_INTERVAL (float): Seconds between two writes of a worker's metrics into `METRICS_DIR`.
 	"""
 
 
 	APP_NAME				:	str		=	'TDS TA - May \'25 Project'
 	DEBUG					:	bool	=	True
+	SERVER_WORKERS			:	int		=	1
 
 	DISCOURSE_URL			:	str		=	'https://discourse.onlinedegree.iitm.ac.in'
-	DISCOURSE_AUTH_TOKEN	:	str		=	open('./.auth/auth_token.cookie').read()
-	DISCOURSE_SESSION_TOKEN	:	str		=	open('./.auth/forum_session.cookie').read()
+	DISCOURSE_AUTH_TOKEN	:	str		=	Field(default_factory=auth_file('auth_token.cookie'))
+	DISCOURSE_SESSION_TOKEN	:	str		=	Field(default_factory=auth_file('forum_session.cookie'))
 
 	OUTPUT_FOLDER_C_CONTENT	:	str		=	'./scraping-output/course_content'
 	OUTPUT_FOLDER_D_CONTENT	:	str		=	'./scraping-output/discourse_content'
 	TEMP_DISCOURSE_JSON		:	str		=	'./inner-loop.json'
+	DISCOURSE_CHECKPOINT_DB	:	str		=	'./scraping-output/discourse_content/__scrape_checkpoint.sqlite3'
+	DISCOURSE_CONCURRENCY	:	int		=	4
+	DISCOURSE_RATE			:	float	=	3.0
+	DISCOURSE_BURST			:	int		=	6
+	DISCOURSE_POSTS_PER_REQUEST:	int	=	20
+	DISCOURSE_MAX_RETRIES	:	int		=	5
+	DISCOURSE_DATE_FROM		:	str		=	'2025-01-01'
+	DISCOURSE_DATE_TO		:	str		=	'2025-04-14'
 
 	OUTPUT_FORMATTED_KB_DATA:	str		=	'./scraping-output'
-
-	AIPIPE_API_KEY			:	str		=	open('./.auth/aipipe.token').read()
-
-	KB_EMBEDDINGS_DATA_JSON	:	str		=	'./scraping-output/kb_with_embeddings.json'
+	KB_FORMATTED_DATA		:	str		=	'./scraping-output/formatted_scraped_kb.jsonl'
+	CHUNK_MAX_TOKENS		:	int		=	400
+	CHUNK_OVERLAP_TOKENS	:	int		=	50
+	KB_FORMAT_WORKERS		:	int		=	0
+	KB_FORMAT_CHUNK			:	int		=	64
+
+	AIPIPE_API_KEY			:	str		=	Field(default_factory=auth_file('aipipe.token'))
+	AIPIPE_BASE_URL			:	str		=	'https://aipipe.org/openai/v1'
+
+	HTTP_POOL_MAX_CONNECTIONS:	int		=	200
+	HTTP_POOL_MAX_KEEPALIVE	:	int		=	50
+	HTTP_KEEPALIVE_EXPIRY	:	float	=	30.0
+	HTTP_CONNECT_TIMEOUT	:	float	=	5.0
+	HTTP_READ_TIMEOUT		:	float	=	60.0
+	HTTP_POOL_TIMEOUT		:	float	=	10.0
+
+	EMBED_CACHE_SIZE		:	int		=	4096
+	EMBED_CACHE_TTL			:	float	=	7 * 24 * 3600
+	EMBED_CACHE_DB			:	str		=	'./CACHE/question_embeddings.sqlite3'
+
+	SEARCH_N_RESULTS		:	int		=	6
+	SEARCH_HYBRID			:	bool	=	True
+	SEARCH_CANDIDATES		:	int		=	30
+	RRF_K					:	int		=	60
+	BM25_K1					:	float	=	1.2
+	BM25_B					:	float	=	0.75
+
+	CONTEXT_TOKEN_BUDGET	:	int		=	3000
+	CONTEXT_MAX_OVERLAP		:	float	=	0.8
+	CONTEXT_MIN_TRUNCATED_TOKENS:	int		=	64
+
+	ANSWER_CACHE_SIZE		:	int		=	1024
+	ANSWER_CACHE_MIN_SIMILARITY:	float	=	0.97
+	ANSWER_CACHE_TTL		:	float	=	24 * 3600
+
+	KB_EMBEDDINGS_DATA_JSON	:	str		=	'./scraping-output/kb_with_embeddings.jsonl'
+	VECTOR_BACKEND			:	str		=	'numpy'
+	VECTOR_DTYPE			:	str		=	'float32'
+	KB_INDEX_DIR			:	str		=	'./scraping-output/kb_index'
+
+	EMBED_BATCH_SIZE		:	int		=	128
+	EMBED_CONCURRENCY		:	int		=	4
+	EMBED_MAX_RETRIES		:	int		=	6
+	KB_EMBED_STORE_DB		:	str		=	'./scraping-output/kb_embedding_store.sqlite3'
+
+	BATCH_MAX_QUESTIONS		:	int		=	200
+	BATCH_CONCURRENCY		:	int		=	8
+
+	TESSERACT_CMD			:	str		=	''
+	OCR_WORKERS				:	int		=	2
+	OCR_PREWARM				:	bool	=	False
+	OCR_QUEUE_SIZE			:	int		=	8
+	OCR_TIMEOUT				:	float	=	20.0
+	OCR_MAX_SIDE			:	int		=	2000
+	OCR_CACHE_SIZE			:	int		=	1024
+	OCR_CACHE_TTL			:	float	=	30 * 24 * 3600
+	OCR_CACHE_DB			:	str		=	'./CACHE/ocr_text.sqlite3'
 
 	KB_API_LOG_PATH			:	str		=	'./LOGS/API-CALL-LOGS'
 	QUESTION_LOG_PATH		:	str		=	'./LOGS/QA-ARCHIVE'
+	QUESTION_IMAGE_PATH		:	str		=	'./LOGS/QA-ARCHIVE/images'
+
+	LOG_QUEUE_SIZE			:	int		=	10000
+	LOG_FLUSH_RECORDS		:	int		=	200
+	LOG_FLUSH_INTERVAL		:	float	=	2.0
+	LOG_MAX_FILE_BYTES		:	int		=	50 * 1024 * 1024
+
+	METRICS_WINDOW			:	int		=	2048
+	METRICS_DIR				:	str		=	'./CACHE/metrics'
+	METRICS_SHARE_INTERVAL	:	float	=	5.0
 
 SETTINGS = Settings()
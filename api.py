@@ -1,16 +1,27 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, AsyncIterator, TYPE_CHECKING
 
-import requests
-import re
+import json
+import time
+import asyncio
+import hashlib
 
 from ams.settings import SETTINGS
-
-from chromadb.api.types import QueryResult
 from ams.methods.init_vectorDB import getCol
-from ams.methods.accessabilty import trackAPICalls, extract_text_from_base64_image, save_question_data
+from ams.methods.bm25 import getBM25, rrf_fuse
+from ams.methods.context import assemble_context
+from ams.methods.metrics import getMetrics, span
+from ams.methods.http_client import getHTTPClient
+from ams.methods.caching import getEmbeddingCache, getAnswerCache, getOCRCache, normalize_question, cache_key
+from ams.methods.ocr import getOCRService, decode_image, clean_ocr_text
+from ams.methods.accessabilty import trackAPICalls, save_question_data
+
+# Only the type: importing `chromadb` costs more than the rest of the server's imports
+if TYPE_CHECKING:
+	from chromadb.api.types import QueryResult
 
 # ############## [ END IMPORTS ] ##############
 
@@ -20,25 +31,92 @@ class QuestionFormat(BaseModel):
 	question	:	str
 	image		:	Optional[str] = None	# base64-encoded image (optional)
 
-def searchKB(query_embedding: list[float]) -> QueryResult:
+class BatchQuestionFormat(BaseModel):
+	questions	:	list[QuestionFormat]
+
+def fuseWithBM25(results: 'QueryResult', query_texts: list[str]) -> 'QueryResult':
+	"""
+	Re-ranks the vector results of each query together with the BM25 results of its text
+	(reciprocal-rank fusion) and keeps the best `SETTINGS.SEARCH_N_RESULTS`
+
+	The `distances` of the fused result are `1 - score / best possible score`: lower is
+	still better, and 0 for a row ranked first by both retrievers.
+
+	Parameters
+		`results: QueryResult` vector results, `SETTINGS.SEARCH_CANDIDATES` per query
+		`query_texts: list[str]` the text of each query
+
+	Returns
+		`QueryResult` of the fused rows, best first
+	"""
+
+	fused	=	{'ids': [], 'distances': [], 'metadatas': [], 'documents': None, 'embeddings': None}
+	best	=	2.0 / (SETTINGS.RRF_K + 1)
+
+	for ids, metadatas, text in zip(results['ids'], results['metadatas'], query_texts):
+		vector_rows		=	[int(i.removeprefix('doc_')) for i in ids]
+		lexical_rows, _	=	getBM25().query(text, SETTINGS.SEARCH_CANDIDATES)
+
+		picked = rrf_fuse([vector_rows, lexical_rows], SETTINGS.SEARCH_N_RESULTS)
+
+		# Rows found only by BM25 have no metadata in the vector results yet
+		known	=	dict(zip(ids, metadatas))
+		missing	=	[f"doc_{row}" for row, _ in picked if f"doc_{row}" not in known]
+		if missing:
+			extra = getCol().get(ids=missing)
+			known.update(zip(extra['ids'], extra['metadatas']))
+
+		fused['ids'].append([f"doc_{row}" for row, _ in picked])
+		fused['distances'].append([1.0 - score / best for _, score in picked])
+		fused['metadatas'].append([known[f"doc_{row}"] for row, _ in picked])
+
+	return fused
+
+def searchKB(query_embedding: list[float], query_text: Optional[str] = None) -> 'QueryResult':
 	"""
 	Searches the stored VectorDB
 
 	Parameters
 		`query_embeddings: list[float]` takes the embedding associated with the question asked and serach it into the 'KB' initialized
+		`query_text: str` the text of the question, for the keyword (BM25) half of hybrid search (optional)
 
 	Returns
 		`QueryResult` object containing the expected results
 	"""
 
+	return searchKBBatch([query_embedding], None if query_text is None else [query_text])[0]
+
+def searchKBBatch(query_embeddings: list[list[float]], query_texts: Optional[list[str]] = None) -> list['QueryResult']:
+	"""
+	Searches the stored VectorDB for many questions with a single query
+
+	Parameters
+		`query_embeddings: list[list[float]]` the embeddings of the questions
+		`query_texts: list[str]` their texts, for hybrid search (optional)
+
+	Returns
+		`list[QueryResult]` one single-question result per embedding, shaped like `searchKB`'s
+	"""
+
+	if not query_embeddings:
+		return []
+
+	hybrid = query_texts is not None and getBM25() is not None
+
 	results = getCol().query(
-		query_embeddings=[query_embedding],
-		n_results=9
+		query_embeddings=query_embeddings,
+		n_results=SETTINGS.SEARCH_CANDIDATES if hybrid else SETTINGS.SEARCH_N_RESULTS
 	)
-	
-	return results
 
-def makeQEmbeds(q: str) -> list[float]:
+	if hybrid:
+		results = fuseWithBM25(results, query_texts)
+
+	return [
+		{'ids': [results['ids'][i]], 'distances': [results['distances'][i]], 'metadatas': [results['metadatas'][i]]}
+		for i in range(len(query_embeddings))
+	]
+
+async def makeQEmbeds(q: str) -> list[float]:
 	"""
 	Make embeddings of the provided text. [context: embeddings of the asked question]
 
@@ -49,9 +127,14 @@ def makeQEmbeds(q: str) -> list[float]:
 		`list[float]` object containing the returned embeddings for the passed string (question)
 	"""
 
-	response = requests.post(
-		"https://aipipe.org/openai/v1/embeddings",
-		headers={"Authorization": f"Bearer {SETTINGS.AIPIPE_API_KEY}"},
+	# Repeated questions are served from the cache, skipping the round trip and the token cost
+	key = cache_key("text-embedding-3-small", normalize_question(q))
+	cached = await getEmbeddingCache().aget(key)
+	if cached is not None:
+		return cached
+
+	response = await getHTTPClient().post(
+		"/embeddings",
 		json={"model": "text-embedding-3-small", "input": q}
 	)
 
@@ -65,23 +148,107 @@ def makeQEmbeds(q: str) -> list[float]:
 	)
 
 
-	return data["data"][0]["embedding"]
+	embedding : list[float] = data["data"][0]["embedding"]
+	await getEmbeddingCache().aset(key, embedding)
+
+	return embedding
 
-def generateChatAnswer(student_prompt: str, source_text: list[str], image_text :str = '') -> str:
+async def makeQEmbedsBatch(qs: list[str]) -> list[list[float]]:
 	"""
-	Function to generate a complete response based on the provided context of sources and image's text
+	Batch twin of `makeQEmbeds`: cached questions are skipped and all the others (de-duplicated)
+	are embedded with a single embeddings call
 
 	Parameters
-		`student_prompt: str` Question asked by the student
-		`source_text: list[str]` Sources/references for the asked question based on the cosine similarity
-		`image_text: str` extracted text from omage (optional)
-		
+		`qs: list[str]` the strings to embed
 
 	Returns
-		`str` object or simply the answer string
+		`list[list[float]]` one embedding per string, in order
 	"""
 
-	strict_prompt = """
+	keys		=	[cache_key("text-embedding-3-small", normalize_question(q)) for q in qs]
+	embeddings	=	await getEmbeddingCache().aget_many(keys)
+
+	missing = {}
+	for q, key, embedding in zip(qs, keys, embeddings):
+		if embedding is None and key not in missing:
+			missing[key] = q
+
+	if missing:
+		response = await getHTTPClient().post(
+			"/embeddings",
+			json={"model": "text-embedding-3-small", "input": list(missing.values())}
+		)
+
+		data = response.json()
+
+		info = {"total_tokens": data['usage']['total_tokens']}
+		trackAPICalls(
+			method		=	'makeQEmbedsBatch'
+			, resp_data	=	{'usage': data['usage'], 'items': len(missing)}
+			, usage_info=	info
+		)
+
+		fetched = {key: item["embedding"] for key, item in zip(missing, sorted(data["data"], key=lambda d: d["index"]))}
+		await getEmbeddingCache().aset_many(fetched)
+
+		embeddings = [embedding if embedding is not None else fetched[key] for key, embedding in zip(keys, embeddings)]
+
+	return embeddings
+
+# OCR of an image already being processed, so identical concurrent uploads share one run
+OCR_IN_FLIGHT : dict[str, asyncio.Future] = {}
+
+async def extractImageText(image: str) -> str | None:
+	"""
+	OCR text of a question's image, cleaned of junk symbols. [context: text of an uploaded screenshot]
+
+	Results are cached by the hash of the decoded image bytes, so the same screenshot
+	uploaded by many students is OCRed once.
+
+	Parameters
+		`image: str` base64-encoded image (or `data:` URL)
+
+	Returns
+		`str | None` the cleaned text, or `None` if there is no usable text
+	"""
+
+	image_data = decode_image(image)
+	if not image_data:
+		return None
+
+	key = cache_key("ocr", str(SETTINGS.OCR_MAX_SIDE), hashlib.sha256(image_data).hexdigest())
+	cached = await getOCRCache().aget(key)
+	if cached is not None:
+		return cached or None
+
+	if key in OCR_IN_FLIGHT:
+		return await asyncio.shield(OCR_IN_FLIGHT[key])
+
+	future = asyncio.get_running_loop().create_future()
+	OCR_IN_FLIGHT[key] = future
+
+	try:
+		raw_text = await getOCRService().extract_text(image_data)
+
+		# A skipped or failed OCR is not cached, the next upload tries again
+		image_text = None if raw_text is None else clean_ocr_text(raw_text)
+		if image_text is not None:
+			await getOCRCache().aset(key, image_text)
+
+		future.set_result(image_text or None)
+
+	except BaseException:
+		# e.g. this request was cancelled; the others sharing the run go on without image text
+		if not future.done():
+			future.set_result(None)
+		raise
+
+	finally:
+		del OCR_IN_FLIGHT[key]
+
+	return future.result()
+
+STRICT_PROMPT = """
 You are a Teaching Assistant (TA) for the "Tools in Data Science" (TDS) course at IIT Madras. You are helping students by answering their course-related questions accurately and concisely.
 
 ---
@@ -122,10 +289,24 @@ Student Question:
 Your Answer:
 {{Your Answer}}
 """
+
+def buildChatInput(student_prompt: str, source_text: list[str], image_text: str = '') -> list[dict]:
+	"""
+	Builds the `input` messages for the `/responses` call out of the prompt, the sources and the image's text
+
+	Parameters
+		`student_prompt: str` Question asked by the student
+		`source_text: list[str]` Sources/references for the asked question based on the cosine similarity
+		`image_text: str` extracted text from omage (optional)
+
+	Returns
+		`list[dict]` role/content messages
+	"""
+
 	inps = [
 		{
 			'role': 'system'
-			, 'content': strict_prompt
+			, 'content': STRICT_PROMPT
 		},
 		{
 			'role': 'user'
@@ -151,9 +332,27 @@ Your Answer:
 		, 'content': 'Student Question: ' + student_prompt
 	})
 
-	response = requests.post(
-		"https://aipipe.org/openai/v1/responses",
-		headers={"Authorization": f"Bearer {SETTINGS.AIPIPE_API_KEY}"},
+	return inps
+
+async def generateChatAnswer(student_prompt: str, source_text: list[str], image_text :str = '', usage_out: Optional[dict] = None) -> str:
+	"""
+	Function to generate a complete response based on the provided context of sources and image's text
+
+	Parameters
+		`student_prompt: str` Question asked by the student
+		`source_text: list[str]` Sources/references for the asked question based on the cosine similarity
+		`image_text: str` extracted text from omage (optional)
+		`usage_out: dict` if given, filled with the usage info of the call (optional)
+		
+
+	Returns
+		`str` object or simply the answer string
+	"""
+
+	inps = buildChatInput(student_prompt, source_text, image_text)
+
+	response = await getHTTPClient().post(
+		"/responses",
 		json={"model": "gpt-4o-mini", "input": inps}
 	)
 
@@ -166,55 +365,211 @@ Your Answer:
 		, usage_info=	info
 	)
 
+	if usage_out is not None:
+		usage_out.update(info)
+
 	answer :str = data['output'][0]['content'][0]['text']
 
 
 	return answer
 
-@router.post('/api/ask/')
-@router.post('/api/ask')
-def ask_question(Q: QuestionFormat) -> dict:
+async def streamChatAnswer(student_prompt: str, source_text: list[str], image_text: str = '', usage_out: Optional[dict] = None) -> AsyncIterator[str]:
 	"""
-	Parameter
-	`Q: QuestionFormat` the required post data to be processed
+	Streaming twin of `generateChatAnswer`, yields the answer text deltas as the upstream produces them
+
+	Parameters
+		`student_prompt: str` Question asked by the student
+		`source_text: list[str]` Sources/references for the asked question based on the cosine similarity
+		`image_text: str` extracted text from omage (optional)
+		`usage_out: dict` if given, filled with the usage info once the stream completes (optional)
 
 	Returns
-	`dict` (JSON) response
+		`AsyncIterator[str]` of answer text deltas
 	"""
 
-	image_text  = None
+	inps = buildChatInput(student_prompt, source_text, image_text)
 
-	# print("Q: ", Q.question)
+	async with getHTTPClient().stream(
+		"POST",
+		"/responses",
+		json={"model": "gpt-4o-mini", "input": inps, "stream": True}
+	) as response:
+		async for line in response.aiter_lines():
+			if not line.startswith('data:'):
+				continue
 
-	if Q.image:
-		image_text = extract_text_from_base64_image(Q.image)
+			payload = line[len('data:'):].strip()
+			if not payload or payload == '[DONE]':
+				continue
 
-		if image_text:
-			# print("I: ", Q.image[:20:] + ' ... ' + Q.image[-20::])
-			image_text = re.sub(r'[^a-zA-Z0-9\s.,:;?!%-]', '', image_text)  # remove junk symbols
-			image_text = re.sub(r'\s+', ' ', image_text)  # normalize spacing
+			event = json.loads(payload)
 
-			if len(image_text.split()) < 5:
-				image_text = None
-	# endif
+			if event.get('type') == 'response.output_text.delta':
+				yield event.get('delta', '')
 
-	save_question_data(Q.question, Q.image)
+			elif event.get('type') == 'response.completed':
+				data = event['response']
 
-	if image_text is not None:
-		CS_result	=	searchKB(makeQEmbeds(Q.question + '\n' + image_text))
-		chat_answer	=	generateChatAnswer(Q.question, [y['text'] for y in CS_result['metadatas'][0]], image_text if (len(image_text) > 0) else '')
-	else:
-		CS_result	=	searchKB(makeQEmbeds(Q.question))
-		chat_answer	=	generateChatAnswer(Q.question, [y['text'] for y in CS_result['metadatas'][0]])
+				# Usage is only known once the whole answer has been generated
+				info = {"total_tokens": data['usage']['total_tokens']}
+				trackAPICalls(
+					method		=	'streamChatAnswer'
+					, resp_data	=	data
+					, usage_info=	info
+				)
 
-	generated_answer = chat_answer
-	sources = []
+				if usage_out is not None:
+					usage_out.update(info)
+
+def buildQuestionContext(image_text: Optional[str], q_embedding: list[float], CS_result: 'QueryResult') -> dict:
+	"""
+	Turns the KB search result of one question into what answering it needs: the budgeted context and the sources
+
+	Parameters
+		`image_text: str` cleaned text of the question's image, if any
+		`q_embedding: list[float]` embedding of the question
+		`CS_result: QueryResult` its `searchKB` result
+
+	Returns
+		`dict` with the `image_text`, `q_embedding`, `CS_result`, `context` (budgeted source texts), `source_ids`, `kb_version` and `sources`
+	"""
+
+	sources		=	[]
+
+	# Only as many (de-duplicated, best first) chunks as fit the prompt budget go to the LLM
+	with span("context"):
+		context, context_stats = assemble_context(CS_result['metadatas'][0], CS_result['distances'][0])
+
+	if SETTINGS.DEBUG:
+		print(f"[Context] {context_stats['kept']}/{context_stats['candidates']} chunks | {context_stats['used_tokens']}/{context_stats['budget_tokens']} tokens ({context_stats['utilisation']:.0%}) | {context_stats['duplicates']} duplicate, {context_stats['truncated']} truncated, {context_stats['over_budget']} over budget")
 
 	for doc in CS_result['metadatas'][0]:
 		sources.append({
 			"url": doc["url"],
 			"text": doc["text"]
 		})
+
+	return {
+		'image_text': image_text
+		, 'q_embedding': q_embedding
+		, 'CS_result': CS_result
+		, 'context': context
+		, 'source_ids': CS_result['ids'][0]
+		, 'kb_version': getCol().version
+		, 'sources': sources
+	}
+
+def embeddingInput(Q: QuestionFormat, image_text: Optional[str]) -> str:
+	"""
+	The text embedded for a question: the question itself plus its image's text, if any
+	"""
+
+	return Q.question + '\n' + image_text if image_text is not None else Q.question
+
+async def prepareQuestion(Q: QuestionFormat) -> dict:
+	"""
+	Everything `/api/ask` does before the LLM call: OCR of the image, logging, embedding and KB search
+
+	Parameters
+		`Q: QuestionFormat` the required post data to be processed
+
+	Returns
+		`dict` as returned by `buildQuestionContext`
+	"""
+
+	image_text  = None
+
+	# print("Q: ", Q.question)
+
+	if Q.image:
+		# OCR is CPU-bound and blocking, it runs in its own bounded process pool (and is cached by image)
+		with span("ocr"):
+			image_text = await extractImageText(Q.image)
+	# endif
+
+	save_question_data(Q.question, Q.image)
+
+	q_text = embeddingInput(Q, image_text)
+
+	with span("embed"):
+		q_embedding	=	await makeQEmbeds(q_text)
+
+	with span("search"):
+		CS_result	=	searchKB(q_embedding, q_text)
+
+	return buildQuestionContext(image_text, q_embedding, CS_result)
+
+async def prepareQuestions(Qs: list[QuestionFormat]) -> list[dict]:
+	"""
+	Batch twin of `prepareQuestion`: the images are OCRed concurrently, then all the questions
+	are embedded with one embeddings call and searched with one multi-query KB search
+
+	Parameters
+		`Qs: list[QuestionFormat]` the questions
+
+	Returns
+		`list[dict]` one `buildQuestionContext` result per question, in order
+	"""
+
+	async def ocr(Q: QuestionFormat) -> Optional[str]:
+		if not Q.image:
+			return None
+
+		with span("ocr"):
+			return await extractImageText(Q.image)
+
+	image_texts = await asyncio.gather(*(ocr(Q) for Q in Qs))
+
+	for Q in Qs:
+		save_question_data(Q.question, Q.image)
+
+	q_texts = [embeddingInput(Q, t) for Q, t in zip(Qs, image_texts)]
+
+	with span("embed_batch"):
+		q_embeddings = await makeQEmbedsBatch(q_texts)
+
+	with span("search_batch"):
+		CS_results = searchKBBatch(q_embeddings, q_texts)
+
+	return [buildQuestionContext(*args) for args in zip(image_texts, q_embeddings, CS_results)]
+
+async def answerQuestion(Q: QuestionFormat, ctx: Optional[dict] = None, route: str = "ask") -> dict:
+	"""
+	Body of `/api/ask`, timed as a whole by its caller
+
+	Parameter
+	`Q: QuestionFormat` the required post data to be processed
+	`ctx: dict` its `prepareQuestion` result, if already prepared (optional)
+	`route: str` label of the calling route in the metrics
+
+	Returns
+	`dict` with the `answer` and its `links`
+	"""
+
+	if ctx is None:
+		ctx = await prepareQuestion(Q)
+
+	# Near-duplicate question over the same sources of the same KB: skip the LLM call
+	with span("answer_cache"):
+		cached = getAnswerCache().lookup(ctx['q_embedding'], ctx['source_ids'], ctx['kb_version'])
+
+	if cached is not None:
+		getMetrics().inc("tds_questions_total", route=route, cached="true")
+		return {
+			'answer': cached['answer']
+			, 'links': cached['links']
+		}
+
+	usage = {}
+	with span("llm"):
+		chat_answer	=	await generateChatAnswer(Q.question, ctx['context'], ctx['image_text'] or '', usage_out=usage)
+
+	getMetrics().inc("tds_questions_total", route=route, cached="false")
+
+	generated_answer = chat_answer
+	sources = ctx['sources']
+
+	getAnswerCache().store(ctx['q_embedding'], ctx['source_ids'], ctx['kb_version'], generated_answer, sources, usage.get('total_tokens', 0))
 	
 	final_answer : dict = {
 		'answer': generated_answer
@@ -223,4 +578,151 @@ def ask_question(Q: QuestionFormat) -> dict:
 
 	return final_answer
 
+@router.post('/api/ask/')
+@router.post('/api/ask')
+async def ask_question(Q: QuestionFormat) -> dict:
+	"""
+	Parameter
+	`Q: QuestionFormat` the required post data to be processed
+
+	Returns
+	`dict` (JSON) response
+	"""
+
+	with span("ask"):
+		return await answerQuestion(Q)
+
+def questionKey(Q: QuestionFormat) -> str:
+	"""
+	Identity of a question within a batch: its normalized text and the content hash of its image
+
+	Parameter
+	`Q: QuestionFormat` the question
+
+	Returns
+	`str` equal for questions which get the same answer
+	"""
+
+	image_data = decode_image(Q.image) if Q.image else None
+
+	return cache_key(normalize_question(Q.question), hashlib.sha256(image_data).hexdigest() if image_data else '')
+
+@router.post('/api/ask/batch/')
+@router.post('/api/ask/batch')
+async def ask_question_batch(B: BatchQuestionFormat) -> dict:
+	"""
+	Answers a whole list of questions (e.g. a graded assignment set) in one request
+
+	Repeated questions (same normalized text and image) are answered once and the answer is
+	given at each of their positions. All distinct questions are embedded with a single
+	embeddings call and searched with a single KB query; the LLM calls then run with at most
+	`SETTINGS.BATCH_CONCURRENCY` in flight. A question that fails gets an `error` instead of
+	failing the whole batch.
+
+	Parameter
+	`B: BatchQuestionFormat` the questions
+
+	Returns
+	`dict` (JSON) response with `results`, one `{answer, links}` per question, in order
+	"""
+
+	if len(B.questions) > SETTINGS.BATCH_MAX_QUESTIONS:
+		raise HTTPException(status_code=413, detail=f"At most {SETTINGS.BATCH_MAX_QUESTIONS} questions per batch")
+
+	with span("ask_batch"):
+		# Positions of each distinct question, in order of first appearance
+		groups : dict[str, list[int]] = {}
+		for i, Q in enumerate(B.questions):
+			groups.setdefault(questionKey(Q), []).append(i)
+
+		unique = [B.questions[positions[0]] for positions in groups.values()]
+
+		# The repeats are still logged, `prepareQuestions` only logs the questions it prepares
+		for positions in groups.values():
+			for i in positions[1:]:
+				save_question_data(B.questions[i].question, B.questions[i].image)
+
+		ctxs = await prepareQuestions(unique)
+		semaphore = asyncio.Semaphore(max(1, SETTINGS.BATCH_CONCURRENCY))
+
+		async def answer(Q: QuestionFormat, ctx: dict) -> dict:
+			async with semaphore:
+				try:
+					return await answerQuestion(Q, ctx, route="batch")
+				except Exception as e:
+					print(f"[Batch Error] {type(e).__name__} {e}")
+					return {'answer': None, 'links': ctx['sources'], 'error': 'The answer could not be generated.'}
+
+		answers = await asyncio.gather(*(answer(Q, ctx) for Q, ctx in zip(unique, ctxs)))
+
+		results = [None] * len(B.questions)
+		for positions, result in zip(groups.values(), answers):
+			for i in positions:
+				results[i] = dict(result)
+
+			# Served without an LLM call of their own, like an answer cache hit
+			if len(positions) > 1 and 'error' not in result:
+				getMetrics().inc("tds_questions_total", len(positions) - 1, route="batch", cached="true")
+
+	return {'results': results}
+
+def _sse(event: str, data) -> str:
+	return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post('/api/ask/stream/')
+@router.post('/api/ask/stream')
+async def ask_question_stream(Q: QuestionFormat) -> StreamingResponse:
+	"""
+	Server-sent events version of `/api/ask`: a `links` event first, then one `token` event per
+	answer delta and a final `done` event (or `error`)
+
+	Parameter
+	`Q: QuestionFormat` the required post data to be processed
+
+	Returns
+	`StreamingResponse` of `text/event-stream`
+	"""
+
+	started = time.perf_counter()
+	ctx = await prepareQuestion(Q)
+
+	async def events() -> AsyncIterator[str]:
+		cached = getAnswerCache().lookup(ctx['q_embedding'], ctx['source_ids'], ctx['kb_version'])
+		if cached is not None:
+			getMetrics().inc("tds_questions_total", route="stream", cached="true")
+			yield _sse('links', cached['links'])
+			yield _sse('token', {'text': cached['answer']})
+			yield _sse('done', {'cached': True})
+			return
+
+		yield _sse('links', ctx['sources'])
+
+		usage = {}
+		parts = []
+
+		try:
+			llm_started = time.perf_counter()
+
+			async for delta in streamChatAnswer(Q.question, ctx['context'], ctx['image_text'] or '', usage_out=usage):
+				if not parts:
+					getMetrics().observe("tds_stage_seconds", time.perf_counter() - llm_started, stage="llm_first_token")
+					getMetrics().observe("tds_stage_seconds", time.perf_counter() - started, stage="ask_stream_first_token")
+
+				parts.append(delta)
+				yield _sse('token', {'text': delta})
+
+			getMetrics().observe("tds_stage_seconds", time.perf_counter() - llm_started, stage="llm_stream")
+
+		except Exception as e:
+			print(f"[Stream Error] {e}")
+			yield _sse('error', {'message': 'The answer could not be generated completely.'})
+			return
+
+		if parts:
+			getAnswerCache().store(ctx['q_embedding'], ctx['source_ids'], ctx['kb_version'], ''.join(parts), ctx['sources'], usage.get('total_tokens', 0))
+
+		getMetrics().inc("tds_questions_total", route="stream", cached="false")
+
+		yield _sse('done', {'cached': False, 'usage': usage})
 
+	return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
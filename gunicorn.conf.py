@@ -0,0 +1,29 @@
+"""
+gunicorn settings of the multi-worker mode (Linux/macOS), run from the repo root:
+
+	gunicorn server:app -c gunicorn.conf.py
+	WEB_CONCURRENCY=8 BIND=0.0.0.0:8080 gunicorn server:app -c gunicorn.conf.py
+
+The KB index is prepared once in the master before the workers start, every worker then
+only maps the same read-only files.
+"""
+
+import os
+
+# ############## [ END IMPORTS ] ##############
+
+
+bind			=	os.environ.get("BIND", "0.0.0.0:8000")
+workers			=	int(os.environ.get("WEB_CONCURRENCY", 4))
+worker_class	=	"uvicorn.workers.UvicornWorker"
+
+# Answers wait on the LLM; a worker slower than this is restarted
+timeout			=	120
+graceful_timeout=	30
+
+
+def on_starting(server):
+	# Imported here: loading the config (e.g. `gunicorn --check-config`) should not import the whole app
+	from ams.methods.init_vectorDB import prepare_kb_index
+
+	prepare_kb_index()
@@ -6,13 +6,19 @@ Description: GPT-based (aipipe.org) Teaching Assistant (TA) LLM application for
 """
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from ams.settings import SETTINGS
-from ams.methods.init_vectorDB import initialize_vector_db
+from ams.methods.init_vectorDB import initialize_vector_db, prepare_kb_index
+from ams.methods.http_client import startup_http_client, shutdown_http_client
+from ams.methods.ocr import startup_ocr_service, shutdown_ocr_service
+from ams.methods.log_sink import startup_log_sink, shutdown_log_sink
+from ams.methods.caching import getAnswerCache, flush_caches
+from ams.methods.metrics import getMetrics, startup_metrics, shutdown_metrics
 
 import api
 
@@ -23,13 +29,34 @@ This segment is necesarry to handle the initializtion of our VectorDB when the s
 """
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-	# Only initialize once, avoid reloading or subprocess issues
-	import multiprocessing
+	# Every worker maps the same read-only index; whichever starts first builds it if needed
+	# Answers cached against an older KB build must not be served anymore
+	getAnswerCache().invalidate(keep_version=initialize_vector_db().version)
+
+	# One pooled, keep-alive HTTP client per worker for all the upstream (AIPIPE) calls
+	await startup_http_client()
+
+	# Image questions are OCRed by a few dedicated worker processes, not by the request threads
+	await startup_ocr_service()
+
+	# API-call and question logs are written in batches by a background thread
+	await startup_log_sink()
+
+	# Every worker shares its metrics, so that `/metrics` reports all of them
+	await startup_metrics()
 
-	if multiprocessing.current_process().name == "MainProcess":
-		initialize_vector_db()
 	yield
 
+	await shutdown_metrics()
+	await shutdown_ocr_service()
+	await shutdown_http_client()
+
+	# Cached embeddings / OCR texts still queued for the SQLite tiers
+	await flush_caches()
+
+	# Last, so that records of the final requests are still written
+	await shutdown_log_sink()
+
 # FastAPI Application Initializtion
 app = FastAPI(title=SETTINGS.APP_NAME, debug=SETTINGS.DEBUG, lifespan=lifespan)
 
@@ -49,6 +76,14 @@ Main route to handle the API Requests for the TDS-TA LLM
 app.include_router(api.router)
 
 
+"""
+Per-stage latency (p50/p95/p99), token counts and cache hit ratios, in the Prometheus text format
+"""
+@app.get('/metrics', response_class=PlainTextResponse)
+def metrics() -> str:
+	return getMetrics().render()
+
+
 """
 Un-comment this section if want to:
 - scrape either Discourse or Course Content Website; `scrapping`
@@ -68,7 +103,12 @@ app.mount("/", StaticFiles(directory="static", html=True), name="static")
 
 """
 Un-comment this section if want to serve on local-machine using the command: `python server.py` 
+With `SERVER_WORKERS` > 1 the index is prepared here once, then every worker only maps it
+(`gunicorn server:app -c gunicorn.conf.py` does the same on Linux)
 """
 import uvicorn
 if __name__ == '__main__':
-	uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=False)
+	if SETTINGS.SERVER_WORKERS > 1:
+		prepare_kb_index()
+
+	uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=False, workers=SETTINGS.SERVER_WORKERS)
@@ -0,0 +1,110 @@
+"""
+Benchmarks `tools/cleaning.py` against the former `clean_text` on the scraped corpus.
+
+The texts are those `form_kb` cleans: the passages `chunk_text` makes of every Discourse
+post and course page under `scraping-output/`. Every cleaned text must be byte-identical to
+the former implementation's (the run fails otherwise). Reports the best of `--repeat`
+runs of the former cleaner, the new one in this process and the new one over processes.
+Run from the repo root:
+
+	python -m tools.bench_cleaning --repeat 5
+	python -m tools.bench_cleaning --processes 4
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+from bs4 import BeautifulSoup
+
+from ams.settings import SETTINGS
+from ams.methods.kb_io import iter_json_records
+from tools.chunking import chunk_text
+from tools.cleaning import clean_text, clean_texts
+
+# ############## [ END IMPORTS ] ##############
+
+
+def former_clean_text(raw_text: str) -> str:
+	"""
+	`clean_text` as it was before `tools/cleaning.py`, the reference output.
+	"""
+
+	raw_text = re.sub(r"^---[\s\S]*?---\n", "", raw_text)
+
+	raw_text = re.sub(r"!\[.*?\]\((.*?)\)", "", raw_text)
+	raw_text = re.sub(r"\[(.*?)\]\((.*?)\)", r"\1", raw_text)
+
+	raw_text = re.sub(r"^#+\s*", "", raw_text, flags=re.MULTILINE)
+
+	raw_text = re.sub(r"\n\s*#\s*", "", raw_text)
+	raw_text = re.sub(r"\|\s*---\s*\|.*", "", raw_text)
+	raw_text = re.sub("\\n[-=_]{1,}\\n", "", raw_text)
+	raw_text = re.sub("\\n", "", raw_text)
+
+	raw_text = raw_text.replace("…", "").replace("’", "'").replace("“", '"').replace("”", '"')
+
+	raw_text = BeautifulSoup(raw_text, "html.parser").get_text()
+
+	return raw_text.strip()
+
+
+def load_corpus() -> list[str]:
+	"""
+	The raw passage texts of the scraped Discourse posts and course pages.
+	"""
+
+	raw = [item['content'] for item in iter_json_records(os.path.join(SETTINGS.OUTPUT_FOLDER_D_CONTENT, 'discourse_posts.json'))]
+
+	metadata = os.path.join(SETTINGS.OUTPUT_FOLDER_C_CONTENT, 'metadata.json')
+	if os.path.exists(metadata):
+		for filename in dict.fromkeys(item['filename'] for item in iter_json_records(metadata)):
+			with open(os.path.join(SETTINGS.OUTPUT_FOLDER_C_CONTENT, filename)) as f:
+				raw.append(f.read())
+
+	return [chunk['text'] for text in raw for chunk in chunk_text(text)]
+
+
+def best_of(repeat: int, run) -> tuple[float, list[str]]:
+	best, out = float('inf'), None
+	for _ in range(repeat):
+		started = time.perf_counter()
+		out = run()
+		best = min(best, time.perf_counter() - started)
+	return best, out
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark the KB text cleaner against the former implementation")
+	parser.add_argument("--repeat", type=int, default=3, help="runs of each cleaner, the best is reported")
+	parser.add_argument("--processes", type=int, default=None, help="worker processes of the parallel run, all the CPUs by default")
+	args = parser.parse_args()
+
+	texts = load_corpus()
+
+	former_s, expected = best_of(args.repeat, lambda: [former_clean_text(t) for t in texts])
+	serial_s, serial = best_of(args.repeat, lambda: [clean_text(t) for t in texts])
+	parallel_s, parallel = best_of(args.repeat, lambda: list(clean_texts(texts, args.processes)))
+
+	mismatches = sum(a != b for a, b in zip(expected, serial)) + sum(a != b for a, b in zip(expected, parallel))
+	with_markup = sum(('<' in t or '&' in t) for t in texts)
+
+	report = {
+		"texts": len(texts)
+		, "mb": round(sum(len(t.encode('utf-8')) for t in texts) / 1e6, 2)
+		, "texts_with_markup": with_markup
+		, "former_s": round(former_s, 3)
+		, "serial_s": round(serial_s, 3)
+		, "parallel_s": round(parallel_s, 3)
+		, "processes": args.processes or os.cpu_count()
+		, "speedup_serial": round(former_s / serial_s, 1)
+		, "speedup_parallel": round(former_s / parallel_s, 1)
+		, "identical": mismatches == 0
+	}
+
+	print(json.dumps(report, indent=2))
+
+	sys.exit(0 if mismatches == 0 else 1)
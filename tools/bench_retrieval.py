@@ -0,0 +1,112 @@
+"""
+Benchmarks the retrieval backends of `ams/methods/retrieval.py` on the built KB index.
+
+Queries are KB rows with some noise added, so they look like real question embeddings
+that land near, but not exactly on, a chunk. For every backend it reports the setup time,
+per-query latency (p50/p95/p99, one query at a time and in batches) and recall@k against
+the exact float32 search. Run from the repo root:
+
+	python -m tools.bench_retrieval --queries 500 --k 9
+	python -m tools.bench_retrieval --backends numpy:float32,numpy:int8,chroma
+"""
+
+import json
+import time
+import argparse
+
+import numpy as np
+
+from ams.methods.init_vectorDB import ensure_kb_index
+from ams.methods.retrieval import create_backend
+
+# ############## [ END IMPORTS ] ##############
+
+
+def make_queries(embeddings: np.ndarray, n: int, noise: float, seed: int = 0) -> np.ndarray:
+	"""
+	`n` unit-length query vectors: random KB rows plus gaussian noise of relative size `noise`.
+	"""
+
+	rng = np.random.default_rng(seed)
+	rows = np.asarray(embeddings[rng.integers(0, embeddings.shape[0], n)], dtype=np.float32)
+	rows /= np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+
+	queries = rows + rng.normal(0, noise / np.sqrt(rows.shape[1]), rows.shape).astype(np.float32)
+	return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def run_backend(spec: str, build_dir: str, manifest: dict, queries: np.ndarray, k: int, batch: int) -> tuple[dict, list[list[str]]]:
+	"""
+	Times one backend (`name` or `name:dtype`); returns its report and the ids found per query.
+	"""
+
+	name, _, dtype = spec.partition(':')
+
+	started = time.perf_counter()
+	backend = create_backend(build_dir, manifest, name, dtype or None)
+	setup = time.perf_counter() - started
+
+	# Warm up: page the mapped files in and let BLAS start its threads
+	backend.query(queries[:1].tolist(), n_results=k)
+
+	latencies, found = [], []
+	for q in queries:
+		started = time.perf_counter()
+		result = backend.query([q.tolist()], n_results=k)
+		latencies.append(time.perf_counter() - started)
+		found.append(result['ids'][0])
+
+	started = time.perf_counter()
+	for start in range(0, len(queries), batch):
+		backend.query(queries[start:start + batch].tolist(), n_results=k)
+	batched = (time.perf_counter() - started) / len(queries)
+
+	p50, p95, p99 = (np.quantile(latencies, [0.5, 0.95, 0.99]) * 1000).tolist()
+
+	report = {
+		"backend": spec
+		, "rows": backend.count()
+		, "setup_ms": round(setup * 1000, 1)
+		, "p50_ms": round(p50, 3)
+		, "p95_ms": round(p95, 3)
+		, "p99_ms": round(p99, 3)
+		, f"batched_{batch}_ms_per_query": round(batched * 1000, 3)
+	}
+
+	return report, found
+
+
+def recall(found: list[list[str]], exact: list[list[str]]) -> float:
+	hits = sum(len(set(f) & set(e)) for f, e in zip(found, exact))
+	total = sum(len(e) for e in exact)
+	return hits / total if total else 1.0
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Compare the latency and recall of the KB retrieval backends")
+	parser.add_argument("--backends", default="numpy:float32,numpy:float16,numpy:int8,chroma", help="comma separated `name[:dtype]` list")
+	parser.add_argument("--queries", type=int, default=300)
+	parser.add_argument("--k", type=int, default=9)
+	parser.add_argument("--batch", type=int, default=32, help="queries per call in the batched run")
+	parser.add_argument("--noise", type=float, default=0.5, help="relative size of the noise added to the sampled rows")
+	args = parser.parse_args()
+
+	build_dir, manifest = ensure_kb_index()
+	exact = None
+	reports = []
+
+	for spec in [s.strip() for s in args.backends.split(',') if s.strip()]:
+		try:
+			if exact is None:
+				reference = create_backend(build_dir, manifest, 'numpy', 'float32')
+				queries = make_queries(reference.embeddings, args.queries, args.noise)
+				exact = reference.query(queries.tolist(), n_results=args.k)['ids']
+
+			report, found = run_backend(spec, build_dir, manifest, queries, args.k, args.batch)
+			report[f"recall@{args.k}"] = round(recall(found, exact), 4)
+
+		except ImportError as e:
+			report = {"backend": spec, "skipped": f"{type(e).__name__}: {e}"}
+
+		print(json.dumps(report))
+		reports.append(report)
@@ -0,0 +1,152 @@
+"""
+Splits long Discourse posts and course pages into retrievable passages.
+
+Chunking runs on the raw text, before `clean_text` (`tools/cleaning.py`) collapses the
+newlines, so it can follow the document's structure: Markdown headings start new sections,
+sections are split into paragraphs, and only paragraphs that are still too long are cut at
+sentence and then at word boundaries. Passages are packed up to a token budget and
+consecutive passages of the same section share a small overlap, so an answer spanning a
+boundary is still retrievable.
+"""
+
+import re
+
+from ams.settings import SETTINGS
+from ams.methods.tokens import estimate_tokens
+
+# ############## [ END IMPORTS ] ##############
+
+
+FRONTMATTER	=	re.compile(r"^---[\s\S]*?---\n")
+HEADING		=	re.compile(r"^#{1,6}[ \t]+(.*?)[ \t#]*$", re.MULTILINE)
+PARAGRAPH	=	re.compile(r"\S[\s\S]*?(?=\n[ \t]*\n|\Z)")
+SENTENCE	=	re.compile(r"\S[^\n.!?]*(?:[.!?]+|\n|\Z)")
+WORD		=	re.compile(r"\S+")
+LINK		=	re.compile(r"\[(.*?)\]\((.*?)\)")
+
+
+def _pieces(pattern: re.Pattern, text: str, start: int, end: int) -> list[tuple[int, int]]:
+	return [(start + m.start(), start + m.end()) for m in pattern.finditer(text[start:end])]
+
+
+def _units(text: str, start: int, end: int, max_tokens: int) -> list[tuple[int, int, int]]:
+	"""
+	`(start, end, tokens)` spans of `text[start:end]`, each within `max_tokens` where possible:
+	paragraphs, else sentences, else windows of words.
+	"""
+
+	units = []
+
+	for p_start, p_end in _pieces(PARAGRAPH, text, start, end):
+		tokens = estimate_tokens(text[p_start:p_end])
+		if tokens <= max_tokens:
+			units.append((p_start, p_end, tokens))
+			continue
+
+		for s_start, s_end in _pieces(SENTENCE, text, p_start, p_end):
+			tokens = estimate_tokens(text[s_start:s_end])
+			if tokens <= max_tokens:
+				units.append((s_start, s_end, tokens))
+				continue
+
+			# Words themselves longer than the budget (inline base64, minified code) are cut by length
+			words = []
+			for a, b in _pieces(WORD, text, s_start, s_end):
+				words.extend((i, min(i + max_tokens * 4, b)) for i in range(a, b, max_tokens * 4))
+
+			w_start, acc = words[0][0], 0
+			for i, (a, b) in enumerate(words):
+				acc += estimate_tokens(text[a:b])
+				if acc >= max_tokens or i == len(words) - 1:
+					units.append((w_start, b, acc))
+					if i + 1 < len(words):
+						w_start, acc = words[i + 1][0], 0
+
+	return units
+
+
+def split_sections(text: str) -> list[tuple[int, int, str]]:
+	"""
+	`(start, end, heading)` of every Markdown section; text before the first heading is a
+	section with an empty heading.
+	"""
+
+	starts = [(m.start(), LINK.sub(r"\1", m.group(1)).strip()) for m in HEADING.finditer(text)]
+
+	if not starts or starts[0][0] > 0:
+		starts.insert(0, (0, ''))
+
+	return [
+		(start, starts[i + 1][0] if i + 1 < len(starts) else len(text), heading)
+		for i, (start, heading) in enumerate(starts)
+	]
+
+
+def chunk_text(raw_text: str, max_tokens: int = SETTINGS.CHUNK_MAX_TOKENS, overlap_tokens: int = SETTINGS.CHUNK_OVERLAP_TOKENS) -> list[dict]:
+	"""
+	Splits raw Markdown / plain text into passages of at most ~`max_tokens` tokens.
+
+	Parameters:
+		raw_text (str): The uncleaned text of a post or page.
+		max_tokens (int): Token budget of a passage.
+		overlap_tokens (int): Tokens repeated from the end of the previous passage of the same section.
+
+	Returns:
+		list[dict]: `{offset, heading, text}` per passage, `offset` being its position in `raw_text`.
+	"""
+
+	body_start = m.end() if (m := FRONTMATTER.match(raw_text)) else 0
+
+	if estimate_tokens(raw_text[body_start:]) <= max_tokens:
+		return [{'offset': body_start, 'heading': '', 'text': raw_text[body_start:]}]
+
+	chunks	=	[]
+	current	:	list[tuple[int, int, int]]	=	[]
+	heading	=	''
+
+	def emit() -> None:
+		if current:
+			chunks.append({'offset': current[0][0], 'heading': heading, 'text': raw_text[current[0][0]:current[-1][1]]})
+
+	for s_start, s_end, s_heading in split_sections(raw_text[body_start:]):
+		units = _units(raw_text, body_start + s_start, body_start + s_end, max_tokens)
+		if not units:
+			continue
+
+		# A new section starts a new passage unless the current one is still small
+		if current and sum(u[2] for u in current) >= max_tokens // 2:
+			emit()
+			current = []
+
+		if not current:
+			heading = s_heading
+
+		for unit in units:
+			if current and sum(u[2] for u in current) + unit[2] > max_tokens:
+				emit()
+
+				# Carry the tail of the passage over as overlap
+				overlap, acc = [], 0
+				for prev in reversed(current):
+					if acc + prev[2] > overlap_tokens:
+						break
+					overlap.insert(0, prev)
+					acc += prev[2]
+
+				# The last paragraph alone is too long: overlap with its last sentences instead
+				if not overlap and overlap_tokens > 0:
+					for a, b in reversed(_pieces(SENTENCE, raw_text, current[-1][0], current[-1][1])):
+						tokens = estimate_tokens(raw_text[a:b])
+						if acc + tokens > overlap_tokens:
+							break
+						overlap.insert(0, (a, b, tokens))
+						acc += tokens
+
+				current = overlap if acc + unit[2] <= max_tokens else []
+				heading = s_heading
+
+			current.append(unit)
+
+	emit()
+
+	return chunks
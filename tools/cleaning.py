@@ -0,0 +1,109 @@
+"""
+Cleans the Markdown of the course pages and the text of the Discourse posts into the
+single-line plain text of the KB records.
+
+`clean_text` applies the substitutions it always did, in the same order and with the same
+result, but with precompiled patterns, each pass run only when the text holds what its
+pattern needs (a pass may match what the previous one left, e.g. a link around an image, so
+they are not merged into one alternation). The HTML parser only runs on text with a tag or
+an entity in it: the Discourse posts were turned into plain text by the scraper already.
+
+`clean_texts` cleans a whole corpus over worker processes; `python -m tools.bench_cleaning`
+checks the output against the former implementation and times both.
+"""
+
+import re
+import multiprocessing
+from typing import Iterable, Iterator
+
+from bs4 import BeautifulSoup
+
+# ############## [ END IMPORTS ] ##############
+
+
+FRONTMATTER		=	re.compile(r"^---[\s\S]*?---\n")
+IMAGE			=	re.compile(r"!\[.*?\]\((.*?)\)")
+LINK			=	re.compile(r"\[(.*?)\]\((.*?)\)")
+HEADING			=	re.compile(r"^#+\s*", re.MULTILINE)
+NEWLINE_HASH	=	re.compile(r"\n\s*#\s*")
+TABLE_RULE		=	re.compile(r"\|\s*---\s*\|.*")
+RULE			=	re.compile(r"\n[-=_]{1,}\n")
+
+# Smart punctuation to plain (`str.replace` beats a `str.translate` table by far here)
+PUNCTUATION		=	(("…", ""), ("’", "'"), ("“", '"'), ("”", '"'))
+
+
+def clean_text(raw_text: str) -> str:
+	"""
+	Cleans and simplifies raw Markdown or HTML-rich text for downstream processing.
+
+	This function performs the following steps:
+		- Strips YAML frontmatter (e.g., metadata between --- markers).
+		- Removes image links in Markdown syntax.
+		- Converts Markdown hyperlinks to plain text (retaining visible link text only).
+		- Removes Markdown heading markers (e.g., `#`, `##`).
+		- Cleans up table formatting artifacts and decorative dividers.
+		- Replaces special characters like smart quotes and ellipses with plain equivalents.
+		- Removes embedded HTML tags using BeautifulSoup, if there are any.
+		- Returns a single-line, stripped plain text string.
+
+	Parameters:
+		raw_text (str): The input text that may contain Markdown, HTML, or other formatting.
+
+	Returns:
+		str: Cleaned, plain text content suitable for analysis or display.
+	"""
+
+	if raw_text.startswith("---"):
+		raw_text = FRONTMATTER.sub("", raw_text, count=1)
+
+	if "![" in raw_text:
+		raw_text = IMAGE.sub("", raw_text)
+
+	if "](" in raw_text:
+		raw_text = LINK.sub(r"\1", raw_text)
+
+	if "#" in raw_text:
+		raw_text = HEADING.sub("", raw_text)
+		raw_text = NEWLINE_HASH.sub("", raw_text)
+
+	if "|" in raw_text:
+		raw_text = TABLE_RULE.sub("", raw_text)
+
+	if "\n" in raw_text:
+		raw_text = RULE.sub("", raw_text)
+		raw_text = raw_text.replace("\n", "")
+
+	if not raw_text.isascii():
+		for char, plain in PUNCTUATION:
+			if char in raw_text:
+				raw_text = raw_text.replace(char, plain)
+
+	# Without a tag or an entity the parser gives the text back as it is (but for
+	# whitespace-only text, which the strip empties anyway)
+	if "<" in raw_text or "&" in raw_text:
+		raw_text = BeautifulSoup(raw_text, "html.parser").get_text()
+
+	return raw_text.strip()
+
+
+def clean_texts(texts: Iterable[str], processes: int | None = None, chunksize: int = 64) -> Iterator[str]:
+	"""
+	Cleans many texts over `processes` worker processes, yielding the results in order
+
+	Parameters
+		`texts: Iterable[str]` raw texts, consumed lazily
+		`processes: int | None` worker processes, all the CPUs by default; 1 cleans in this process
+		`chunksize: int` texts sent to a worker at a time
+
+	Returns
+		`Iterator[str]` the cleaned texts, in the order of `texts`
+	"""
+
+	if processes == 1:
+		yield from map(clean_text, texts)
+		return
+
+	# `spawn`: forking a process that already runs the event loop and thread pools is unsafe
+	with multiprocessing.get_context('spawn').Pool(processes) as pool:
+		yield from pool.imap(clean_text, texts, chunksize)
@@ -0,0 +1,131 @@
+"""
+A local stand-in for the AIPIPE (OpenAI-compatible) embeddings and responses endpoints, so
+the KB build and the server can be run and benchmarked offline without spending tokens.
+
+Embeddings are deterministic unit vectors derived from the SHA-256 of each input, so the
+same text always maps to the same vector. Latency and rate limiting can be simulated:
+
+	python -m tools.fake_aipipe_server --port 8765 --latency-ms 150 --rate-limit 0.05
+	python -m tools.make_embeds --bench 5000 --base-url http://127.0.0.1:8765/openai/v1
+
+`/responses` answers with a canned text after `--llm-ms`, streamed as `response.output_text.delta`
+events when asked to (see `tools/load_test.py`).
+"""
+
+import asyncio
+import hashlib
+import argparse
+import random
+import json
+from array import array
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# ############## [ END IMPORTS ] ##############
+
+
+app = FastAPI(title="Fake AIPIPE")
+
+CONFIG = {
+	"dim": 1536
+	, "latency_ms": 0.0
+	, "per_item_ms": 0.0
+	, "rate_limit": 0.0
+	, "retry_after": 1
+	, "llm_ms": 0.0
+}
+
+ANSWER = "This is a canned answer from the local AIPIPE stand-in, the same for every question."
+
+
+def fake_embedding(text: str, dim: int) -> list[float]:
+	"""
+	Deterministic unit vector for `text`, expanded from its SHA-256 digest.
+	"""
+
+	values = array('f')
+	seed = hashlib.sha256(text.encode("utf-8")).digest()
+	block = seed
+
+	while len(values) < dim:
+		block = hashlib.sha256(block + seed).digest()
+		values.extend((b - 127.5) / 127.5 for b in block)
+
+	del values[dim:]
+	norm = sum(v * v for v in values) ** 0.5 or 1.0
+
+	return [v / norm for v in values]
+
+
+@app.post("/openai/v1/embeddings")
+async def embeddings(request: Request):
+	body = await request.json()
+	inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+
+	if CONFIG["rate_limit"] and random.random() < CONFIG["rate_limit"]:
+		return JSONResponse(
+			{"error": {"message": "Rate limit reached (fake)", "type": "rate_limit"}}
+			, status_code=429
+			, headers={"Retry-After": str(CONFIG["retry_after"])}
+		)
+
+	await asyncio.sleep((CONFIG["latency_ms"] + CONFIG["per_item_ms"] * len(inputs)) / 1000)
+
+	tokens = sum(max(1, len(text) // 4) for text in inputs)
+
+	return {
+		"object": "list"
+		, "model": body.get("model", "text-embedding-3-small")
+		, "data": [
+			{"object": "embedding", "index": i, "embedding": fake_embedding(text, CONFIG["dim"])}
+			for i, text in enumerate(inputs)
+		]
+		, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+	}
+
+
+@app.post("/openai/v1/responses")
+async def responses(request: Request):
+	body = await request.json()
+	tokens = max(1, len(json.dumps(body["input"])) // 4) + len(ANSWER) // 4
+	usage = {"input_tokens": tokens - len(ANSWER) // 4, "output_tokens": len(ANSWER) // 4, "total_tokens": tokens}
+
+	if not body.get("stream"):
+		await asyncio.sleep(CONFIG["llm_ms"] / 1000)
+		return {
+			"object": "response"
+			, "model": body.get("model", "gpt-4o-mini")
+			, "output": [{"type": "message", "role": "assistant", "content": [{"type": "output_text", "text": ANSWER}]}]
+			, "usage": usage
+		}
+
+	async def events():
+		words = ANSWER.split(" ")
+		for i, word in enumerate(words):
+			await asyncio.sleep(CONFIG["llm_ms"] / 1000 / len(words))
+			delta = word if i == 0 else f" {word}"
+			yield f"data: {json.dumps({'type': 'response.output_text.delta', 'delta': delta})}\n\n"
+
+		yield f"data: {json.dumps({'type': 'response.completed', 'response': {'model': body.get('model', 'gpt-4o-mini'), 'usage': usage}})}\n\n"
+
+	return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+	import uvicorn
+
+	parser = argparse.ArgumentParser(description="Fake AIPIPE embeddings server for offline builds and benchmarks")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8765)
+	parser.add_argument("--dim", type=int, default=CONFIG["dim"])
+	parser.add_argument("--latency-ms", type=float, default=CONFIG["latency_ms"], help="fixed delay per request")
+	parser.add_argument("--per-item-ms", type=float, default=CONFIG["per_item_ms"], help="extra delay per input text")
+	parser.add_argument("--rate-limit", type=float, default=CONFIG["rate_limit"], help="fraction of requests answered with 429")
+	parser.add_argument("--retry-after", type=int, default=CONFIG["retry_after"], help="Retry-After seconds sent with a 429")
+	parser.add_argument("--llm-ms", type=float, default=CONFIG["llm_ms"], help="time to generate a /responses answer")
+	args = parser.parse_args()
+
+	CONFIG.update(dim=args.dim, latency_ms=args.latency_ms, per_item_ms=args.per_item_ms, rate_limit=args.rate_limit, retry_after=args.retry_after, llm_ms=args.llm_ms)
+
+	uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
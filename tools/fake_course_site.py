@@ -0,0 +1,136 @@
+"""
+A local stand-in for the course site, to run and benchmark `tools/scrape_web_contents.py`
+offline:
+
+	python -m tools.fake_course_site --port 8767 --pages 120 --render-ms 150
+	python tools/scrape_web_contents.py /tmp/course_mirror --base-url http://127.0.0.1:8767/2025-01/index.html
+
+Pages are generated from their number and link to a few others. Like the Docsify site, the
+article is only filled in by a script (`--render-ms` after load), and every page pulls an
+image, a web font and Google's analytics script. Pages carry an `ETag` and answer `304` to a
+matching `If-None-Match`. `POST /__edit/{n}` changes page `n`, `/__stats` reports the
+requests served.
+"""
+
+import json
+import asyncio
+import hashlib
+import argparse
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import HTMLResponse
+
+# ############## [ END IMPORTS ] ##############
+
+
+app = FastAPI(title="Fake course site")
+
+CONFIG = {
+	"pages": 120
+	, "render_ms": 150
+	, "latency_ms": 0.0
+}
+
+STATS = {"pages": 0, "not_modified": 0, "assets": 0}
+
+# Edits per page number
+EDITS = {}
+
+# 1x1 transparent GIF
+PIXEL = bytes.fromhex("47494638396101000100800000000000ffffff21f90401000000002c00000000010001000002024401003b")
+
+
+def page_name(n: int) -> str:
+	return "index" if n == 0 else f"page-{n}"
+
+
+def page_links(n: int) -> list[int]:
+	total = CONFIG["pages"]
+	return sorted({(2 * n + 1) % total, (2 * n + 2) % total, (n + 1) % total} - {n})
+
+
+def fake_page(n: int) -> str:
+	edits = EDITS.get(n, 0)
+	links = "".join(f'<li><a href="{page_name(i)}.html">Page {i}</a> (<a href="{page_name(i)}.html#usage">usage</a>)</li>' for i in page_links(n))
+	body = (
+		f"<h1>Page {n}</h1><p>How to run <code>uv run app.py</code> for GA{n % 7}.</p>"
+		+ (f"<p>Edit {edits}: use <code>uv run --with httpx</code> instead.</p>" if edits else "")
+		+ f'<h2 id="usage">Usage</h2><ul>{links}</ul><p><a href="https://example.com/outside">Elsewhere</a></p>'
+	)
+
+	return f"""<!DOCTYPE html>
+<html><head>
+<title>Page {n} - Tools in Data Science</title>
+<link rel="stylesheet" href="/assets/site.css">
+<script async src="https://www.googletagmanager.com/gtag/js?id=G-FAKE"></script>
+</head><body>
+<nav><a href="index.html">Home</a></nav>
+<article class="markdown-section" id="main"></article>
+<img src="/assets/figure-{n}.gif" alt="figure">
+<script>
+setTimeout(() => {{ document.querySelector('#main').innerHTML = {json.dumps(body)}; }}, {CONFIG["render_ms"]});
+</script>
+</body></html>"""
+
+
+@app.get("/2025-01/{name}.html")
+async def page(name: str, request: Request):
+	n = 0 if name == "index" else int(name.removeprefix("page-"))
+	if not 0 <= n < CONFIG["pages"]:
+		return HTMLResponse("Not found", status_code=404)
+
+	await asyncio.sleep(CONFIG["latency_ms"] / 1000)
+
+	html = fake_page(n)
+	etag = f'"{hashlib.sha256(html.encode()).hexdigest()[:16]}"'
+
+	if request.headers.get("if-none-match") == etag:
+		STATS["not_modified"] += 1
+		return Response(status_code=304, headers={"ETag": etag})
+
+	STATS["pages"] += 1
+	return HTMLResponse(html, headers={"ETag": etag})
+
+
+@app.get("/assets/site.css")
+async def stylesheet():
+	STATS["assets"] += 1
+	return Response(
+		"@font-face { font-family: Fake; src: url(/assets/fake.woff2) format('woff2'); } body { font-family: Fake, sans-serif; }"
+		, media_type="text/css"
+	)
+
+
+@app.get("/assets/{name}")
+async def asset(name: str):
+	STATS["assets"] += 1
+	if name.endswith(".gif"):
+		return Response(PIXEL, media_type="image/gif")
+	return Response(b"", media_type="font/woff2")
+
+
+@app.get("/__stats")
+async def stats():
+	return STATS
+
+
+@app.post("/__edit/{n}")
+async def edit(n: int):
+	EDITS[n] = EDITS.get(n, 0) + 1
+	return {"page": n, "edits": EDITS[n]}
+
+
+if __name__ == "__main__":
+	import uvicorn
+
+	parser = argparse.ArgumentParser(description="Fake course site for offline crawling and benchmarks")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8767)
+	parser.add_argument("--pages", type=int, default=CONFIG["pages"], help="pages of the site")
+	parser.add_argument("--render-ms", type=int, default=CONFIG["render_ms"], help="delay before the article is filled in")
+	parser.add_argument("--latency-ms", type=float, default=CONFIG["latency_ms"], help="fixed delay per page request")
+	args = parser.parse_args()
+
+	CONFIG.update(pages=args.pages, render_ms=args.render_ms, latency_ms=args.latency_ms)
+
+	uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
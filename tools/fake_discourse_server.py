@@ -0,0 +1,212 @@
+"""
+A local stand-in for the parts of the Discourse API `tools/scrapping.py` uses, so the
+scraper can be run and benchmarked offline, without cookies and without loading the forum.
+
+Topics and posts are generated deterministically from their ids. Latency and Discourse's
+rate limiting (`429` with `Retry-After` once more than `--rate` requests arrive in a second)
+can be simulated:
+
+	python -m tools.fake_discourse_server --port 8766 --topics 60 --posts 80 --rate 20
+	python -m tools.scrapping --base-url http://127.0.0.1:8766 --concurrency 8 --rate 15
+
+`/__stats` reports the requests served and throttled. Forum activity for the incremental
+sync can be simulated with `POST /__reply/{topic_id}`, `/__edit/{post_id}` and
+`/__delete/{post_id}`; the listing is ordered by `bumped_at`, like Discourse's.
+"""
+
+import time
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# ############## [ END IMPORTS ] ##############
+
+
+app = FastAPI(title="Fake Discourse")
+
+CONFIG = {
+	"topics": 60
+	, "posts": 80
+	, "page_size": 30
+	, "chunk_size": 20
+	, "latency_ms": 0.0
+	, "rate": 0.0
+	, "retry_after": 1
+}
+
+STATS = {"requests": 0, "throttled": 0, "posts_served": 0}
+
+# Start of the current one-second window of the rate limiter, and requests in it
+WINDOW = {"start": 0.0, "count": 0}
+
+EPOCH = datetime(2025, 1, 2)
+
+# Simulated activity: replies added per topic, edits per post, deleted posts, bump times
+ACTIVITY = {"replies": {}, "edits": {}, "deleted": set(), "bumped": {}}
+
+
+def _stamp(when: datetime) -> str:
+	return when.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def post_ids(topic_id: int) -> list[int]:
+	count = CONFIG["posts"] + ACTIVITY["replies"].get(topic_id, 0)
+	return [i for i in (topic_id * 10_000 + n for n in range(1, count + 1)) if i not in ACTIVITY["deleted"]]
+
+
+def post_created(post_id: int) -> datetime:
+	topic_id, number = divmod(post_id, 10_000)
+	return EPOCH + timedelta(days=topic_id % 100, hours=topic_id % 24 + number)
+
+
+def fake_topic(topic_id: int) -> dict:
+	created = EPOCH + timedelta(days=topic_id % 100, hours=topic_id % 24)
+	stream = post_ids(topic_id)
+	last = post_created(stream[-1]) if stream else created
+
+	return {
+		"id": topic_id
+		, "title": f"Fake topic {topic_id}"
+		, "slug": f"fake-topic-{topic_id}"
+		, "tags": ["fake"]
+		, "posts_count": len(stream)
+		, "created_at": _stamp(created)
+		, "last_posted_at": _stamp(last)
+		, "bumped_at": _stamp(max(last, ACTIVITY["bumped"].get(topic_id, last)))
+	}
+
+
+def fake_post(post_id: int) -> dict:
+	topic_id, number = divmod(post_id, 10_000)
+	created = post_created(post_id)
+	edits = ACTIVITY["edits"].get(post_id, 0)
+
+	return {
+		"id": post_id
+		, "topic_id": topic_id
+		, "post_number": number
+		, "username": f"user{post_id % 37}"
+		, "created_at": _stamp(created)
+		, "updated_at": _stamp(created + timedelta(minutes=edits))
+		, "reply_to_post_number": number - 1 if number > 1 else None
+		, "reply_count": 1 if number < CONFIG["posts"] else 0
+		, "cooked": f"<p>Post <b>{number}</b> of topic {topic_id}: how do I run <code>uv run app.py</code> for GA{topic_id % 7}?</p>"
+			+ (f"<p>Edit {edits}: use <code>uv run --with httpx</code> instead.</p>" if edits else "")
+	}
+
+
+async def serve() -> JSONResponse | None:
+	"""
+	Counts a request, sleeps the configured latency and answers `429` past the rate limit.
+	"""
+
+	STATS["requests"] += 1
+
+	if CONFIG["rate"]:
+		now = time.monotonic()
+		if now - WINDOW["start"] >= 1.0:
+			WINDOW["start"], WINDOW["count"] = now, 0
+
+		WINDOW["count"] += 1
+		if WINDOW["count"] > CONFIG["rate"]:
+			STATS["throttled"] += 1
+			return JSONResponse(
+				{"errors": ["You've performed this action too many times. (fake)"], "error_type": "rate_limit", "extras": {"wait_seconds": CONFIG["retry_after"]}}
+				, status_code=429
+				, headers={"Retry-After": str(CONFIG["retry_after"])}
+			)
+
+	await asyncio.sleep(CONFIG["latency_ms"] / 1000)
+
+	return None
+
+
+@app.get("/session/current.json")
+async def current_session():
+	return await serve() or {"current_user": {"id": 1, "username": "fake"}}
+
+
+@app.get("/c/courses/tds-kb/34.json")
+async def category_topics(page: int = 0):
+	if (limited := await serve()) is not None:
+		return limited
+
+	topics = sorted((fake_topic(i) for i in range(1, CONFIG["topics"] + 1)), key=lambda t: (t["bumped_at"], t["id"]), reverse=True)
+	start = page * CONFIG["page_size"]
+
+	return {"topic_list": {"topics": topics[start:start + CONFIG["page_size"]]}}
+
+
+@app.get("/t/{topic_id}.json")
+async def topic(topic_id: int):
+	if (limited := await serve()) is not None:
+		return limited
+
+	stream = post_ids(topic_id)
+	posts = [fake_post(i) for i in stream[:CONFIG["chunk_size"]]]
+	STATS["posts_served"] += len(posts)
+
+	return {**fake_topic(topic_id), "post_stream": {"stream": stream, "posts": posts}}
+
+
+@app.get("/t/{topic_id}/posts.json")
+async def topic_posts(topic_id: int, request: Request):
+	if (limited := await serve()) is not None:
+		return limited
+
+	known = set(post_ids(topic_id))
+	wanted = [int(i) for i in request.query_params.getlist("post_ids[]") if int(i) in known]
+	STATS["posts_served"] += len(wanted)
+
+	return {"post_stream": {"posts": [fake_post(i) for i in wanted]}}
+
+
+@app.get("/__stats")
+async def stats():
+	return STATS
+
+
+def _bump(topic_id: int) -> None:
+	ACTIVITY["bumped"][topic_id] = max(post_created(i) for i in post_ids(topic_id)) + timedelta(days=365)
+
+
+@app.post("/__reply/{topic_id}")
+async def reply(topic_id: int):
+	ACTIVITY["replies"][topic_id] = ACTIVITY["replies"].get(topic_id, 0) + 1
+	_bump(topic_id)
+	return fake_topic(topic_id)
+
+
+@app.post("/__edit/{post_id}")
+async def edit(post_id: int):
+	ACTIVITY["edits"][post_id] = ACTIVITY["edits"].get(post_id, 0) + 1
+	_bump(post_id // 10_000)
+	return fake_post(post_id)
+
+
+@app.post("/__delete/{post_id}")
+async def delete(post_id: int):
+	ACTIVITY["deleted"].add(post_id)
+	_bump(post_id // 10_000)
+	return fake_topic(post_id // 10_000)
+
+
+if __name__ == "__main__":
+	import uvicorn
+
+	parser = argparse.ArgumentParser(description="Fake Discourse server for offline scraping and benchmarks")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8766)
+	parser.add_argument("--topics", type=int, default=CONFIG["topics"], help="topics in the category")
+	parser.add_argument("--posts", type=int, default=CONFIG["posts"], help="posts per topic")
+	parser.add_argument("--latency-ms", type=float, default=CONFIG["latency_ms"], help="fixed delay per request")
+	parser.add_argument("--rate", type=float, default=CONFIG["rate"], help="requests per second before answering 429, 0 for no limit")
+	parser.add_argument("--retry-after", type=int, default=CONFIG["retry_after"], help="Retry-After seconds sent with a 429")
+	args = parser.parse_args()
+
+	CONFIG.update(topics=args.topics, posts=args.posts, latency_ms=args.latency_ms, rate=args.rate, retry_after=args.retry_after)
+
+	uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -1,91 +1,196 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
 
 import os
-import json
-
-from bs4 import BeautifulSoup
-import re
+import time
+import hashlib
+import itertools
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
 
 from ams.settings import SETTINGS
+from ams.methods.kb_io import iter_json_records, write_jsonl, resolve_records_path
+from ams.methods.metrics import span
+from ams.methods.scrape_checkpoint import getCheckpoint
+from tools.chunking import chunk_text
+from tools.cleaning import clean_text
 
 # ############## [ END IMPORTS ] ##############
 
 router = APIRouter()
 
 
-def clean_text(raw_text: str) -> str:
+def chunk_record(tmp: dict, raw_text: str):
 	"""
-	Cleans and simplifies raw Markdown or HTML-rich text for downstream processing.
+	Splits one post/page into passage records sharing its metadata
+
+	Parameters
+		`tmp: dict` the record's title, tags, author and url
+		`raw_text: str` its uncleaned text; chunking needs the newlines and headings `clean_text` removes
 
-	This function performs the following steps:
-		- Strips YAML frontmatter (e.g., metadata between --- markers).
-		- Removes image links in Markdown syntax.
-		- Converts Markdown hyperlinks to plain text (retaining visible link text only).
-		- Removes Markdown heading markers (e.g., `#`, `##`).
-		- Cleans up table formatting artifacts and decorative dividers.
-		- Replaces special characters like smart quotes and ellipses with plain equivalents.
-		- Removes embedded HTML tags using BeautifulSoup.
-		- Returns a single-line, stripped plain text string.
+	Returns
+		generator of records with `text` plus the `parent_url`, `chunk` number, `offset` into the raw text and `heading`
+	"""
+
+	n = 0
+	for chunk in chunk_text(raw_text):
+		text = clean_text(chunk['text'])
+		if not text:
+			continue
 
-	Parameters:
-		raw_text (str): The input text that may contain Markdown, HTML, or other formatting.
+		passage = dict(tmp)
 
-	Returns:
-		str: Cleaned, plain text content suitable for analysis or display.
+		passage['text']			=	text
+		passage['parent_url']	=	tmp['url']
+		passage['chunk']		=	n
+		passage['offset']		=	chunk['offset']
+		passage['heading']		=	chunk['heading']
+
+		n += 1
+		yield passage
+
+
+def format_chunk(sources: list[tuple[dict, str]]) -> list[list[dict]]:
+	"""
+	Pool job: the passage records of each `(metadata, raw text)` source of a chunk
 	"""
 
-	# Strip frontmatter
-	raw_text = re.sub(r"^---[\s\S]*?---\n", "", raw_text)
+	return [list(chunk_record(tmp, raw_text)) for tmp, raw_text in sources]
 
-	# Convert markdown links/images
-	raw_text = re.sub(r"!\[.*?\]\((.*?)\)", "", raw_text)  # remove image links
-	raw_text = re.sub(r"\[(.*?)\]\((.*?)\)", r"\1", raw_text)  # keep visible link text only
 
-	# Optional: remove heading hashes
-	raw_text = re.sub(r"^#+\s*", "", raw_text, flags=re.MULTILINE)
+def format_sources(
+	sources			:	Iterable[tuple[dict, str]]
+	, workers		:	int		=	SETTINGS.KB_FORMAT_WORKERS
+	, chunk_size	:	int		=	SETTINGS.KB_FORMAT_CHUNK
+) -> Iterator[list[dict]]:
+	"""
+	Chunks and cleans sources into their passage records over a process pool
+
+	Parameters
+		`sources: Iterable[tuple[dict, str]]` `(metadata, raw text)` of the posts and pages, read lazily
+		`workers: int` worker processes, 0 for one per CPU; 1 formats in this process
+		`chunk_size: int` sources sent to a worker at a time
 
-	raw_text = re.sub(r"\n\s*#\s*", "", raw_text)
-	raw_text = re.sub(r"\|\s*---\s*\|.*", "", raw_text)
-	raw_text = re.sub("\\n[-=_]{1,}\\n", "", raw_text)
-	raw_text = re.sub("\\n", "", raw_text)
+	Returns
+		`Iterator[list[dict]]` the passages of every source, in the order of `sources`
+	"""
 
-	raw_text = raw_text.replace("…", "").replace("’", "'").replace("“", '"').replace("”", '"')
+	workers	=	workers or os.cpu_count() or 1
+	sources	=	iter(sources)
+	chunks	=	iter(lambda: list(itertools.islice(sources, chunk_size)), [])
 
-	# Remove any embedded HTML (if present)
-	raw_text = BeautifulSoup(raw_text, "html.parser").get_text()
+	head	=	list(itertools.islice(chunks, 2))
+	chunks	=	itertools.chain(head, chunks)
 
-	return raw_text.strip()
+	# A single chunk (e.g. the few posts of a delta) is not worth starting processes for
+	if workers == 1 or len(head) < 2:
+		for chunk in chunks:
+			yield from format_chunk(chunk)
+		return
 
+	# `spawn`: forking a process that already runs the event loop and thread pools is unsafe
+	with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+		# Two chunks per worker in flight keep the pool busy; results are taken in submission
+		# order, so the output is the same as a serial run's whatever the worker timings
+		pending = collections.deque()
 
-@router.get('/form_kb')
-def form_kb():
+		for chunk in chunks:
+			pending.append(pool.submit(format_chunk, chunk))
+			if len(pending) >= 2 * workers:
+				yield from pending.popleft().result()
+
+		while pending:
+			yield from pending.popleft().result()
+
+
+def content_key(passages: list[dict]) -> str:
+	return hashlib.sha256("\n".join(passage['text'] for passage in passages).encode('utf-8')).hexdigest()
+
+
+def dedup_sources(formatted: Iterable[list[dict]], seen: set, stats: dict) -> Iterator[dict]:
 	"""
-	Performs filtering oprations on the collected datasets of Discourse and Website
-	and save only the needed attributes into a file named, `formatted_scraped_kb.json`
+	Flattens the passages of formatted sources, dropping every source whose cleaned text is
+	the same as an earlier one's (e.g. a post repeated under another id)
+
+	Parameters
+		`formatted: Iterable[list[dict]]` the passages of each source
+		`seen: set` content keys (`content_key`) of the sources already written; updated
+		`stats: dict` its `duplicates` count is increased per source dropped
 	"""
 
-	# open discourse-scraps
-	D_scrap						=	json.load(open(os.path.join(SETTINGS.OUTPUT_FOLDER_D_CONTENT, 'discourse_posts.json')))
-	D_formatted	: list[dict]	=	[]
+	for passages in formatted:
+		if not passages:
+			continue
 
-	for item in D_scrap:
-		tmp = dict()
+		key = content_key(passages)
+		if key in seen:
+			stats['duplicates'] += 1
+			continue
+
+		seen.add(key)
+		yield from passages
 
-		tmp['title']	=	item['topic_title']
-		tmp['tags']		=	item['tags']
-		tmp['author']	=	item['author']
-		tmp['url']		=	item['url']
-		tmp['text']		=	clean_text(item['content'])
 
-		D_formatted.append(tmp)
+def discourse_source(item: dict) -> tuple[dict, str]:
+	"""
+	Metadata and raw text of one scraped Discourse post
+	"""
 
-	# open C-contents-scraps
-	C_scrap						=	json.load(open(os.path.join(SETTINGS.OUTPUT_FOLDER_C_CONTENT, 'metadata.json')))
-	C_formatted	: list[dict]	=	[]
+	tmp = dict()
 
-	tracking_appneded = []
+	tmp['title']	=	item['topic_title']
+	tmp['tags']		=	item['tags']
+	tmp['author']	=	item['author']
+	tmp['url']		=	item['url']
 
-	for item in C_scrap:
+	return tmp, item['content']
+
+
+def iter_discourse_sources():
+	"""
+	Streams the scraped Discourse posts as `(metadata, raw text)`
+	"""
+
+	for item in iter_json_records(os.path.join(SETTINGS.OUTPUT_FOLDER_D_CONTENT, 'discourse_posts.json')):
+		yield discourse_source(item)
+
+
+def iter_delta_records(delta: dict, stats: dict):
+	"""
+	Streams the current formatted KB with the posts of a Discourse sync delta replaced:
+	passages of changed or removed posts are dropped, those of changed posts are re-made
+
+	Parameters
+		`delta: dict` the pending delta of the scraper checkpoint (`ScrapeCheckpoint.pending_delta`)
+		`stats: dict` counts of the build, see `dedup_sources`
+	"""
+
+	stale = {post['url'] for post in delta['changed']} | {post['url'] for post in delta['removed']}
+	seen = set()
+
+	kept = (
+		record for record in iter_json_records(resolve_records_path(SETTINGS.KB_FORMATTED_DATA))
+		if record.get('parent_url', record.get('url')) not in stale
+	)
+
+	# The passages of a post are consecutive: their key is the one `dedup_sources` gave the post
+	for _, passages in itertools.groupby(kept, key=lambda record: record.get('parent_url', record.get('url'))):
+		passages = list(passages)
+		seen.add(content_key(passages))
+		yield from passages
+
+	yield from dedup_sources(format_sources(discourse_source(item) for item in delta['changed']), seen, stats)
+
+
+def iter_course_sources():
+	"""
+	Streams the scraped course pages as `(metadata, raw text)`, each file only once
+	"""
+
+	tracking_appneded = set()
+
+	for item in iter_json_records(os.path.join(SETTINGS.OUTPUT_FOLDER_C_CONTENT, 'metadata.json')):
 		tmp = dict()
 
 		if item['filename'] in tracking_appneded:
@@ -95,22 +200,73 @@ def form_kb():
 		tmp['tags']		=	[]
 		tmp['author']	=	[]
 		tmp['url']		=	item['original_url']
-		tmp['text']		=	clean_text(open(os.path.join(SETTINGS.OUTPUT_FOLDER_C_CONTENT, item['filename'])).read())
 
-		tracking_appneded.append(item['filename'])
-		C_formatted.append(tmp)
+		with open(os.path.join(SETTINGS.OUTPUT_FOLDER_C_CONTENT, item['filename'])) as f:
+			raw_text	=	f.read()
 
+		tracking_appneded.add(item['filename'])
 
-	all_formatted_scraped_data = D_formatted + [{}]
+		yield tmp, raw_text
 
-	saved_filename = os.path.join(SETTINGS.OUTPUT_FORMATTED_KB_DATA, 'formatted_scraped_kb.json')
-	json.dump(
-		all_formatted_scraped_data
-		, open(saved_filename, 'w')
-		, indent=4
-	)
+
+@router.get('/form_kb')
+def form_kb(
+	include_course: bool = Query(default=False, description="Also add the scraped course pages to the KB")
+	, delta: bool = Query(default=False, description="Only apply the posts changed by the last Discourse syncs to the current KB")
+):
+	"""
+	Performs filtering oprations on the collected datasets of Discourse and Website
+	and save only the needed attributes into `SETTINGS.KB_FORMATTED_DATA` (JSONL)
+
+	Records are streamed from the scraped files straight into the output. Posts and pages
+	are split into passages (see `tools/chunking.py`) and cleaned in chunks over
+	`SETTINGS.KB_FORMAT_WORKERS` processes, the output keeping the order of the sources. A
+	post or page whose cleaned text is the same as an earlier one's is left out.
+
+	The KB holds the Discourse posts only, as it always has; `include_course` adds the
+	scraped course pages too, which grows the KB and the embeddings to compute.
+
+	With `delta`, the current KB is kept and only the posts changed by the Discourse syncs
+	since the last build (the delta log of the scraper checkpoint) are re-formatted or
+	dropped. Without a KB to update yet, the whole KB is formatted instead. Either way the
+	delta log is consumed.
+	"""
+
+	saved_filename	=	SETTINGS.KB_FORMATTED_DATA
+	has_kb			=	os.path.exists(resolve_records_path(saved_filename))
+
+	checkpoint		=	getCheckpoint()
+	pending, upto	=	checkpoint.pending_delta()
+
+	stats			=	{'duplicates': 0}
+
+	if delta and has_kb:
+		if not (pending['changed'] or pending['removed']):
+			return {"status": "Nothing to update, no pending Discourse delta", "records": None}
+
+		records = iter_delta_records(pending, stats)
+	else:
+		sources = iter_discourse_sources()
+		if include_course:
+			sources = itertools.chain(sources, iter_course_sources())
+
+		records = dedup_sources(format_sources(sources), set(), stats)
+
+	started = time.perf_counter()
+
+	with span("kb_format"):
+		count		=	write_jsonl(saved_filename, records)
+
+	seconds = time.perf_counter() - started
+
+	# Applied, or taken in by the full build: later syncs start a new delta
+	checkpoint.clear_delta(upto)
 
 	return {
 		"status": f"Done!! check file, {saved_filename}"
+		, "records": count
+		, "duplicates": stats['duplicates']
+		, "workers": SETTINGS.KB_FORMAT_WORKERS or os.cpu_count()
+		, "seconds": round(seconds, 2)
+		, "records_per_s": round(count / seconds) if seconds else None
 	}
-
@@ -0,0 +1,176 @@
+"""
+Load-tests the ask route of a running server, or of servers it starts with 1, 2, 4... workers.
+
+Every request asks a question no other request asked, so the answer cache never hides the
+work of a request. Reports the requests per second and the p50 / p95 latencies:
+
+	python -m tools.load_test --url http://127.0.0.1:8000 --concurrency 32 --seconds 20
+
+With `--spawn` it starts `uvicorn server:app --workers N` for each N in turn (from the repo
+root, against the local AIPIPE stand-in, which is started too unless `--aipipe-url` is given),
+waits for it to be ready, loads it and stops it:
+
+	python -m tools.load_test --spawn 1,2,4 --concurrency 32 --seconds 20 --llm-ms 300
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import subprocess
+
+import httpx
+
+# ############## [ END IMPORTS ] ##############
+
+
+TOPICS = ("docker", "git", "uv", "pandas", "ollama", "the GA marks", "the ROE", "fastapi", "sqlite", "playwright")
+
+
+def percentile(values: list[float], q: float) -> float:
+	if not values:
+		return 0.0
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_load(url: str, concurrency: int, seconds: float, timeout: float) -> dict:
+	"""
+	POSTs unique questions to `url/api/ask` from `concurrency` clients for `seconds`
+
+	Parameters
+		`url: str` base URL of the server
+		`concurrency: int` requests in flight at a time
+		`seconds: float` duration of the load
+		`timeout: float` most seconds to wait for one answer
+
+	Returns
+		`dict` with the requests, errors, requests per second and p50 / p95 latencies (ms)
+	"""
+
+	counter = itertools.count()
+	latencies = []
+	errors = 0
+
+	limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+	async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+		started = time.perf_counter()
+		deadline = started + seconds
+
+		async def user():
+			nonlocal errors
+			while time.perf_counter() < deadline:
+				n = next(counter)
+				question = f"How do I use {TOPICS[n % len(TOPICS)]} in the course project? (load test #{n})"
+
+				sent = time.perf_counter()
+				try:
+					response = await client.post("/api/ask", json={"question": question})
+					response.raise_for_status()
+					latencies.append(time.perf_counter() - sent)
+				except Exception as e:
+					errors += 1
+					if errors <= 3:
+						print(f"[Load Test] {type(e).__name__} {e}")
+
+		await asyncio.gather(*(user() for _ in range(concurrency)))
+		elapsed = time.perf_counter() - started
+
+	return {
+		"requests": len(latencies)
+		, "errors": errors
+		, "rps": round(len(latencies) / elapsed, 1)
+		, "p50_ms": round(percentile(latencies, 0.50) * 1000, 1)
+		, "p95_ms": round(percentile(latencies, 0.95) * 1000, 1)
+	}
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float) -> None:
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		if process.poll() is not None:
+			raise RuntimeError(f"{process.args} exited with {process.returncode}")
+		try:
+			if httpx.get(url, timeout=1).status_code < 500:
+				return
+		except httpx.HTTPError:
+			pass
+		time.sleep(0.25)
+
+	raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def stop(process: subprocess.Popen) -> None:
+	process.terminate()
+	try:
+		process.wait(timeout=15)
+	except subprocess.TimeoutExpired:
+		process.kill()
+		process.wait()
+
+
+def spawn_runs(args) -> list[dict]:
+	"""
+	Starts the server once per worker count of `args.spawn` and load-tests each
+	"""
+
+	aipipe = None
+	aipipe_url = args.aipipe_url
+
+	if aipipe_url is None:
+		aipipe = subprocess.Popen([
+			sys.executable, "-m", "tools.fake_aipipe_server", "--port", str(args.aipipe_port), "--llm-ms", str(args.llm_ms)
+		])
+		wait_ready(f"http://127.0.0.1:{args.aipipe_port}/docs", aipipe, 30)
+		aipipe_url = f"http://127.0.0.1:{args.aipipe_port}/openai/v1"
+
+	env = {**os.environ, "AIPIPE_BASE_URL": aipipe_url}
+	url = f"http://127.0.0.1:{args.port}"
+	reports = []
+
+	try:
+		for workers in (int(n) for n in args.spawn.split(",")):
+			server = subprocess.Popen([
+				sys.executable, "-m", "uvicorn", "server:app", "--port", str(args.port), "--workers", str(workers), "--log-level", "warning"
+			], env=env)
+
+			try:
+				wait_ready(f"{url}/metrics", server, args.startup_timeout)
+				report = {"workers": workers, **asyncio.run(run_load(url, args.concurrency, args.seconds, args.timeout))}
+			finally:
+				stop(server)
+
+			print(json.dumps(report))
+			reports.append(report)
+	finally:
+		if aipipe is not None:
+			stop(aipipe)
+
+	return reports
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Load-test the /api/ask route")
+	parser.add_argument("--url", default="http://127.0.0.1:8000", help="server to load, unless --spawn")
+	parser.add_argument("--spawn", default=None, help="comma-separated worker counts of the servers to start, e.g. 1,2,4")
+	parser.add_argument("--port", type=int, default=8010, help="port of the spawned servers")
+	parser.add_argument("--aipipe-url", default=None, help="AIPIPE_BASE_URL of the spawned servers, the local stand-in by default")
+	parser.add_argument("--aipipe-port", type=int, default=8765, help="port of the local AIPIPE stand-in")
+	parser.add_argument("--llm-ms", type=float, default=300, help="answer time of the local AIPIPE stand-in")
+	parser.add_argument("--concurrency", type=int, default=32, help="requests in flight at a time")
+	parser.add_argument("--seconds", type=float, default=20, help="duration of each load")
+	parser.add_argument("--timeout", type=float, default=60, help="most seconds to wait for one answer")
+	parser.add_argument("--startup-timeout", type=float, default=120, help="most seconds to wait for a spawned server")
+	args = parser.parse_args()
+
+	if args.spawn:
+		reports = spawn_runs(args)
+		baseline = reports[0]["rps"] or 1
+		for report in reports:
+			print(f"{report['workers']} worker(s): {report['rps']} req/s ({report['rps'] / baseline:.2f}x) p50 {report['p50_ms']} ms p95 {report['p95_ms']} ms, {report['errors']} errors")
+	else:
+		print(json.dumps(asyncio.run(run_load(args.url, args.concurrency, args.seconds, args.timeout))))
@@ -1,91 +1,331 @@
-from fastapi import APIRouter
+"""
+Builds `kb_with_embeddings.jsonl` (+ `.f32`) out of `formatted_scraped_kb.jsonl`.
+
+Besides the `/make_embeds` route, it can be run on its own (from the repo root) to build
+or to benchmark the batched embedder, e.g. against `tools/fake_aipipe_server.py`:
+
+	python -m tools.make_embeds --batch-size 128 --concurrency 8
+	python -m tools.make_embeds --bench 5000 --base-url http://127.0.0.1:8765/openai/v1
+"""
+
+from fastapi import APIRouter, Query
 
-import os
 import json
-import requests
+import time
+import random
+import asyncio
+import argparse
+import httpx
 
 from ams.settings import SETTINGS
+from ams.methods.caching import SQLiteKVStore, cache_key, encode_embedding, decode_embedding
+from ams.methods.kb_io import iter_json_records, resolve_records_path, EmbeddingsWriter
+from ams.methods.metrics import getMetrics, span
+from ams.methods.http_client import RETRY_STATUS, retry_delay, aipipe_headers
 
 # ############## [ END IMPORTS ] ##############
 
 router = APIRouter()
 
-def append_json_line(file_path: str, data: dict) -> None:
+# The embeddings API takes at most 2048 inputs and ~300k tokens per request, stay well below
+MAX_BATCH_ITEMS = 2048
+MAX_BATCH_CHARS = 400_000
+
+def make_batches(texts: list[str], batch_size: int) -> list[list[int]]:
 	"""
-	With this function we can append each line of `data: dict` in the specified file with filepath = `file_path: str`
+	Packs the indices of `texts` into batches bounded by item count and total characters
+
+	Parameter
+		`texts: list[str]` the texts to embed
+		`batch_size: int` maximum number of texts per request
+
+	Returns
+		`list[list[int]]` indices into `texts`, in order
 	"""
 
-	with open(file_path, "a", encoding="utf-8") as f:
-		json_line = json.dumps(data, ensure_ascii=False)
-		f.write(json_line + ",\n")
+	batch_size = max(1, min(batch_size, MAX_BATCH_ITEMS))
+	batches, current, chars = [], [], 0
+
+	for i, text in enumerate(texts):
+		if current and (len(current) >= batch_size or chars + len(text) > MAX_BATCH_CHARS):
+			batches.append(current)
+			current, chars = [], 0
+
+		current.append(i)
+		chars += len(text)
 
+	if current:
+		batches.append(current)
 
-def get_embeddings(content: str) -> list[float]:
+	return batches
+
+
+async def get_embeddings_batch(client: httpx.AsyncClient, texts: list[str], max_retries: int = SETTINGS.EMBED_MAX_RETRIES) -> dict:
 	"""
-	FUnction to create embeddings of the provided text string
+	Embeds many texts with a single request, retrying on 429/5xx and network errors
 
 	Parameter
-		`content: str` the string of text for which the embedding has to be created
+		`client: httpx.AsyncClient` pooled client pointing to the embeddings API
+		`texts: list[str]` the texts to embed, in order
+		`max_retries: int` attempts after the first one before giving up
 
 	Returns
-		`list[float]` the embedding for the provided string
+		`dict` with `output` (one embedding per text, in order) and `info` (token usage)
 	"""
 
-	response = requests.post(
-		"https://aipipe.org/openai/v1/embeddings",
-		headers={"Authorization": f"Bearer {SETTINGS.AIPIPE_API_KEY}"},
-		json={"model": "text-embedding-3-small", "input": content}
-	)
+	attempt = 0
 
-	data = response.json()
+	while True:
+		response = None
 
-	info = {"total_tokens": data['usage']['total_tokens']}
+		try:
+			response = await client.post(
+				"/embeddings",
+				json={"model": "text-embedding-3-small", "input": texts}
+			)
 
-	return {
-		"output": data["data"][0]["embedding"]
-		, "info": info
+			if response.status_code not in RETRY_STATUS:
+				response.raise_for_status()
+				data = response.json()
+
+				return {
+					"output": [item["embedding"] for item in sorted(data["data"], key=lambda d: d["index"])]
+					, "info": {"total_tokens": data['usage']['total_tokens']}
+				}
+
+		except httpx.LocalProtocolError:
+			# The request itself is invalid (e.g. a bad header), sending it again cannot help
+			raise
+
+		except (httpx.TransportError, httpx.TimeoutException) as e:
+			print(f"[Embeddings] network error: {type(e).__name__} {e}")
+
+		if attempt >= max_retries:
+			raise RuntimeError(f"Embedding batch of {len(texts)} failed after {attempt + 1} attempts (last status: {response.status_code if response is not None else 'n/a'})")
+
+		delay = retry_delay(attempt, response)
+		print(f"[Embeddings] retrying batch in {delay:.1f}s (status: {response.status_code if response is not None else 'n/a'})")
+
+		await asyncio.sleep(delay)
+		attempt += 1
+
+
+async def embed_texts(
+	texts		:	list[str]
+	, batch_size	:	int					=	SETTINGS.EMBED_BATCH_SIZE
+	, concurrency	:	int					=	SETTINGS.EMBED_CONCURRENCY
+	, base_url		:	str | None			=	None
+	, on_batch		=	None
+) -> tuple[list[list[float]], dict]:
+	"""
+	Embeds all texts in batches, with at most `concurrency` requests in flight
+
+	Parameter
+		`texts: list[str]` the texts to embed
+		`batch_size: int` texts packed per request
+		`concurrency: int` parallel requests
+		`base_url: str` embeddings API base URL, defaults to `SETTINGS.AIPIPE_BASE_URL`
+		`on_batch` optional `async callback(indices, embeddings, info)` awaited as each batch completes
+
+	Returns
+		`tuple` of the embeddings (in the order of `texts`; not collected when `on_batch` consumes them) and a throughput report
+	"""
+
+	batches		=	make_batches(texts, batch_size)
+	embeddings	:	list[list[float] | None]	=	[None] * len(texts) if on_batch is None else []
+	semaphore	=	asyncio.Semaphore(max(1, concurrency))
+	totals		=	{"tokens": 0, "done": 0}
+	started		=	time.perf_counter()
+
+	async with httpx.AsyncClient(
+		base_url	=	base_url or SETTINGS.AIPIPE_BASE_URL
+		, headers	=	aipipe_headers()
+		, limits	=	httpx.Limits(max_connections=max(1, concurrency), max_keepalive_connections=max(1, concurrency))
+		, timeout	=	httpx.Timeout(SETTINGS.HTTP_READ_TIMEOUT, connect=SETTINGS.HTTP_CONNECT_TIMEOUT)
+	) as client:
+
+		async def run(indices: list[int]) -> None:
+			async with semaphore:
+				with span("kb_embed_batch"):
+					x = await get_embeddings_batch(client, [texts[i] for i in indices])
+
+			if on_batch is None:
+				for i, emb in zip(indices, x['output']):
+					embeddings[i] = emb
+
+			totals["tokens"] += x['info']['total_tokens']
+			totals["done"] += len(indices)
+
+			getMetrics().inc("tds_api_calls_total", method="get_embeddings_batch")
+			getMetrics().inc("tds_tokens_total", x['info']['total_tokens'], method="get_embeddings_batch")
+
+			if on_batch is not None:
+				await on_batch(indices, x['output'], x['info'])
+
+			elapsed = time.perf_counter() - started
+			print(f"[Embeddings] {totals['done']}/{len(texts)} items | {totals['done'] / elapsed:.1f} items/s | {totals['tokens'] / elapsed:.0f} tokens/s")
+
+		await asyncio.gather(*(run(indices) for indices in batches))
+
+	elapsed = time.perf_counter() - started
+	report = {
+		"items": len(texts)
+		, "batches": len(batches)
+		, "tokens": totals["tokens"]
+		, "seconds": round(elapsed, 3)
+		, "items_per_s": round(len(texts) / elapsed, 1) if elapsed else 0.0
+		, "tokens_per_s": round(totals["tokens"] / elapsed, 1) if elapsed else 0.0
 	}
 
+	return embeddings, report
+
+
+def record_hash(item: dict) -> str:
+	"""
+	Content hash of a formatted KB record, i.e. of the exact text that gets embedded
+	"""
+
+	return cache_key("text-embedding-3-small", item['text'])
+
+
+def iter_formatted_kb():
+	"""
+	Streams the formatted KB records that have some text to embed
+	"""
+
+	for item in iter_json_records(resolve_records_path(SETTINGS.KB_FORMATTED_DATA)):
+		if item and item.get('text'):
+			yield item
+
+
+def hash_records(stored: frozenset) -> tuple[set, dict, int, int]:
+	"""
+	Pass 1: hashes every formatted KB record; identical texts (e.g. duplicated posts) are embedded once
+
+	Parameters
+		`stored: frozenset` hashes already in the embeddings store
+
+	Returns
+		`tuple` of all the hashes, the `{hash: text}` still to embed, the record count and the reused count
+	"""
+
+	hashes		=	set()
+	to_embed	=	{}
+	records		=	0
+	reused		=	0
+
+	for item in iter_formatted_kb():
+		h = record_hash(item)
+		hashes.add(h)
+		records += 1
+
+		if h in stored:
+			reused += 1
+		elif h not in to_embed:
+			to_embed[h] = item['text']
+
+	return hashes, to_embed, records, reused
+
+
+def write_embeddings(store: SQLiteKVStore, saved_filename: str) -> None:
+	"""
+	Pass 2: streams the records out, fetching their vectors from the store chunk by chunk
+	"""
+
+	with EmbeddingsWriter(saved_filename) as writer:
+		chunk = []
+
+		def flush() -> None:
+			vectors = store.get_many([h for h, _ in chunk])
+			for h, item in chunk:
+				writer.write({"data": item, "hash": h}, decode_embedding(vectors[h]))
+			chunk.clear()
+
+		for item in iter_formatted_kb():
+			chunk.append((record_hash(item), item))
+			if len(chunk) >= 1000:
+				flush()
+
+		flush()
+
 
 @router.get('/make_embeds')
-def form_kb():
+async def form_kb(
+	batch_size: int = Query(default=SETTINGS.EMBED_BATCH_SIZE, description="Texts packed into each embeddings request")
+	, concurrency: int = Query(default=SETTINGS.EMBED_CONCURRENCY, description="Embeddings requests in flight at once")
+	, full_rebuild: bool = Query(default=False, description="Ignore the stored embeddings and embed every record again")
+):
 	"""
 	Creates embedding for each text of the filtered post data of Discourse and Website
-	and save it with the data itself into a file named, `kb_with_embeddings.json`
+	and save it with the data itself into `SETTINGS.KB_EMBEDDINGS_DATA_JSON` (JSONL records)
+	plus its `.f32` sidecar holding the embeddings as raw float32 rows.
 
-	Also, `kb_with_embeddings.json` is our database to load into the VectorDB.
+	Also, these files are our database to load into the VectorDB.
+
+	Embeddings are kept in `SETTINGS.KB_EMBED_STORE_DB` keyed by the content hash of each
+	record's text: unchanged records reuse their stored embedding, only new or edited ones
+	are sent to the API, and hashes no longer in the KB are deleted. Every batch is committed
+	as soon as it returns, so an interrupted run resumes where it stopped.
+
+	Records are streamed twice (hashing, then writing) instead of being held in memory.
+	Only the embeddings requests run on the event loop; the store and the file work are
+	done in worker threads so the server keeps answering meanwhile.
 	"""
 
-	# open formatted-scraps
-	F_scrap				=	json.load(open(os.path.join(SETTINGS.OUTPUT_FORMATTED_KB_DATA, 'formatted_scraped_kb.json')))
-	created_embeddings	=	[]
-	counter				=	0
+	store		=	await asyncio.to_thread(SQLiteKVStore, SETTINGS.KB_EMBED_STORE_DB)
+	stored		=	frozenset() if full_rebuild else await asyncio.to_thread(store.keys)
+
+	with span("kb_embed_hash"):
+		hashes, to_embed, records, reused = await asyncio.to_thread(hash_records, stored)
+
+	print(f"[Embeddings] {records} records | {reused} reused | {len(to_embed)} to embed")
+
+	pending = list(to_embed)
 
-	for item in F_scrap:
-		print("CURRENT INDEX", counter, "URL: ", item['url'])
-		x = get_embeddings(item['text'])
+	async def save_batch(indices: list[int], embeddings: list[list[float]], info: dict) -> None:
+		await asyncio.to_thread(store.set_many, {pending[i]: encode_embedding(emb) for i, emb in zip(indices, embeddings)})
 
-		dcdt = {
-				"embeddings": x['output']
-				, "data": item
-				, "api_call_info": x['info']
-			}
+	report = {"items": 0, "tokens": 0}
+	if pending:
+		with span("kb_embed_api"):
+			_, report = await embed_texts([to_embed[h] for h in pending], batch_size, concurrency, on_batch=save_batch)
 
-		created_embeddings.append(dcdt)
-		append_json_line('./tmp-embeddings.txt', dcdt)
+	del to_embed
 
+	removed = list(await asyncio.to_thread(store.keys) - hashes)
+	await asyncio.to_thread(store.delete_many, removed)
 
-		counter += 1
+	saved_filename = SETTINGS.KB_EMBEDDINGS_DATA_JSON
 
-	saved_filename = os.path.join(SETTINGS.OUTPUT_FORMATTED_KB_DATA, 'kb_with_embeddings.json')
+	with span("kb_embed_write"):
+		await asyncio.to_thread(write_embeddings, store, saved_filename)
 
-	json.dump(
-		created_embeddings
-		, open(saved_filename, 'w')
-		, indent=4
-	)
+	await asyncio.to_thread(store.close)
+
+	report.update({"records": records, "embedded": len(pending), "reused": reused, "removed": len(removed), "stages": getMetrics().snapshot()})
+	print(f"[Embeddings] {report}")
 
 	return {
 		"status": f"Done!! check file, {saved_filename}"
+		, "throughput": report
 	}
 
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Build the KB embeddings, or benchmark the batched embedder")
+	parser.add_argument("--batch-size", type=int, default=SETTINGS.EMBED_BATCH_SIZE)
+	parser.add_argument("--concurrency", type=int, default=SETTINGS.EMBED_CONCURRENCY)
+	parser.add_argument("--base-url", default=None, help="embeddings API base URL, e.g. the fake server's")
+	parser.add_argument("--bench", type=int, default=0, metavar="N", help="embed N synthetic texts and only report throughput")
+	parser.add_argument("--full-rebuild", action="store_true", help="ignore the stored embeddings")
+	args = parser.parse_args()
+
+	if args.base_url:
+		SETTINGS.AIPIPE_BASE_URL = args.base_url
+
+	if args.bench:
+		texts = [f"synthetic forum post {i} " + "lorem ipsum dolor sit amet " * random.randint(5, 60) for i in range(args.bench)]
+		_, report = asyncio.run(embed_texts(texts, args.batch_size, args.concurrency))
+		print(json.dumps(report, indent=2))
+	else:
+		print(json.dumps(asyncio.run(form_kb(args.batch_size, args.concurrency, args.full_rebuild)), indent=2))
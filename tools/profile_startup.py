@@ -0,0 +1,131 @@
+"""
+Profiles the cold start of the server: what importing it costs, module by module, and how
+long a fresh process takes until it serves requests.
+
+The import report is Python's `-X importtime` output of a fresh interpreter, with the
+slowest modules by cumulative time and the heavy packages that should only be loaded on
+first use (the OCR, the scrapers, the ChromaDB backend) if they were loaded anyway. Run
+from the repo root (the settings read `./.auth`):
+
+	python -m tools.profile_startup
+	python -m tools.profile_startup --module api --top 40
+	python -m tools.profile_startup --boot --repeat 3
+
+`--boot` also starts `uvicorn server:app` and times it until `/metrics` answers, i.e. until
+the lifespan (KB index mapped, caches and pools started) is done.
+"""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+from tools.load_test import wait_ready, stop
+
+# ############## [ END IMPORTS ] ##############
+
+
+# Only needed by image questions, the scrapers or the `chroma` backend, never by a text question
+LAZY_PACKAGES = ("chromadb", "onnxruntime", "opentelemetry", "kubernetes", "PIL", "pytesseract", "requests", "bs4", "playwright", "markdownify")
+
+
+def import_times(module: str) -> list[dict]:
+	"""
+	Imports `module` in a fresh interpreter with `-X importtime`
+
+	Parameters
+		`module: str` module to import, e.g. `server`
+
+	Returns
+		`list[dict]` one `{module, self_us, cumulative_us, depth}` per imported module, in import order
+	"""
+
+	result = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", f"import {module}"]
+		, capture_output=True, text=True
+	)
+	if result.returncode != 0:
+		raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+	rows = []
+	for line in result.stderr.splitlines():
+		if not line.startswith("import time:") or "self [us]" in line:
+			continue
+
+		self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+		rows.append({
+			"module": name.strip()
+			, "self_us": int(self_us)
+			, "cumulative_us": int(cumulative_us)
+			, "depth": (len(name) - len(name.lstrip())) // 2
+		})
+
+	return rows
+
+
+def import_report(module: str, top: int) -> dict:
+	rows = import_times(module)
+
+	# Top-level entries of the tree add up to the whole import
+	total_us = sum(row["cumulative_us"] for row in rows if row["depth"] == 0)
+
+	# Own time of all their modules: a package's dependencies may have been imported by another first
+	lazy = {}
+	for row in rows:
+		package = row["module"].split(".", 1)[0]
+		if package in LAZY_PACKAGES:
+			lazy[package] = lazy.get(package, 0) + row["self_us"]
+
+	return {
+		"module": module
+		, "modules": len(rows)
+		, "total_ms": round(total_us / 1000, 1)
+		, "slowest": [
+			{"module": row["module"], "cumulative_ms": round(row["cumulative_us"] / 1000, 1), "self_ms": round(row["self_us"] / 1000, 1)}
+			for row in sorted(rows, key=lambda row: row["cumulative_us"], reverse=True)[:top]
+		]
+		, "eagerly_loaded_ms": {package: round(us / 1000, 1) for package, us in lazy.items()}
+	}
+
+
+def boot_time(port: int, timeout: float) -> float:
+	"""
+	Seconds from starting `uvicorn server:app` until its `/metrics` answers
+	"""
+
+	started = time.perf_counter()
+	server = subprocess.Popen(
+		[sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"]
+		, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+	)
+
+	try:
+		wait_ready(f"http://127.0.0.1:{port}/metrics", server, timeout)
+		return time.perf_counter() - started
+	finally:
+		stop(server)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Profile the imports and the boot time of the server")
+	parser.add_argument("--module", default="server", help="module whose import is profiled")
+	parser.add_argument("--top", type=int, default=25, help="slowest modules listed")
+	parser.add_argument("--boot", action="store_true", help="also time a uvicorn start until it serves")
+	parser.add_argument("--port", type=int, default=8012, help="port of the booted server")
+	parser.add_argument("--repeat", type=int, default=3, help="imports / boots measured, the median is reported")
+	parser.add_argument("--timeout", type=float, default=120, help="most seconds to wait for the booted server")
+	args = parser.parse_args()
+
+	reports = [import_report(args.module, args.top) for _ in range(args.repeat)]
+	report = min(reports, key=lambda r: r["total_ms"])
+	report["total_ms_median"] = statistics.median(r["total_ms"] for r in reports)
+
+	if args.boot:
+		report["boot_s_median"] = round(statistics.median(boot_time(args.port, args.timeout) for _ in range(args.repeat)), 2)
+
+	print(json.dumps(report, indent=2))
+
+	if report["eagerly_loaded_ms"]:
+		print(f"[Startup] loaded on import though only needed on first use: {', '.join(report['eagerly_loaded_ms'])}", file=sys.stderr)
@@ -2,92 +2,299 @@
 This whole script has to be called seprated not within the FastAPI routes since,
 it is using async methods of async_playwright's chromium and I have not implemented
 the asyncs there in the main application.
+
+The site is crawled breadth-first from a queue, by a pool of browser pages working at the
+same time. A page is read as soon as its article is rendered, and images, fonts, media and
+analytics requests are not even made. On a re-crawl, a page whose source (the Docsify
+markdown, or the HTML document of a plain site) answers `304` to its saved ETag or
+Last-Modified, or still has the same content hash, is not rendered again; the crawl state
+is kept in `.crawl_state.json` next to `metadata.json`.
+
+    python tools/scrape_web_contents.py ./scraping-output/course_content --pages 6
+    python -m tools.fake_course_site --port 8767 --pages 120
+    python tools/scrape_web_contents.py /tmp/course_mirror --base-url http://127.0.0.1:8767/2025-01/index.html
 """
 
 import asyncio
-import sys, os, re, json
+import os, re, json, time, hashlib, argparse
 from datetime import datetime
+from urllib.parse import urlsplit
 from markdownify import markdownify as md
 from playwright.async_api import async_playwright
 
 BASE_URL = "https://tds.s-anand.net/#/2025-01/"
-BASE_ORIGIN = "https://tds.s-anand.net"
-OUTPUT_DIR =  sys.argv[1]
-METADATA_FILE = os.path.join(sys.argv[1], "metadata.json")
+ARTICLE_SELECTOR = "article.markdown-section#main"
+STATE_FILENAME = ".crawl_state.json"
+
+# Requests the article never needs
+BLOCKED_RESOURCES = {"image", "media", "font"}
+BLOCKED_HOSTS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net", "plausible.io", "clarity.ms", "hotjar.com")
 
-visited = set()
-metadata = []
+# Marks the article on screen, so that after a Docsify route change (same document, same
+# <article>) the page is only ready once the new route has been rendered into it
+MARK_STALE_JS = """sel => {
+    const article = document.querySelector(sel);
+    if (article) { const mark = document.createElement('meta'); mark.dataset.crawlStale = '1'; article.prepend(mark); }
+}"""
+ARTICLE_READY_JS = """sel => {
+    const article = document.querySelector(sel);
+    return !!article && article.innerHTML.trim() !== '' && !article.querySelector('[data-crawl-stale]');
+}"""
 
 def sanitize_filename(title):
     return re.sub(r'[\\/*?:"<>|]', "_", title).strip().replace(" ", "_")
 
-async def extract_all_internal_links(page):
-    return list(set([
-        link for link in await page.eval_on_selector_all("a[href]", "els => els.map(el => el.href)")
-        if BASE_ORIGIN in link and '/#/' in link
-    ]))
-
-async def wait_for_article_and_get_html(page):
-    await page.wait_for_selector("article.markdown-section#main", timeout=10000)
-    return await page.inner_html("article.markdown-section#main")
-
-async def crawl_page(page, url):
-    if url in visited:
-        return
-    visited.add(url)
-    print(f"📄 Visiting: {url}")
-    try:
-        await page.goto(url, wait_until="domcontentloaded")
-        await page.wait_for_timeout(1000)
-        html = await wait_for_article_and_get_html(page)
-    except Exception as e:
-        print(f"Error loading {url}\n{e}")
-        return
-
-    title = (await page.title()).split(" - ")[0].strip() or f"page_{len(visited)}"
-    filename = sanitize_filename(title)
-    filepath = os.path.join(OUTPUT_DIR, f"{filename}.md")
-
-    markdown = md(html)
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(f"---\n")
-        f.write(f'title: "{title}"\n')
-        f.write(f'original_url: "{url}"\n')
-        f.write(f'downloaded_at: "{datetime.now().isoformat()}"\n')
-        f.write(f"---\n\n")
-        f.write(markdown)
-
-    metadata.append({
-        "title": title,
-        "filename": f"{filename}.md",
-        "original_url": url,
-        "downloaded_at": datetime.now().isoformat()
-    })
-
-    links = await extract_all_internal_links(page)
-    for link in links:
-        await crawl_page(page, link)
-
-async def main():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    global visited, metadata
-    visited.clear()
-    metadata.clear()
-
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()
+def digest(data):
+    return hashlib.sha256(data.encode("utf-8") if isinstance(data, str) else data).hexdigest()
+
+def crawl_scope(base_url):
+    """
+    Prefix of the links to follow: every hash route of the site for a Docsify base URL
+    (`https://host/#/...`), else the folder of the base URL.
+    """
+    parts = urlsplit(base_url)
+    if parts.fragment.startswith("/"):
+        return f"{parts.scheme}://{parts.netloc}/#/"
+    return base_url.rsplit("/", 1)[0] + "/"
+
+def normalize_url(url):
+    # Docsify's in-page anchors (`#/page?id=section`) and plain fragments are the same page
+    if "/#/" in url:
+        return url.split("?id=", 1)[0]
+    return url.split("#", 1)[0]
+
+async def extract_all_internal_links(page, scope):
+    return sorted(set(
+        normalize_url(link) for link in await page.eval_on_selector_all("a[href]", "els => els.map(el => el.href)")
+        if link.startswith(scope)
+    ))
+
+
+class CourseCrawler:
+    """
+    Crawls the course site into markdown pages, `pages` browser pages at a time.
+
+    Parameters
+        `output_dir: str` folder of the markdown pages, `metadata.json` and the crawl state
+        `base_url: str` first page, always rendered; links under its `crawl_scope` are followed
+        `pages: int` browser pages crawling at the same time
+        `timeout_ms: int` most time to wait for the article of a page
+        `block: bool` abort the images, fonts, media and analytics requests
+        `force: bool` render every page again, ignoring the saved ETags and hashes
+    """
+
+    def __init__(self, output_dir, base_url=BASE_URL, pages=4, timeout_ms=10000, block=True, force=False):
+        self.output_dir = output_dir
+        self.base_url = normalize_url(base_url)
+        self.scope = crawl_scope(base_url)
+        self.pages = pages
+        self.timeout_ms = timeout_ms
+        self.block = block
+        self.force = force
+
+        self.state_file = os.path.join(output_dir, STATE_FILENAME)
+        self.state = self.load_state()
+
+        # url -> entry of this crawl (title, filename, downloaded_at, hash, source, links)
+        self.crawled = {}
+        self.seen = set()
+        self.queue = asyncio.Queue()
+        self.stats = {"rendered": 0, "unchanged": 0, "not_modified": 0, "failed": 0, "blocked_requests": 0}
+
+    def load_state(self):
+        if self.force or not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def enqueue(self, url):
+        url = normalize_url(url)
+        if url not in self.seen:
+            self.seen.add(url)
+            self.queue.put_nowait(url)
+
+    async def block_route(self, route):
+        request = route.request
+        if request.resource_type in BLOCKED_RESOURCES or (urlsplit(request.url).hostname or "").endswith(BLOCKED_HOSTS):
+            self.stats["blocked_requests"] += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def revalidate(self, request_context, url):
+        """
+        Returns the saved entry of `url` if its source did not change since the last crawl,
+        asking with its ETag / Last-Modified and else comparing the content hash.
+        """
+        entry = self.state.get(url)
+        if not entry or not entry.get("source") or not os.path.exists(os.path.join(self.output_dir, entry["filename"])):
+            return None
+
+        source = entry["source"]
+        headers = {}
+        if source.get("etag"):
+            headers["If-None-Match"] = source["etag"]
+        if source.get("last_modified"):
+            headers["If-Modified-Since"] = source["last_modified"]
+
+        try:
+            response = await request_context.get(source["url"], headers=headers, fail_on_status_code=False, timeout=self.timeout_ms)
+        except Exception:
+            return None
+
+        if response.status == 304 or (response.ok and digest(await response.body()) == source["hash"]):
+            return entry
+        return None
+
+    async def page_source(self, document, responses):
+        """
+        The response the article was rendered from: the page's markdown on a Docsify site
+        (not `_sidebar.md` and the like), else the HTML document.
+        """
+        markdown = [
+            r for r in responses
+            if r.ok and urlsplit(r.url).path.endswith(".md") and not os.path.basename(urlsplit(r.url).path).startswith("_")
+        ]
+        response = markdown[-1] if markdown else document
+        if response is None or not response.ok:
+            return None
+
+        try:
+            headers = await response.all_headers()
+            body = await response.body()
+        except Exception:
+            return None
+
+        return {"url": response.url, "etag": headers.get("etag"), "last_modified": headers.get("last-modified"), "hash": digest(body)}
+
+    async def visit(self, page, url, responses):
+        print(f"📄 Visiting: {url}")
+
+        responses.clear()
+        await page.evaluate(MARK_STALE_JS, ARTICLE_SELECTOR)
+        document = await page.goto(url, wait_until="domcontentloaded")
+        await page.wait_for_function(ARTICLE_READY_JS, arg=ARTICLE_SELECTOR, timeout=self.timeout_ms)
+        html = await page.inner_html(ARTICLE_SELECTOR)
+
+        title = (await page.title()).split(" - ")[0].strip() or f"page_{len(self.seen)}"
+        filename = f"{sanitize_filename(title)}.md"
+        filepath = os.path.join(self.output_dir, filename)
+        page_hash = digest(html)
+
+        # Re-rendered but identical: the file (and its `downloaded_at`) stays as it is
+        previous = self.state.get(url)
+        if previous and previous["hash"] == page_hash and previous["filename"] == filename and os.path.exists(filepath):
+            downloaded_at = previous["downloaded_at"]
+            self.stats["unchanged"] += 1
+        else:
+            downloaded_at = datetime.now().isoformat()
+            with open(filepath, "w", encoding="utf-8") as f:
+                f.write("---\n")
+                f.write(f'title: "{title}"\n')
+                f.write(f'original_url: "{url}"\n')
+                f.write(f'downloaded_at: "{downloaded_at}"\n')
+                f.write("---\n\n")
+                f.write(md(html))
+            self.stats["rendered"] += 1
+
+        return {
+            "title": title,
+            "filename": filename,
+            "downloaded_at": downloaded_at,
+            "hash": page_hash,
+            "source": await self.page_source(document, responses),
+            "links": await extract_all_internal_links(page, self.scope),
+        }
+
+    async def worker(self, context):
         page = await context.new_page()
-        await crawl_page(page, BASE_URL)
+        responses = []
+        page.on("response", responses.append)
+
+        while True:
+            url = await self.queue.get()
+            # Whatever happens to the page, it is marked done, or `queue.join()` never returns
+            try:
+                try:
+                    # The first page is always rendered: its links (the sidebar) find the new pages
+                    entry = None if self.force or url == self.base_url else await self.revalidate(context.request, url)
+                    if entry is not None:
+                        self.stats["not_modified"] += 1
+                        print(f"⏭️  Not modified: {url}")
+                    else:
+                        entry = await self.visit(page, url, responses)
+                except Exception as e:
+                    print(f"Error loading {url}\n{e}")
+                    self.stats["failed"] += 1
+                    # Keeps what the last crawl got of it, a transient error does not drop the page
+                    entry = self.state.get(url)
+
+                if entry is not None:
+                    self.crawled[url] = entry
+                    # Entries of older state files may have no links saved
+                    for link in entry.get("links", []):
+                        self.enqueue(link)
+            except Exception as e:
+                print(f"Error following the links of {url}\n{e}")
+            finally:
+                self.queue.task_done()
 
-        with open(METADATA_FILE, "w", encoding="utf-8") as f:
+    def save(self):
+        metadata = [
+            {"title": entry["title"], "filename": entry["filename"], "original_url": url, "downloaded_at": entry["downloaded_at"]}
+            for url, entry in sorted(self.crawled.items())
+        ]
+        with open(os.path.join(self.output_dir, "metadata.json"), "w", encoding="utf-8") as f:
             json.dump(metadata, f, indent=2)
 
-        print("\n**************************************************")
-        print(f"Saved {len(metadata)} course pages")
-        print("**************************************************\n")
+        tmp = f"{self.state_file}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.crawled, f, indent=2)
+        os.replace(tmp, self.state_file)
+
+        return metadata
+
+    async def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        started = time.perf_counter()
+
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            context = await browser.new_context()
+            if self.block:
+                await context.route("**/*", self.block_route)
+
+            self.enqueue(self.base_url)
+            workers = [asyncio.create_task(self.worker(context)) for _ in range(self.pages)]
+            await self.queue.join()
+
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+            await browser.close()
+
+        metadata = self.save()
+
+        return {"pages": len(metadata), **self.stats, "seconds": round(time.perf_counter() - started, 2)}
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl the TDS course site into markdown pages")
+    parser.add_argument("output_dir", help="folder of the pages and metadata.json")
+    parser.add_argument("--base-url", default=BASE_URL, help="first page, e.g. a local mirror's")
+    parser.add_argument("--pages", type=int, default=4, help="browser pages crawling at the same time")
+    parser.add_argument("--timeout-ms", type=int, default=10000, help="most time to wait for the article of a page")
+    parser.add_argument("--no-block", action="store_true", help="load images, fonts, media and analytics too")
+    parser.add_argument("--force", action="store_true", help="render every page again")
+    args = parser.parse_args(argv)
+
+    crawler = CourseCrawler(args.output_dir, args.base_url, args.pages, args.timeout_ms, block=not args.no_block, force=args.force)
+    report = await crawler.run()
 
-        await browser.close()
+    print("\n**************************************************")
+    print(f"Saved {report['pages']} course pages")
+    print(json.dumps(report))
+    print("**************************************************\n")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,15 +1,39 @@
+"""
+Scrapers of the TDS Discourse category and of the course content site.
+
+The Discourse scraper is async: topics are scraped `DISCOURSE_CONCURRENCY` at a time over
+one pooled client, posts are asked for `DISCOURSE_POSTS_PER_REQUEST` ids per request (the
+first chunk comes with the topic itself), and every request goes through one token bucket
+that a `429` pauses for the `Retry-After` Discourse asked for. Besides the `/scrap/discourse`
+route, it can be run on its own against `tools/fake_discourse_server.py`:
+
+	python -m tools.fake_discourse_server --port 8766 --rate 20
+	python -m tools.scrapping --base-url http://127.0.0.1:8766 --concurrency 8 --rate 15
+
+By default the scrape is an incremental sync: the watermarks (`bumped_at`, `last_posted_at`,
+`posts_count`) of every topic are kept in `DISCOURSE_CHECKPOINT_DB`, the category listing (most
+recently bumped first) is only read until a page has nothing new, and only topics whose
+watermark moved are fetched again, all their posts, so edits show up as a new `updated_at`.
+The posts added, edited or removed are logged in the checkpoint too, until
+`form_kb(delta=True)` consumes them.
+"""
+
 import json
+import time
+import asyncio
+import argparse
 import os, subprocess
-from time import sleep
 from datetime import datetime
 
 from typing import Optional
 from fastapi import APIRouter, Query
 
-import requests
+import httpx
 from bs4 import BeautifulSoup
 
 from ams.methods import connect_discourse
+from ams.methods.http_client import RETRY_STATUS, retry_delay
+from ams.methods.scrape_checkpoint import ScrapeCheckpoint, getCheckpoint
 from ams.settings import SETTINGS
 
 # ############## [ END IMPORTS ] ##############
@@ -22,8 +46,11 @@ router = APIRouter()
 ***********************************************************
 """
 
-DATE_FROM = datetime(2025, 1, 1)
-DATE_TO = datetime(2025, 4, 14)
+DATE_FROM = datetime.fromisoformat(SETTINGS.DISCOURSE_DATE_FROM)
+DATE_TO = datetime.fromisoformat(SETTINGS.DISCOURSE_DATE_TO)
+
+# Topic fields that change whenever something is posted in (or bumps) a topic
+WATERMARK_FIELDS = ("bumped_at", "last_posted_at", "posts_count")
 
 
 def parse_date(date_str):
@@ -33,124 +60,307 @@ def parse_date(date_str):
 		return datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%SZ")
 
 
-def get_paginated_topics(session: requests.Session, limit: int | None) -> list[dict]:
-	"""
-	Find topics for HARDCODED Category ID "34"
+"""
+Scraped posts are not requested again if a previous run got them but dropped the chain
+somewhere after: each topic's posts are committed to the checkpoint (`getCheckpoint()`,
+SQLite) as soon as the topic is done, and a resumed run starts from there.
+"""
 
-	Parameters
-		`session: requests.Session` active session, obtained from pasting browser cookies into the specified files in the /.auth directory
 
-	Returns
-		`list[dict]` of such topics
+def topic_watermark(topic_dict: dict) -> dict:
+	return {field: topic_dict.get(field) for field in WATERMARK_FIELDS}
+
+
+def is_unchanged(topic_dict: dict, known: dict) -> bool:
+	"""
+	Whether a listed topic has the watermark recorded for it by the last sync.
 	"""
 
-	all_topics = []
-	page_num = 0
+	previous = known.get(str(topic_dict["id"]))
+	return previous is not None and topic_watermark(topic_dict) == topic_watermark(previous)
 
-	print("\n**************************************************")
-	print("In --> get_paginated_topics()")
-	print("**************************************************\n")
 
-	if os.path.exists(f"{SETTINGS.OUTPUT_FOLDER_D_CONTENT}/__discourse_topics.json"):
-		print("LOADING TOPICS FROM FILE...")
-		return json.loads(open(f"{SETTINGS.OUTPUT_FOLDER_D_CONTENT}/__discourse_topics.json", 'r').read())
+class TokenBucket:
+	"""
+	Async token bucket shared by every request to Discourse.
 
-	while True:
-		url = f"{SETTINGS.DISCOURSE_URL}/c/courses/tds-kb/34.json?page={page_num}"
-		res = session.get(url)
-		data = res.json()
+	Tokens refill at `rate` per second up to `burst`, and each request takes one. A `429`
+	pauses the whole bucket for the time Discourse asked for, so the other topics back off
+	too instead of running into the limit one after another.
 
-		print("GETTING FOR: page ", page_num)
+	Parameters:
+		rate (float): Requests per second; 0 for no limit.
+		burst (int): Tokens the bucket holds when full.
+	"""
 
-		topics = data.get("topic_list", {}).get("topics", [])
+	def __init__(self, rate: float = SETTINGS.DISCOURSE_RATE, burst: int = SETTINGS.DISCOURSE_BURST) -> None:
+		self.rate			=	rate
+		self.capacity		=	max(1, burst)
+		self.tokens			=	float(self.capacity)
+		self.updated		=	time.monotonic()
+		self.paused_until	=	0.0
 
-		if not topics:
-			break
+		self._lock			=	asyncio.Lock()
 
-		all_topics.extend(topics)
-		page_num += 1
+	async def acquire(self) -> None:
+		# Waiters queue on the lock, so requests are let through in arrival order
+		async with self._lock:
+			while True:
+				now = time.monotonic()
 
-		if ((limit is not None) and (page_num >= limit)):
-			break
+				if now < self.paused_until:
+					await asyncio.sleep(self.paused_until - now)
+					continue
 
-	print("\n**************************************************")
-	print(f"Found {len(all_topics)} topics in category 34")
-	print("**************************************************\n")
-	
-	json.dump(all_topics, open(f"{SETTINGS.OUTPUT_FOLDER_D_CONTENT}/__discourse_topics.json", "w", encoding="utf-8"))
-	
-	return all_topics
+				if self.rate <= 0:
+					return
 
-"""
-This block of code will help you not calling the embedding API if previously have called
-but due to some run-down it drops the chain.
+				self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
 
-What it does is that, after each good response from the API, it store the data into the `saved_posts`
-with keys as the `post_id` and after a bunch of 50 (as I have specified) it stores it into the
-`SETTINGS.TEMP_DISCOURSE_JSON` file.
-"""
-if os.path.exists(SETTINGS.TEMP_DISCOURSE_JSON):
-	with open(SETTINGS.TEMP_DISCOURSE_JSON, "r", encoding="utf-8") as f:
-		saved_posts = json.load(f)
-else:
-	saved_posts = {}
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
 
-# Ensure it's a dict (keyed by post_id)
-if isinstance(saved_posts, list):
-	saved_posts = {str(p["post_id"]): p for p in saved_posts}
+				await asyncio.sleep((1 - self.tokens) / self.rate)
 
+	def pause(self, seconds: float) -> None:
+		"""
+		Lets no request through for `seconds`, and restarts from an empty bucket afterwards.
+		"""
 
-def fetch_posts_for_topic(session: requests.Session, topic_dict: dict) -> list[dict]:
-	"""
-	Find posts related to the topic for HARDCODED Category ID "34"
+		self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+		self.tokens = 0.0
+		self.updated = self.paused_until
 
-	Parameters
-		`session: requests.Session` active session, obtained from pasting browser cookies into the specified files in the /.auth directory
-		`topic_dict: dict` the topic details for which the posts have to be fetched
 
-	Returns
-		`list[dict]` of such posts
+def _throttle_delay(attempt: int, response: httpx.Response | None) -> float:
 	"""
+	`Retry-After` of a response, else the `wait_seconds` Discourse puts in its `429` body,
+	else exponential backoff.
+	"""
+
+	if response is not None and response.status_code == 429 and not response.headers.get("Retry-After"):
+		try:
+			return max(0.0, float(response.json()["extras"]["wait_seconds"]))
+		except (ValueError, KeyError, TypeError):
+			pass
+
+	return retry_delay(attempt, response)
 
+
+def make_post_record(topic_dict: dict, post: dict, plain_text: str) -> dict:
 	topic_id = topic_dict["id"]
-	topic_title = topic_dict["title"]
-	topic_tags = topic_dict["tags"]
 
-	stream_ids = session.get(f"{SETTINGS.DISCOURSE_URL}/t/{topic_id}.json").json()['post_stream']['stream']
-	extracted_posts = []
+	return {
+		"topic_id": topic_id,
+		"topic_title": topic_dict["title"],
+		"tags": topic_dict["tags"],
+		"post_id": post["id"],
+		"post_number": post["post_number"],
+		"author": post["username"],
+		"created_at": post["created_at"],
+		"updated_at": post["updated_at"],
+		"reply_to_post_number": post.get("reply_to_post_number"),
+		"reply_count": post.get("reply_count", 0),
+		"url": f"{SETTINGS.DISCOURSE_URL}/t/{topic_id}/posts.json?post_ids[]={post['id']}&include_suggested=false",
+		"content": plain_text,
+	}
+
+
+class DiscourseScraper:
+	"""
+	Concurrent scraper of the TDS Discourse category over one pooled client.
+
+	Parameters:
+		client (httpx.AsyncClient): Authenticated client with the Discourse base URL, see
+			`connect_discourse.create_async_client_with_browser_cookies`.
+		checkpoint (ScrapeCheckpoint): Store of the posts scraped so far; the shared one by default.
+		concurrency (int): Topics scraped at the same time.
+		rate (float): Requests per second allowed.
+		burst (int): Requests allowed back to back.
+		posts_per_request (int): Post ids asked for per `posts.json` request.
+		max_retries (int): Attempts after the first one for a throttled or failed request.
+	"""
 
-	timer = 0
+	def __init__(
+		self
+		, client				:	httpx.AsyncClient
+		, checkpoint			:	ScrapeCheckpoint | None	=	None
+		, concurrency			:	int		=	SETTINGS.DISCOURSE_CONCURRENCY
+		, rate					:	float	=	SETTINGS.DISCOURSE_RATE
+		, burst					:	int		=	SETTINGS.DISCOURSE_BURST
+		, posts_per_request		:	int		=	SETTINGS.DISCOURSE_POSTS_PER_REQUEST
+		, max_retries			:	int		=	SETTINGS.DISCOURSE_MAX_RETRIES
+	) -> None:
+		self.client				=	client
+		self.checkpoint			=	checkpoint or getCheckpoint()
+		self.concurrency		=	max(1, concurrency)
+		self.bucket				=	TokenBucket(rate, burst)
+		self.posts_per_request	=	max(1, posts_per_request)
+		self.max_retries		=	max_retries
 
-	for post_id in stream_ids:
-		if timer > 50:
-			n = 5
-			with open(SETTINGS.TEMP_DISCOURSE_JSON, "w", encoding="utf-8") as f:
-				json.dump(saved_posts, f, indent=2, ensure_ascii=False)
-			print(f"SAVED TO {SETTINGS.TEMP_DISCOURSE_JSON} FILE")
-			print(f'SLEEPING FOR {n} SECONDS')
+		self.stats = {"requests": 0, "throttled": 0, "retries": 0, "failed": 0}
 
-			sleep(n)
-			timer = 0
+		# Posts new or edited since the checkpoint, and saved posts no longer in their topic
+		self.changed	:	int		=	0
+		self.removed	:	int		=	0
 
-		post_url = f"{SETTINGS.DISCOURSE_URL}/t/{topic_id}/posts.json?post_ids[]={post_id}&include_suggested=false"
+	async def get_json(self, path: str, params: dict | None = None) -> dict:
+		"""
+		GETs a Discourse JSON endpoint through the rate limiter, retrying `429`/5xx and network errors.
+		"""
 
-		if str(post_id) in saved_posts:
-			print(f"Skipping Post ID {post_id} — already saved")
-			continue
+		attempt = 0
 
-		try:
-			print(f"Fetching Post ID: {post_id}")
-			response = session.get(post_url)
-			response.raise_for_status()
-			post_data = response.json()
+		while True:
+			await self.bucket.acquire()
+			self.stats["requests"] += 1
+			response = None
+
+			try:
+				response = await self.client.get(path, params=params)
+
+				if response.status_code not in RETRY_STATUS:
+					response.raise_for_status()
+					return response.json()
+
+			except httpx.TransportError as e:
+				print(f"[Discourse] network error: {type(e).__name__} {e}")
+
+			if attempt >= self.max_retries:
+				raise RuntimeError(f"GET {path} failed after {attempt + 1} attempts (last status: {response.status_code if response is not None else 'n/a'})")
 
-			posts = post_data.get("post_stream", {}).get("posts")
-			if not posts:
+			delay = _throttle_delay(attempt, response)
+
+			if response is not None and response.status_code == 429:
+				self.stats["throttled"] += 1
+				print(f"[Discourse] throttled, pausing every request for {delay:.1f}s")
+				self.bucket.pause(delay)
+			else:
+				await asyncio.sleep(delay)
+
+			self.stats["retries"] += 1
+			attempt += 1
+
+	async def get_paginated_topics(self, limit: int | None, refresh: bool = False, known: dict | None = None) -> list[dict]:
+		"""
+		Find topics for HARDCODED Category ID "34"
+
+		Parameters
+			`limit: int | None` most title pages to read
+			`refresh: bool` read the listing again instead of the topics saved by an earlier run
+			`known: dict | None` watermarks of the last sync: the listing is ordered by last
+			activity, so it stops after the first page where no (unpinned) topic changed
+
+		Returns
+			`list[dict]` of such topics
+		"""
+
+		all_topics = []
+		page_num = 0
+
+		print("\n**************************************************")
+		print("In --> get_paginated_topics()")
+		print("**************************************************\n")
+
+		if not refresh and os.path.exists(f"{SETTINGS.OUTPUT_FOLDER_D_CONTENT}/__discourse_topics.json"):
+			print("LOADING TOPICS FROM FILE...")
+			return json.loads(open(f"{SETTINGS.OUTPUT_FOLDER_D_CONTENT}/__discourse_topics.json", 'r').read())
+
+		while True:
+			data = await self.get_json("/c/courses/tds-kb/34.json", params={"page": page_num})
+
+			print("GETTING FOR: page ", page_num)
+
+			topics = data.get("topic_list", {}).get("topics", [])
+
+			if not topics:
+				break
+
+			all_topics.extend(topics)
+			page_num += 1
+
+			if known is not None:
+				unpinned = [topic for topic in topics if not topic.get("pinned")]
+				if unpinned and all(is_unchanged(topic, known) for topic in unpinned):
+					print("NO CHANGES PAST THIS PAGE")
+					break
+
+			if ((limit is not None) and (page_num >= limit)):
+				break
+
+		print("\n**************************************************")
+		print(f"Found {len(all_topics)} topics in category 34")
+		print("**************************************************\n")
+
+		os.makedirs(SETTINGS.OUTPUT_FOLDER_D_CONTENT, exist_ok=True)
+		json.dump(all_topics, open(f"{SETTINGS.OUTPUT_FOLDER_D_CONTENT}/__discourse_topics.json", "w", encoding="utf-8"))
+
+		return all_topics
+
+	async def fetch_posts_for_topic(self, topic_dict: dict, refetch: bool = False, mark: dict | None = None) -> tuple[list[dict], bool]:
+		"""
+		Find posts related to the topic for HARDCODED Category ID "34"
+
+		The topic JSON already carries the first chunk of posts; the rest are fetched
+		`posts_per_request` ids at a time. Posts in the checkpoint are not fetched again,
+		unless `refetch`: then every post is, so that edits (a newer `updated_at`) and
+		deleted posts are noticed. What changed is committed to the checkpoint at the end,
+		together with the topic's watermark `mark` if every request succeeded.
+
+		Parameters
+			`topic_dict: dict` the topic details for which the posts have to be fetched
+			`refetch: bool` fetch the posts already saved as well
+			`mark: dict | None` watermark to record for the topic
+
+		Returns
+			`tuple[list[dict], bool]` the posts, in the order of the topic, and whether every request succeeded
+		"""
+
+		topic_id = topic_dict["id"]
+		saved_posts = await asyncio.to_thread(self.checkpoint.topic_posts, topic_id)
+
+		post_stream = (await self.get_json(f"/t/{topic_id}.json")).get("post_stream", {})
+		stream_ids = post_stream.get("stream", [])
+		posts = {post["id"]: post for post in post_stream.get("posts", [])}
+
+		missing = [post_id for post_id in stream_ids if post_id not in posts and (refetch or post_id not in saved_posts)]
+		batches = [missing[i:i + self.posts_per_request] for i in range(0, len(missing), self.posts_per_request)]
+
+		results = await asyncio.gather(
+			*(
+				self.get_json(f"/t/{topic_id}/posts.json", params={"post_ids[]": batch, "include_suggested": "false"})
+				for batch in batches
+			)
+			, return_exceptions=True
+		)
+
+		complete = True
+
+		for batch, result in zip(batches, results):
+			if isinstance(result, Exception):
+				print(f"Failed to fetch post IDs {batch[0]}..{batch[-1]} of topic {topic_id}: {result}")
+				self.stats["failed"] += len(batch)
+				complete = False
+				continue
+
+			for post in result.get("post_stream", {}).get("posts", []):
+				posts[post["id"]] = post
+
+		extracted_posts, new_posts, changed, removed = [], [], [], []
+
+		for post_id in stream_ids:
+			saved = saved_posts.get(post_id)
+			post = posts.get(post_id)
+
+			if post is None:
+				if saved is not None:
+					extracted_posts.append(saved)
 				continue
 
-			post = posts[0]
-			if post["id"] != post_id:
-				print(f"Warning: ID mismatch for expected {post_id}, got {post['id']}")
+			if saved is not None and saved["updated_at"] == post["updated_at"]:
+				extracted_posts.append(saved)
 				continue
 
 			# Extract text and skip if cooked is empty or whitespace
@@ -159,31 +369,210 @@ def fetch_posts_for_topic(session: requests.Session, topic_dict: dict) -> list[d
 				print(f"Skipping Post ID {post_id} - empty content")
 				continue
 
-			a_post : dict = {
-				"topic_id": topic_id,
-				"topic_title": topic_title,
-				"tags": topic_tags,
-				"post_id": post["id"],
-				"post_number": post["post_number"],
-				"author": post["username"],
-				"created_at": post["created_at"],
-				"updated_at": post["updated_at"],
-				"reply_to_post_number": post.get("reply_to_post_number"),
-				"reply_count": post.get("reply_count", 0),
-				"url": post_url,
-				"content": plain_text,
-			}
+			a_post = make_post_record(topic_dict, post, plain_text)
 
 			extracted_posts.append(a_post)
-			saved_posts[str(post["id"])] = a_post
-	
-			timer += 1
+			new_posts.append(a_post)
+
+			# A new `updated_at` with the same text (e.g. a rebake) changes nothing in the KB
+			if saved is None or saved["content"] != plain_text:
+				changed.append(a_post)
+
+		if refetch and complete:
+			in_stream = set(stream_ids)
+			for post_id, post in saved_posts.items():
+				if post_id not in in_stream:
+					removed.append({"post_id": post["post_id"], "url": post["url"]})
+
+		# In a worker thread: the SQLite commit must not stall the fetches of the other topics
+		await asyncio.to_thread(self.checkpoint.commit_topic, topic_id, new_posts, removed, mark if complete else None, changed)
+
+		self.changed += len(changed)
+		self.removed += len(removed)
+
+		return extracted_posts, complete
+
+	async def scrape_topics(self, topics: list[dict], refetch: set | None = None, marks: dict | None = None) -> list[dict]:
+		"""
+		Scrapes the posts of many topics, `concurrency` at a time, checkpointing each topic once done.
+
+		Parameters
+			`topics: list[dict]` the topics
+			`refetch: set | None` ids of the topics whose saved posts have to be fetched again
+			`marks: dict | None` watermark to record per topic id, for the incremental sync
+
+		Returns
+			`list[dict]` posts of every topic, in the order of `topics`
+		"""
+
+		semaphore = asyncio.Semaphore(self.concurrency)
+
+		async def run(topic: dict) -> list[dict]:
+			async with semaphore:
+				print("GETTING FOR: ", topic.get("slug", topic["id"]))
+
+				try:
+					posts, _ = await self.fetch_posts_for_topic(
+						topic
+						, refetch=refetch is not None and topic["id"] in refetch
+						, mark=marks.get(topic["id"]) if marks else None
+					)
+				except Exception as e:
+					print(f"Failed to fetch topic {topic['id']}: {e}")
+					return []
+
+				return posts
+
+		results = await asyncio.gather(*(run(topic) for topic in topics))
+
+		return [post for posts in results for post in posts]
 
-		except Exception as e:
-			print(f"Failed to fetch post ID {post_id}: {e}")
-			continue
 
-	return extracted_posts
+def discourse_client(concurrency: int = SETTINGS.DISCOURSE_CONCURRENCY) -> httpx.AsyncClient:
+	return connect_discourse.create_async_client_with_browser_cookies(
+		SETTINGS.DISCOURSE_URL,
+		{
+			"_t": SETTINGS.DISCOURSE_AUTH_TOKEN,
+			"_forum_session": SETTINGS.DISCOURSE_SESSION_TOKEN,
+		},  # Credential cookies, Extracted from browser
+		max_connections=2 * concurrency,
+	)
+
+
+async def scrape_discourse(
+	limit_title_pages	:	int | None		=	None
+	, date_from			:	datetime		=	DATE_FROM
+	, date_to			:	datetime		=	DATE_TO
+	, refresh_topics	:	bool			=	False
+	, **scraper_options
+) -> tuple[list[dict], dict]:
+	"""
+	Scrapes the topics of category 34 created between `date_from` and `date_to`
+
+	Parameters
+		`limit_title_pages: int | None` most title pages to read
+		`date_from: datetime`, `date_to: datetime` creation-date window of the topics
+		`refresh_topics: bool` read the category listing again instead of the saved one
+		`scraper_options` overrides of the `DiscourseScraper` parameters
+
+	Returns
+		`tuple[list[dict], dict]` the posts, and a report of the run (`None` posts if the login expired)
+	"""
+
+	started = time.perf_counter()
+
+	async with discourse_client(scraper_options.get("concurrency", SETTINGS.DISCOURSE_CONCURRENCY)) as client:
+		if not await connect_discourse.verify_async_client_authentication(client):
+			return None, {}
+
+		scraper = DiscourseScraper(client, **scraper_options)
+
+		all_topics = await scraper.get_paginated_topics(limit_title_pages, refresh=refresh_topics)
+		topics = [topic for topic in all_topics if date_from <= parse_date(topic["created_at"]) <= date_to]
+
+		posts = await scraper.scrape_topics(topics)
+
+	seconds = time.perf_counter() - started
+
+	report = {
+		"topics": len(topics)
+		, "posts": len(posts)
+		, **scraper.stats
+		, "seconds": round(seconds, 2)
+		, "posts_per_s": round(len(posts) / seconds, 1) if seconds else 0.0
+	}
+
+	return posts, report
+
+
+async def sync_discourse(
+	limit_title_pages	:	int | None		=	None
+	, date_from			:	datetime		=	DATE_FROM
+	, date_to			:	datetime		=	DATE_TO
+	, **scraper_options
+) -> tuple[list[dict], dict]:
+	"""
+	Incremental scrape: only the topics whose watermark moved since the last sync are fetched
+
+	Topics seen for the first time are scraped like in `scrape_discourse` (reusing the
+	checkpoint), topics seen before are fetched whole again to catch edits and deletions.
+	A topic's watermark is only recorded, with its posts, once all of them were fetched, so
+	a failed or interrupted topic is retried by the next sync.
+
+	Parameters
+		`limit_title_pages: int | None` most title pages to read
+		`date_from: datetime`, `date_to: datetime` creation-date window of the topics
+		`scraper_options` overrides of the `DiscourseScraper` parameters
+
+	Returns
+		`tuple[list[dict], dict]` every post of the synced topics in the window, and a report (`None` posts if the login expired)
+	"""
+
+	started = time.perf_counter()
+
+	checkpoint = getCheckpoint()
+	known : dict = await asyncio.to_thread(checkpoint.topics)
+
+	async with discourse_client(scraper_options.get("concurrency", SETTINGS.DISCOURSE_CONCURRENCY)) as client:
+		if not await connect_discourse.verify_async_client_authentication(client):
+			return None, {}
+
+		scraper = DiscourseScraper(client, checkpoint, **scraper_options)
+
+		# A new window may take in old, unchanged topics: the listing is then read to the end
+		window = [date_from.isoformat(), date_to.isoformat()]
+		same_window = await asyncio.to_thread(checkpoint.get_meta, "window") == window
+
+		listed = await scraper.get_paginated_topics(limit_title_pages, refresh=True, known=known if same_window else None)
+		changed, outside = [], {}
+
+		for topic in listed:
+			key = str(topic["id"])
+			in_window = date_from <= parse_date(topic["created_at"]) <= date_to
+
+			if is_unchanged(topic, known) and (known[key]["synced"] or not in_window):
+				continue
+
+			if in_window:
+				changed.append(topic)
+			else:
+				# Remembered too, so that the listing can stop at it next time
+				outside[key] = {**topic_watermark(topic), "created_at": topic["created_at"], "synced": False}
+
+		await asyncio.to_thread(checkpoint.set_topics, outside)
+
+		refetch = {topic["id"] for topic in changed if known.get(str(topic["id"]), {}).get("synced")}
+		marks = {topic["id"]: {**topic_watermark(topic), "created_at": topic["created_at"], "synced": True} for topic in changed}
+
+		print(f"[Discourse] {len(listed)} topics listed | {len(changed)} changed | {len(refetch)} to fetch again")
+
+		await scraper.scrape_topics(changed, refetch=refetch, marks=marks)
+
+	await asyncio.to_thread(checkpoint.set_meta, "window", window)
+	await asyncio.to_thread(checkpoint.set_meta, "synced_at", datetime.now().isoformat(timespec="seconds"))
+
+	delta, _ = await asyncio.to_thread(checkpoint.pending_delta)
+
+	in_window = [
+		int(topic_id) for topic_id, mark in (await asyncio.to_thread(checkpoint.topics)).items()
+		if mark["synced"] and date_from <= parse_date(mark["created_at"]) <= date_to
+	]
+	posts = await asyncio.to_thread(lambda: list(checkpoint.iter_posts(in_window)))
+
+	seconds = time.perf_counter() - started
+
+	report = {
+		"topics_listed": len(listed)
+		, "topics_changed": len(changed)
+		, "posts": len(posts)
+		, "posts_changed": scraper.changed
+		, "posts_removed": scraper.removed
+		, "delta_pending": len(delta["changed"]) + len(delta["removed"])
+		, **scraper.stats
+		, "seconds": round(seconds, 2)
+	}
+
+	return posts, report
 
 
 """
@@ -194,59 +583,47 @@ def fetch_posts_for_topic(session: requests.Session, topic_dict: dict) -> list[d
 
 
 @router.get("/scrap/discourse")
-def scrap_tds_discourse(
+async def scrap_tds_discourse(
 	limit_title_pages: Optional[int] = Query(default=None, description="Optional limit on the number of Discourse title pages to scrape")
+	, incremental: bool = Query(default=True, description="Only fetch the topics with activity since the last sync")
+	, date_from: Optional[str] = Query(default=None, description="Scrape topics created from this date (YYYY-MM-DD), defaults to `DISCOURSE_DATE_FROM`")
+	, date_to: Optional[str] = Query(default=None, description="... up to this date, defaults to `DISCOURSE_DATE_TO`")
+	, refresh_topics: bool = Query(default=False, description="Full scrape only: read the topic listing again instead of the saved one")
 ):
 	"""
 	Requests the IITM TDS Discourse and stores json posts.
 	"""
 
-	session = connect_discourse.create_session_with_browser_cookies(
-		SETTINGS.DISCOURSE_URL,
-		{
-			"_t": SETTINGS.DISCOURSE_AUTH_TOKEN,
-			"_forum_session": SETTINGS.DISCOURSE_SESSION_TOKEN,
-		},  # Credential cookies, Extracted from browser
-	)
-
-	if not connect_discourse.verify_session_authentication(session):
-		return {
-			"error": "Login expired!"
-		}
-
-
-	all_topics = get_paginated_topics(session, limit_title_pages)
-	filtered_posts = []
-
 	print("\n**************************************************")
 	print("In --> scrap_tds_discourse()")
 	print("**************************************************\n")
 
-	for topic in all_topics:
-		created_at = parse_date(topic["created_at"])
+	window_from	=	datetime.fromisoformat(date_from) if date_from else DATE_FROM
+	window_to	=	datetime.fromisoformat(date_to) if date_to else DATE_TO
 
-		if DATE_FROM <= created_at <= DATE_TO:
-			print("GETTING FOR: ", topic["slug"])
+	if incremental:
+		filtered_posts, report = await sync_discourse(limit_title_pages, window_from, window_to)
+	else:
+		filtered_posts, report = await scrape_discourse(limit_title_pages, window_from, window_to, refresh_topics)
 
-			posts = fetch_posts_for_topic(session, topic)
-			filtered_posts.extend(posts)
-			
-			with open("./after-each-topic-saved.json", "w", encoding="utf-8") as f:
-				json.dump(saved_posts, f, ensure_ascii=False)
+	if filtered_posts is None:
+		return {
+			"error": "Login expired!"
+		}
 
-	# os.makedirs(SETTINGS.OUTPUT_FOLDER_D_CONTENT, exist_ok=True)
+	os.makedirs(SETTINGS.OUTPUT_FOLDER_D_CONTENT, exist_ok=True)
 
 	with open(f"{SETTINGS.OUTPUT_FOLDER_D_CONTENT}/discourse_posts.json", "w", encoding="utf-8") as f:
-	# with open("thePOST.json", "w", encoding="utf-8") as f:
 		json.dump(filtered_posts, f, indent=4, ensure_ascii=False)
 
 	print("\n**************************************************")
 	print(
-		f"Scraped {len(filtered_posts)} posts of IIT-M Discourse from {DATE_FROM.date()} to {DATE_TO.date()}"
+		f"Scraped {len(filtered_posts)} posts of IIT-M Discourse from {window_from.date()} to {window_to.date()}"
 	)
+	print(json.dumps(report))
 	print("**************************************************\n")
 
-	return {"message": f"IIT-M Discourse from {DATE_FROM.date()} to {DATE_TO.date()} has been scraped", "post_length": len(filtered_posts)}
+	return {"message": f"IIT-M Discourse from {window_from.date()} to {window_to.date()} has been scraped", "post_length": len(filtered_posts), "report": report}
 
 
 @router.get("/scrap/content")
@@ -271,3 +648,38 @@ def scrap_tds_content():
 	print("WAIT THE SCRIPT IS DOING ITS WORK!!!!!")
 
 	return {"message": f"Internal seprate python script had run, pls ckeck the folder {SETTINGS.OUTPUT_FOLDER_C_CONTENT}"}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Scrape the TDS Discourse category, or benchmark the scraper against the fake server")
+	parser.add_argument("--base-url", default=None, help="Discourse base URL, e.g. the fake server's")
+	parser.add_argument("--limit-pages", type=int, default=None, help="most title pages to read")
+	parser.add_argument("--concurrency", type=int, default=SETTINGS.DISCOURSE_CONCURRENCY)
+	parser.add_argument("--rate", type=float, default=SETTINGS.DISCOURSE_RATE, help="requests per second, 0 for no limit")
+	parser.add_argument("--burst", type=int, default=SETTINGS.DISCOURSE_BURST)
+	parser.add_argument("--posts-per-request", type=int, default=SETTINGS.DISCOURSE_POSTS_PER_REQUEST)
+	parser.add_argument("--date-from", default=SETTINGS.DISCOURSE_DATE_FROM)
+	parser.add_argument("--date-to", default=SETTINGS.DISCOURSE_DATE_TO)
+	parser.add_argument("--full", action="store_true", help="scrape every topic of the window instead of syncing the changed ones")
+	parser.add_argument("--refresh-topics", action="store_true", help="with --full: read the topic listing again")
+	args = parser.parse_args()
+
+	if args.base_url:
+		SETTINGS.DISCOURSE_URL = args.base_url.rstrip('/')
+
+	options = dict(concurrency=args.concurrency, rate=args.rate, burst=args.burst, posts_per_request=args.posts_per_request)
+	window = (datetime.fromisoformat(args.date_from), datetime.fromisoformat(args.date_to))
+
+	if args.full:
+		posts, report = asyncio.run(scrape_discourse(args.limit_pages, *window, args.refresh_topics, **options))
+	else:
+		posts, report = asyncio.run(sync_discourse(args.limit_pages, *window, **options))
+
+	if posts is None:
+		print("Login expired!")
+	else:
+		os.makedirs(SETTINGS.OUTPUT_FOLDER_D_CONTENT, exist_ok=True)
+		with open(f"{SETTINGS.OUTPUT_FOLDER_D_CONTENT}/discourse_posts.json", "w", encoding="utf-8") as f:
+			json.dump(posts, f, indent=4, ensure_ascii=False)
+
+		print(json.dumps(report, indent=2))